@@ -0,0 +1,362 @@
+import config
+import json
+import gzip
+import time
+import asyncio
+import hashlib
+import threading
+import importlib.util
+from collections import OrderedDict, namedtuple
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import urlsplit, parse_qs
+import numpy as np
+import pandas as pd
+
+# Arrow responses need pyarrow; it is only imported when one is requested
+ARROW_AVAILABLE = importlib.util.find_spec('pyarrow') is not None
+ARROW_TYPE = 'application/vnd.apache.arrow.stream'
+JSON_TYPE = 'application/json'
+
+# Bodies smaller than this are not worth gzipping
+GZIP_MIN_BYTES = 1024
+
+# One served dataset: the data, its content hash and when that last changed
+Dataset = namedtuple('Dataset', ['data', 'digest', 'last_modified'])
+
+STATUS_TEXT = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 406: 'Not Acceptable', 503: 'Service Unavailable'}
+
+# --- Encoding ---
+def _digest(data):
+    """
+    Content hash of a dataset: row hashes plus column names for frames, canonical JSON otherwise.
+    """
+    hasher = hashlib.blake2b(digest_size=8)
+    if isinstance(data, pd.DataFrame):
+        hasher.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+        hasher.update(repr((list(data.columns), [str(t) for t in data.dtypes])).encode())
+    else:
+        hasher.update(_json_bytes(data))
+    return hasher.hexdigest()
+
+def _jsonable(value):
+    """
+    Plain JSON types for metric values: NaN/inf/NaT as null, timestamps and durations in ISO 8601, frames as records.
+    """
+    if isinstance(value, dict):
+        return {str(key): _jsonable(item) for key, item in value.items()}
+    if isinstance(value, pd.DataFrame):
+        return [_jsonable(row) for row in value.to_dict(orient='records')]
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(item) for item in value]
+    if value is pd.NaT:
+        return None
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return pd.Timestamp(value).isoformat()
+    if isinstance(value, (pd.Timedelta, np.timedelta64)):
+        return pd.Timedelta(value).isoformat()
+    if isinstance(value, (float, np.floating)):
+        return float(value) if np.isfinite(value) else None
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.bool_):
+        return bool(value)
+    return value
+
+def _json_bytes(data):
+    if isinstance(data, pd.DataFrame):
+        return data.to_json(orient='split', date_format='iso', double_precision=15).encode('utf-8')
+    return json.dumps(_jsonable(data), separators=(',', ':'), allow_nan=False).encode('utf-8')
+
+def _arrow_bytes(df):
+    import pyarrow as pa
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def select(data, start=None, end=None, columns=None):
+    """
+    Date range (on a DatetimeIndex) and column selection. Raises ValueError on bad parameters.
+    """
+    if not isinstance(data, pd.DataFrame):
+        if start or end or columns:
+            raise ValueError("Date range and column selection only apply to tables")
+        return data
+    if start or end:
+        if not isinstance(data.index, pd.DatetimeIndex):
+            raise ValueError("This table has no date index")
+        data = data.loc[pd.Timestamp(start) if start else None:pd.Timestamp(end) if end else None]
+    if columns:
+        unknown = [col for col in columns if col not in data.columns]
+        if unknown:
+            raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+        data = data[columns]
+    return data
+
+# --- State ---
+class ApiState:
+    """
+    The datasets the API serves and a cache of their encoded responses.
+    update() only replaces (and invalidates the cached responses of) datasets
+    whose content changed, so ETags and Last-Modified stay stable otherwise.
+    The full JSON of each dataset is encoded up front, outside the lock.
+    """
+    def __init__(self, cache_entries=config.API_CACHE_ENTRIES):
+        self.datasets = {}
+        self.cache_entries = cache_entries
+        self._responses = OrderedDict()
+        self._lock = threading.Lock()
+
+    def update(self, **datasets):
+        changed = []
+        for name, data in datasets.items():
+            if data is None:
+                continue
+            digest = _digest(data)
+            current = self.datasets.get(name)
+            if current is not None and current.digest == digest:
+                continue
+            dataset = Dataset(data, digest, time.time())
+            prebuilt = {(name, digest, None, None, (), 'json', gz): self._encode(dataset, None, None, (), 'json', gz) for gz in (False, True)}
+            with self._lock:
+                for key in [key for key in self._responses if key[0] == name]:
+                    del self._responses[key]
+                self.datasets[name] = dataset
+                self._responses.update(prebuilt)
+            changed.append(name)
+        return changed
+
+    def update_from_run(self, df_history, metrics, results, portfolio_tracker):
+        """
+        Publish a pipeline run: the daily portfolio, weights, holdings,
+        allocation, risk, trailing returns, rolling risk and return stats and metrics.
+        """
+        _, df_alloc, _, _, current_values, current_holdings = results['allocation']
+        holdings = pd.DataFrame({'Quantity': pd.Series(current_holdings, dtype=float), 'Value': pd.Series(current_values, dtype=float)}).rename_axis('Symbol')
+        holdings['Weight'] = holdings['Value'] / df_history['Total_Equity'].iloc[-1]
+
+        returns = df_history['Daily_Return']
+        excess = returns - df_history.get('Risk_Free_Rate_Daily', 0)
+        rolling = results['rolling_var'][0].copy()
+        for window in config.QUANT_WINDOW:
+            volatility = returns.rolling(window).std() * np.sqrt(252)
+            rolling[f'Volatility_{window}'] = volatility
+            rolling[f'Sharpe_{window}'] = excess.rolling(window).mean() * 252 / volatility
+            rolling[f'MWR_{window}'] = results['rolling_irr'][f'{window}d']
+
+        return self.update(
+            portfolio=df_history,
+            weights=getattr(portfolio_tracker, 'historical_weights', None),
+            holdings=holdings,
+            allocation=df_alloc,
+            risk=results['risk_decomposition'][1],
+            trailing_returns=results['period_returns'][1],
+            rolling=rolling,
+            metrics=metrics,
+        )
+
+    def _encode(self, dataset, start, end, columns, fmt, gz):
+        """
+        (headers, body) for one representation of a dataset.
+        """
+        data = select(dataset.data, start, end, list(columns))
+        if fmt == 'arrow':
+            body, content_type = _arrow_bytes(data), ARROW_TYPE
+        else:
+            body, content_type = _json_bytes(data), JSON_TYPE
+        headers = [('Content-Type', content_type)]
+        if gz and len(body) >= GZIP_MIN_BYTES:
+            body = gzip.compress(body, compresslevel=6, mtime=0)
+            headers.append(('Content-Encoding', 'gzip'))
+        return headers, body
+
+    def get(self, name, start, end, columns, fmt, gz):
+        """
+        The dataset and its encoded (headers, body), cached per version and query.
+        Raises KeyError for an unknown dataset and ValueError for bad parameters.
+        """
+        dataset = self.datasets[name]
+        key = (name, dataset.digest, start, end, tuple(columns), fmt, gz)
+        with self._lock:
+            cached = self._responses.get(key)
+            if cached is not None:
+                self._responses.move_to_end(key)
+                return dataset, cached
+        encoded = self._encode(dataset, start, end, columns, fmt, gz)
+        with self._lock:
+            self._responses[key] = encoded
+            while len(self._responses) > self.cache_entries:
+                self._responses.popitem(last=False)
+        return dataset, encoded
+
+    def index(self):
+        return {name: {'etag': dataset.digest, 'last_modified': formatdate(dataset.last_modified, usegmt=True),
+                       'rows': len(dataset.data) if isinstance(dataset.data, pd.DataFrame) else None,
+                       'columns': [str(col) for col in dataset.data.columns] if isinstance(dataset.data, pd.DataFrame) else None}
+                for name, dataset in self.datasets.items()}
+
+# --- HTTP ---
+class ApiServer:
+    """
+    Minimal HTTP/1.1 server (GET/HEAD, keep-alive) on asyncio streams:
+
+        GET /api                                 datasets with their ETag, rows and columns
+        GET /api/<name>[.json|.arrow]            ?start=YYYY-MM-DD&end=...&columns=a,b&format=json|arrow
+
+    Responses carry ETag/Last-Modified (answered with 304 when unchanged) and are
+    gzipped when the client accepts it. Binds to localhost by default.
+    """
+    def __init__(self, state, host=config.API_HOST, port=config.API_PORT):
+        self.state = state
+        self.host = host
+        self.port = port
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._bind_error = None
+        self._date_second = None
+        self._date_header = b''
+
+    def _date(self):
+        now = int(time.time())
+        if now != self._date_second:
+            self._date_second = now
+            self._date_header = f"Date: {formatdate(now, usegmt=True)}\r\n".encode()
+        return self._date_header
+
+    def _response(self, status, headers=(), body=b'', head=False, keep_alive=True):
+        lines = [f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n".encode(), self._date()]
+        lines += [f"{key}: {value}\r\n".encode() for key, value in headers]
+        lines.append(f"Content-Length: {len(body)}\r\n{'' if keep_alive else 'Connection: close' + chr(13) + chr(10)}\r\n".encode())
+        if not head:
+            lines.append(body)
+        return b''.join(lines)
+
+    def _error(self, status, message, head=False, keep_alive=True):
+        return self._response(status, [('Content-Type', JSON_TYPE)], json.dumps({'error': message}).encode(), head, keep_alive)
+
+    def respond(self, method, target, headers, keep_alive=True):
+        """
+        The full response bytes for one request.
+        """
+        head = method == 'HEAD'
+        if method not in ('GET', 'HEAD'):
+            return self._error(405, f"{method} not allowed", keep_alive=keep_alive)
+
+        url = urlsplit(target)
+        path = url.path.rstrip('/')
+        if path in ('', '/api'):
+            return self._response(200, [('Content-Type', JSON_TYPE), ('Cache-Control', 'no-cache')], _json_bytes(self.state.index()), head, keep_alive)
+        if not path.startswith('/api/'):
+            return self._error(404, f"No route {url.path}", head, keep_alive)
+
+        name = path[len('/api/'):]
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        fmt = query.get('format')
+        if name.endswith(('.json', '.arrow')):
+            name, fmt = name.rsplit('.', 1)
+        if fmt is None:
+            fmt = 'arrow' if ARROW_TYPE in headers.get('accept', '') else 'json'
+        if fmt not in ('json', 'arrow'):
+            return self._error(400, f"Unknown format {fmt}", head, keep_alive)
+        if fmt == 'arrow' and not ARROW_AVAILABLE:
+            return self._error(406, "Arrow responses need the pyarrow package", head, keep_alive)
+        if not self.state.datasets:
+            return self._error(503, "No data published yet", head, keep_alive)
+
+        columns = [col for col in query.get('columns', '').split(',') if col]
+        gz = 'gzip' in headers.get('accept-encoding', '')
+        try:
+            dataset, (content_headers, body) = self.state.get(name, query.get('start'), query.get('end'), columns, fmt, gz)
+        except KeyError:
+            return self._error(404, f"Unknown dataset {name} (available: {', '.join(self.state.datasets)})", head, keep_alive)
+        except (ValueError, TypeError) as e:
+            return self._error(400, str(e), head, keep_alive)
+
+        # Validators: one ETag per dataset version, query, format and encoding
+        variant = hashlib.blake2b(repr((query.get('start'), query.get('end'), columns, fmt)).encode(), digest_size=4).hexdigest()
+        gzipped = ('Content-Encoding', 'gzip') in content_headers
+        etag = f'"{dataset.digest}-{variant}{"-gz" if gzipped else ""}"'
+        last_modified = formatdate(dataset.last_modified, usegmt=True)
+        validators = [('ETag', etag), ('Last-Modified', last_modified), ('Cache-Control', 'no-cache'), ('Vary', 'Accept, Accept-Encoding')]
+
+        if_none_match = headers.get('if-none-match')
+        if if_none_match is not None:
+            not_modified = if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+        else:
+            try:
+                not_modified = 'if-modified-since' in headers and int(dataset.last_modified) <= parsedate_to_datetime(headers['if-modified-since']).timestamp()
+            except (TypeError, ValueError):
+                not_modified = False
+        if not_modified:
+            return self._response(304, validators, head=True, keep_alive=keep_alive)
+        return self._response(200, content_headers + validators, body, head, keep_alive)
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                request_line, *header_lines = head.decode('latin-1').split('\r\n')
+                try:
+                    method, target, version = request_line.split(' ', 2)
+                except ValueError:
+                    writer.write(self._error(400, "Malformed request line", keep_alive=False))
+                    break
+                headers = {}
+                for line in header_lines:
+                    key, _, value = line.partition(':')
+                    if key:
+                        headers[key.strip().lower()] = value.strip()
+                if headers.get('content-length', '0') != '0':
+                    await reader.readexactly(int(headers['content-length'])) # Bodies are ignored
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+
+                writer.write(self.respond(method, target, headers, keep_alive))
+                if writer.transport.get_write_buffer_size() > 1 << 16:
+                    await writer.drain()
+                if not keep_alive:
+                    break
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        self._loop = asyncio.get_running_loop()
+        try:
+            self._server = await asyncio.start_server(self._handle, self.host, self.port, limit=1 << 16)
+            self.port = self._server.sockets[0].getsockname()[1] # When bound to port 0
+        except Exception as e: # E.g. the port is in use; start() re-raises it in the caller
+            self._bind_error = e
+            return
+        finally:
+            self._ready.set()
+        print(f"🌐 Serving the portfolio API on http://{self.host}:{self.port}/api")
+        async with self._server:
+            try:
+                await self._server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+
+    def start(self):
+        """
+        Serve from a background thread (its own event loop); returns once
+        listening, or raises the error that kept the server from binding.
+        """
+        self._thread = threading.Thread(target=asyncio.run, args=(self.serve(),), name='api', daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._bind_error is not None:
+            self._thread.join()
+            raise self._bind_error
+        return self
+
+    def stop(self):
+        if self._loop is not None and self._server is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+        if self._thread is not None:
+            self._thread.join(timeout=5)
@@ -0,0 +1,266 @@
+import config
+import os
+import time
+import argparse
+import concurrent.futures
+from datetime import datetime
+from functools import partial
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+
+import portfolio_tracker as tracker
+
+# One what-if run. rule(trades, panel, fee, dividend_tax) returns the trades to replay (None
+# replays the actual ones); it must be a module-level function or a partial of one, so it can
+# be sent to the workers. symbols: symbols it trades beyond the book's. fee: (fixed, rate)
+# re-prices every buy/sell as fixed + rate * amount (None keeps the trades' own fees)
+Variant = namedtuple('Variant', ['name', 'rule', 'symbols', 'dividend_tax', 'fee'], defaults=(None, (), config.DIVIDEND_TAX_RATE, None))
+
+# Annual risk-free rate for the variants' Sharpe ratios (the analyzer's fallback when ^IRX is unavailable)
+RISK_FREE_RATE = 0.04
+
+# --- Variants ---
+def actual(name='Actual', dividend_tax=config.DIVIDEND_TAX_RATE, fee=None):
+    """
+    The trades as they happened, e.g. with other fees or dividend tax.
+    """
+    return Variant(name, None, (), dividend_tax, fee)
+
+def dca(symbol, name=None, dividend_tax=config.DIVIDEND_TAX_RATE, fee=None):
+    """
+    Every deposit invested in one symbol the day it arrives (withdrawals sold from it).
+    """
+    return Variant(name or f"DCA {symbol}", partial(_dca, symbol=symbol), (symbol,), dividend_tax, fee)
+
+def rebalance(weights, name=None, freq='M', dividend_tax=config.DIVIDEND_TAX_RATE, fee=None):
+    """
+    The same deposits and withdrawals, held at target weights ({symbol: weight})
+    and rebalanced on the first weekday of each period (pandas frequency) and
+    on every deposit or withdrawal.
+    """
+    weights = {symbol: weight for symbol, weight in weights.items() if weight > 0}
+    return Variant(name or f"Rebalance {freq} " + ' / '.join(f"{symbol} {weight:.0%}" for symbol, weight in weights.items()),
+                   partial(_rebalance, weights=weights, freq=freq), tuple(weights), dividend_tax, fee)
+
+# --- Rules ---
+def _cash_flows(trades_df):
+    return trades_df[(trades_df['SYMBOL'].astype(str) == 'CASH') & trades_df['BUY/SELL'].astype(str).isin(['DEPOSIT', 'WITHDRAW'])]
+
+def _fee(amount, fee):
+    fixed, rate = fee or (0.0, 0.0)
+    return fixed + rate * amount
+
+def _orders(rows):
+    """
+    Trades frame in the ledger's columns from (date, symbol, buy/sell, qty, price, fee) rows.
+    """
+    df = pd.DataFrame(rows, columns=['DATE', 'SYMBOL', 'BUY/SELL', 'QTY', 'PRICE', 'FEE'])
+    df['AMT'] = df['QTY'] * df['PRICE']
+    return df
+
+def _dca(trades_df, panel, fee, dividend_tax, symbol):
+    """
+    Buys with each day's net deposits (after the fee), sells enough to cover
+    withdrawals. Dividends stay in cash.
+    """
+    flows = _cash_flows(trades_df)
+    column = panel.symbols.index(symbol)
+    fixed, rate = fee or (0.0, 0.0)
+    day = panel.dates.get_indexer(pd.DatetimeIndex(flows['DATE']))
+    change = np.where(flows['BUY/SELL'].astype(str) == 'DEPOSIT', flows['AMT'] - flows['FEE'], -(flows['AMT'] + flows['FEE']))
+    daily_change = pd.Series(change).groupby(day).sum()
+
+    rows, cash, held, last = [], 0.0, 0.0, 0
+    for i, amount in daily_change[daily_change.index >= 0].items():
+        held *= np.prod(panel.split_ratio[last:i, column]) # Splits since the last flow, as the engine applies them
+        last = i
+        cash += amount
+        price = panel.close[i, column]
+        if not price > 0: # No prices yet: the cash waits for the next flow
+            continue
+        if cash > fixed:
+            qty = (cash - fixed) / (price * (1 + rate))
+            rows.append((panel.dates[i], symbol, 'BUY', qty, price, _fee(qty * price, fee)))
+            held += qty
+            cash -= qty * price + rows[-1][-1]
+        elif cash < 0 and held > 0:
+            qty = min((fixed - cash) / (price * (1 - rate)), held)
+            rows.append((panel.dates[i], symbol, 'SELL', qty, price, _fee(qty * price, fee)))
+            held -= qty
+            cash += qty * price - rows[-1][-1]
+    return pd.concat([flows, _orders(rows)], ignore_index=True).sort_values('DATE', kind='stable')
+
+def _rebalance(trades_df, panel, fee, dividend_tax, weights, freq='M'):
+    """
+    Steps through the days with a flow, a rebalance, a split or a dividend,
+    keeping holdings and cash the way tracker.reconstruct will replay them.
+    """
+    flows = _cash_flows(trades_df)
+    columns = [panel.symbols.index(symbol) for symbol in weights]
+    target = np.array(list(weights.values()))
+    close, split_ratio = panel.close[:, columns], panel.split_ratio[:, columns]
+    tax = np.array([0.0 if symbol in config.NO_DIVIDEND_TAX else dividend_tax for symbol in weights])
+    net_dividend = panel.dividend[:, columns] * (1 - tax)
+
+    flow_day = panel.dates.get_indexer(pd.DatetimeIndex(flows['DATE']))
+    change = np.zeros(len(panel.dates))
+    np.add.at(change, flow_day[flow_day >= 0], np.where(flows['BUY/SELL'].astype(str) == 'DEPOSIT', flows['AMT'] - flows['FEE'], -(flows['AMT'] + flows['FEE']))[flow_day >= 0])
+    weekdays = pd.Series(np.arange(len(panel.dates)), index=panel.dates)[panel.dates.dayofweek < 5]
+    scheduled = np.zeros(len(panel.dates), dtype=bool)
+    scheduled[weekdays.groupby(weekdays.index.to_period(freq)).first().to_numpy()] = True
+    rebalance_day = scheduled | (change != 0)
+    event_days = np.nonzero(rebalance_day | (split_ratio != 1).any(axis=1) | (net_dividend != 0).any(axis=1))[0]
+
+    rows, cash, holdings = [], 0.0, np.zeros(len(columns))
+    first_flow = flow_day[flow_day >= 0].min() if (flow_day >= 0).any() else len(panel.dates)
+    for i in event_days[event_days >= first_flow]:
+        cash += change[i]
+        price, ratio = close[i], split_ratio[i]
+        if rebalance_day[i]:
+            priced = price > 0
+            equity = cash + np.sum(holdings * ratio * np.where(priced, price, 0))
+            # Target shares before the day's split, so they are worth the target after it
+            wanted = np.where(priced, target * max(equity, 0) / np.where(priced, price * ratio, 1), holdings)
+            for j in np.nonzero(np.abs(wanted - holdings) * price > 0.01)[0]:
+                qty = wanted[j] - holdings[j]
+                cost = _fee(abs(qty) * price[j], fee)
+                rows.append((panel.dates[i], panel.symbols[columns[j]], 'BUY' if qty > 0 else 'SELL', abs(qty), price[j], cost))
+                cash -= qty * price[j] + cost
+                holdings[j] = wanted[j]
+        holdings = holdings * ratio
+        income = holdings * net_dividend[i]
+        cash += income[income > 0].sum()
+    return pd.concat([flows, _orders(rows)], ignore_index=True).sort_values('DATE', kind='stable')
+
+# --- Running ---
+def _with_fee(trades_df, fee):
+    if fee is None:
+        return trades_df
+    traded = trades_df['BUY/SELL'].isin(['BUY', 'SELL']) & (trades_df['SYMBOL'] != 'CASH')
+    return trades_df.assign(FEE=np.where(traded, _fee(trades_df['AMT'].to_numpy(dtype=float), fee), trades_df['FEE']))
+
+def summarize(df_history, dividend_history, trades_df, risk_free_rate=RISK_FREE_RATE):
+    """
+    Headline metrics of one variant, with the daily return definition of
+    calculate_performance_metrics (flows count half a day).
+    """
+    equity = df_history['Total_Equity'].to_numpy()
+    invested = df_history['Invested_Capital'].iloc[-1]
+    net_flow = df_history['Net_Flow'].to_numpy()[1:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = np.concatenate(([0.0], (equity[1:] - equity[:-1] - net_flow) / (equity[:-1] + 0.5 * net_flow)))
+    returns = np.where(np.isnan(returns), 0.0, returns)
+    years = (df_history.index[-1] - df_history.index[0]).days / 365
+    cumulative = np.prod(1 + returns) - 1
+    volatility = returns.std(ddof=1) * np.sqrt(252) if len(returns) > 1 else np.nan
+    excess = returns - ((1 + risk_free_rate) ** (1 / 365) - 1)
+    traded = (trades_df['SYMBOL'] != 'CASH').to_numpy()
+    return {
+        'Final_Equity': equity[-1],
+        'Invested_Capital': invested,
+        'PnL': equity[-1] - invested,
+        'Total_Return': equity[-1] / invested - 1 if invested else np.nan,
+        'TWR': cumulative,
+        'CAGR': (1 + cumulative) ** (1 / years) - 1 if years > 0 and cumulative > -1 else np.nan,
+        'Volatility': volatility,
+        'Sharpe': excess.mean() * 252 / volatility if volatility > 0 else np.nan,
+        'Max_Drawdown': np.min(equity / np.maximum.accumulate(equity) - 1) if len(equity) else np.nan,
+        'Dividends': sum(row['Amount'] for row in dividend_history),
+        'Fees': trades_df['FEE'].to_numpy(dtype=float)[traded].sum(),
+        'Trades': int(traded.sum()),
+    }
+
+def run_variant(variant, trades_df, panel):
+    """
+    Replay one variant through the reconstruction engine. Returns its metrics and daily equity.
+    """
+    replay = variant.rule(trades_df, panel, variant.fee, variant.dividend_tax) if variant.rule is not None else trades_df
+    replay = _with_fee(replay, variant.fee)
+    df_history, _, dividend_history = tracker.reconstruct(replay, panel, dividend_tax=variant.dividend_tax)
+    return summarize(df_history, dividend_history, replay), df_history['Total_Equity'].to_numpy()
+
+# Worker state: the trades and price panel, set once per process (inherited, not copied, under fork)
+_shared = {}
+
+def _init_worker(trades_df, panel):
+    _shared['trades'] = trades_df
+    _shared['panel'] = panel
+
+def _run_shared(variant):
+    return run_variant(variant, _shared['trades'], _shared['panel'])
+
+def run(portfolio_tracker, variants, update=True, max_workers=config.BACKTEST_WORKERS):
+    """
+    Run the variants over one price panel built from the tracker's market data
+    (symbols a variant needs beyond the book are fetched first). Returns a
+    comparison table (one row per variant) and the equity curves (weekdays x variants).
+    """
+    extra = sorted({symbol for variant in variants for symbol in variant.symbols} - set(portfolio_tracker.market_data))
+    if extra:
+        portfolio_tracker.fetch_market_data(update=update, symbols=extra)
+    symbols = list(dict.fromkeys(portfolio_tracker.symbols + [symbol for variant in variants for symbol in variant.symbols]))
+    dates = pd.date_range(start=portfolio_tracker.start_date, end=portfolio_tracker.end_date, freq='D')
+    panel = tracker.build_price_panel(symbols, portfolio_tracker.market_data, portfolio_tracker.splits, portfolio_tracker.dividends, dates)
+    missing = sorted({symbol for variant in variants for symbol in variant.symbols} - set(panel.symbols))
+    if missing:
+        raise ValueError(f"No split/dividend records for {', '.join(missing)}")
+    trades_df = portfolio_tracker.trades
+
+    start_time = time.perf_counter()
+    if max_workers > 1 and len(variants) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(trades_df, panel)) as pool:
+            outcomes = list(pool.map(_run_shared, variants, chunksize=max(1, len(variants) // (max_workers * 4))))
+    else:
+        outcomes = [run_variant(variant, trades_df, panel) for variant in variants]
+    elapsed = time.perf_counter() - start_time
+    print(f"✅ Backtested {len(variants)} variants in {elapsed:.2f}s ({elapsed / len(variants) * 1000:.1f} ms each, {max_workers} worker{'s' if max_workers > 1 else ''})")
+
+    names = [variant.name for variant in variants]
+    table = pd.DataFrame([metrics for metrics, _ in outcomes], index=pd.Index(names, name='Variant'))
+    weekdays = pd.DatetimeIndex(dates[dates.dayofweek < 5], name='Date')
+    curves = pd.DataFrame(np.column_stack([equity for _, equity in outcomes]), index=weekdays, columns=names)
+    return table, curves
+
+def default_variants(portfolio_tracker):
+    """
+    The actual book with other fees and dividend tax, DCA into each plot
+    benchmark, and monthly rebalancing to today's weights and to equal weights.
+    """
+    weights = portfolio_tracker.historical_weights.iloc[-1] if hasattr(portfolio_tracker, 'historical_weights') else pd.Series(dtype=float)
+    weights = weights[weights > 0]
+    held = weights.index.tolist() or portfolio_tracker.symbols
+    variants = [
+        actual(),
+        actual('No dividend tax', dividend_tax=0.0),
+        actual('Zero fees', fee=(0.0, 0.0)),
+        actual('Fees 0.1%', fee=(0.0, 0.001)),
+    ]
+    variants += [dca(symbol) for symbol in config.PLOT_BENCHMARK]
+    if not weights.empty:
+        variants.append(rebalance((weights / weights.sum()).to_dict(), name='Rebalance M to current weights'))
+    variants.append(rebalance({symbol: 1 / len(held) for symbol in held}, name='Rebalance M equal weight'))
+    return variants
+
+if __name__ == "__main__":
+    import main
+    import pipeline
+
+    parser = argparse.ArgumentParser(description="Compare the actual portfolio with what-if variants")
+    parser.add_argument('--test', action='store_true', help='Use the checkpointed or locally cached market data')
+    parser.add_argument('--workers', type=int, default=config.BACKTEST_WORKERS, help='Process pool size (1 runs in-process)')
+    parser.add_argument('--output', help='Directory for the comparison table and equity curves (default: data/backtests)')
+    args = parser.parse_args()
+
+    config.make_dirs()
+    portfolio_tracker = pipeline.run_stages(main.get_stages(update=not args.test)[:3], outputs=['reconstruct'])['reconstruct']
+    table, curves = run(portfolio_tracker, default_variants(portfolio_tracker), update=not args.test, max_workers=args.workers)
+
+    with pd.option_context('display.float_format', '{:,.4f}'.format, 'display.width', 200):
+        print(table)
+    output_dir = args.output or config.BACKTEST_DIR
+    os.makedirs(output_dir, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    table.to_csv(os.path.join(output_dir, f"backtest_{stamp}.csv"))
+    curves.to_csv(os.path.join(output_dir, f"backtest_{stamp}_equity.csv"))
+    print(f"✅ Saved comparison table and equity curves to {output_dir}")
@@ -0,0 +1,420 @@
+import config
+import os
+import sys
+import json
+import time
+import zlib
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+import data_manager
+import portfolio_tracker as tracker
+import portfolio_analyzer as analyzer
+import report_manager
+import scenario_engine
+import pipeline
+import profiler
+
+# Benchmark scales: (symbols, years of history, trades)
+SCALES = {
+    'small': (10, 1, 1_000),
+    'medium': (100, 5, 20_000),
+    'large': (1000, 20, 500_000), # The report tasks are slow on 500k trades; opt in with --scales large
+}
+DEFAULT_SCALES = ['small', 'medium']
+
+# Golden outputs: a fixed small portfolio whose results must not change when an engine gets faster
+GOLDEN_SCALE = (10, 2, 2_000)
+GOLDEN_FILE = os.path.join(config.SRC_DIR, 'benchmark_golden.json')
+GOLDEN_RTOL = 1e-9
+
+# Fixed "today" so synthetic histories and their outputs are reproducible
+ANCHOR_DATE = pd.Timestamp('2024-12-31')
+
+# First date of the synthetic price calendar (the stress windows reach back to 2000)
+MARKET_START = pd.Timestamp('1999-12-01')
+
+# Cold `import main` must stay under this budget without loading the heavy dependencies,
+# which the stages that need them import on first use
+STARTUP_BUDGET_SECONDS = 0.8
+STARTUP_DEFERRED = ['yfinance', 'scipy', 'matplotlib', 'seaborn', 'plotly', 'jinja2', 'paramiko', 'openpyxl']
+
+# Slowdowns smaller than this never count as regressions, whatever config.BENCHMARK_TOLERANCE says
+REGRESSION_MIN_SECONDS = 0.05
+
+SECTORS = ['Technology', 'Healthcare', 'Financial Services', 'Energy', 'Industrials', 'Consumer Defensive', 'Utilities']
+
+# --- Synthetic market ---
+class _SyntheticTicker:
+    def __init__(self, market, symbol):
+        self.market = market
+        self.symbol = symbol
+
+    def history(self, start=None, period=None, interval='1d', auto_adjust=True, **kwargs):
+        if interval != '1d':
+            return pd.DataFrame()
+        df = self.market.prices(self.symbol)
+        if start is not None:
+            df = df[df.index >= pd.Timestamp(start)]
+        if period == '1d':
+            df = df.iloc[-1:]
+        return df
+
+    @property
+    def dividends(self):
+        return self.market.dividends(self.symbol)
+
+    @property
+    def splits(self):
+        return self.market.splits(self.symbol)
+
+    @property
+    def info(self):
+        code = self.market.code(self.symbol)
+        return {'quoteType': 'ETF' if code % 5 == 0 else 'EQUITY', 'sector': SECTORS[code % len(SECTORS)], 'longName': self.symbol}
+
+class SyntheticMarket:
+    """
+    Seeded, offline stand-in for the yfinance calls the pipeline makes: random
+    walk prices (unadjusted for splits, like the raw close), quarterly
+    dividends on a third of the symbols and a 2:1 split on a tenth of them.
+    """
+    def __init__(self, end=ANCHOR_DATE, seed=0):
+        self.seed = seed
+        self.dates = pd.bdate_range(MARKET_START, end)
+        self._prices = {}
+
+    def code(self, symbol):
+        return zlib.crc32(f"{self.seed}:{symbol}".encode())
+
+    def splits(self, symbol):
+        if self.code(symbol) % 10 != 0 or symbol.startswith('^'):
+            return pd.Series(dtype=float, index=pd.DatetimeIndex([]))
+        return pd.Series([2.0], index=[self.dates[len(self.dates) - 250]])
+
+    def dividends(self, symbol):
+        if self.code(symbol) % 3 != 0 or symbol.startswith('^'):
+            return pd.Series(dtype=float, index=pd.DatetimeIndex([]))
+        close = self.prices(symbol)['Close']
+        pay_dates = self.dates[63::63]
+        return (close.reindex(pay_dates) * 0.005).round(4)
+
+    def prices(self, symbol):
+        if symbol not in self._prices:
+            rng = np.random.default_rng(self.code(symbol))
+            if symbol == '^IRX':
+                close = np.full(len(self.dates), 4.5)
+            elif symbol == 'HKD=X':
+                close = np.full(len(self.dates), 7.8)
+            else:
+                close = rng.uniform(20, 300) * np.exp(np.cumsum(rng.normal(0.0003, 0.018, len(self.dates))))
+                for date, ratio in self.splits(symbol).items():
+                    close[self.dates >= date] /= ratio
+            close = np.round(close, 4)
+            self._prices[symbol] = pd.DataFrame({
+                'Open': close * 0.998, 'High': close * 1.01, 'Low': close * 0.99, 'Close': close, 'Adj Close': close,
+                'Volume': rng.integers(1e5, 1e7, len(self.dates)).astype(float),
+            }, index=self.dates)
+        return self._prices[symbol]
+
+    def Ticker(self, symbol):
+        return _SyntheticTicker(self, symbol)
+
+    def download(self, tickers, start=None, end=None, **kwargs):
+        tickers = [tickers] if isinstance(tickers, str) else list(tickers)
+        close = pd.DataFrame({t: self.prices(t)['Close'] for t in tickers})
+        if start is not None:
+            close = close[close.index >= pd.Timestamp(start)]
+        if end is not None:
+            close = close[close.index < pd.Timestamp(end)]
+        return pd.concat({'Close': close}, axis=1)
+
+def make_trades(market, n_symbols, years, n_trades, seed=0):
+    """
+    Seeded trade log in the ledger schema: an opening deposit, monthly
+    deposits funding the buys, and buys/sells (70/30) priced at the close.
+    Sells are capped at the shares held (and dropped when none are), so the
+    book stays long.
+    """
+    rng = np.random.default_rng(seed)
+    start = ANCHOR_DATE - pd.DateOffset(years=years)
+    dates = pd.bdate_range(start, ANCHOR_DATE - pd.Timedelta(days=5))
+    symbols = [f"S{i:04d}" for i in range(n_symbols)]
+
+    trade_dates = np.sort(dates[rng.integers(0, len(dates), n_trades)])
+    trade_symbols = np.array(symbols)[rng.integers(0, n_symbols, n_trades)]
+    closes = pd.DataFrame({sym: market.prices(sym)['Close'] for sym in symbols})
+    prices = closes.reindex(trade_dates).to_numpy()[np.arange(n_trades), pd.Index(symbols).get_indexer(trade_symbols)]
+    sides = np.where(rng.random(n_trades) < 0.7, 'BUY', 'SELL')
+    qty = rng.integers(1, 50, n_trades)
+
+    # Walk the trades in ledger order (buys before sells within a day); splits only add shares
+    held = dict.fromkeys(symbols, 0)
+    symbol_list, sell_list, qty_list = trade_symbols.tolist(), (sides == 'SELL').tolist(), qty.tolist()
+    for i in np.lexsort((sides == 'SELL', trade_dates)).tolist():
+        if sell_list[i]:
+            qty_list[i] = min(qty_list[i], held[symbol_list[i]])
+            held[symbol_list[i]] -= qty_list[i]
+        else:
+            held[symbol_list[i]] += qty_list[i]
+    qty = np.array(qty_list)
+
+    trades = pd.DataFrame({'DATE': trade_dates, 'MARKET': 'US', 'SYMBOL': trade_symbols, 'BUY/SELL': sides, 'QTY': qty, 'PRICE': np.round(prices, 2), 'FEE': 1.0})
+    trades = trades[trades['QTY'] > 0]
+    months = pd.date_range(dates[0], dates[-1], freq='BMS') # Weekdays, like the history's rows
+    monthly = float((trades['QTY'] * trades['PRICE']).sum()) / max(len(months), 1)
+    deposits = pd.DataFrame({'DATE': [dates[0]] + list(months[1:]), 'MARKET': 'US', 'SYMBOL': 'CASH', 'BUY/SELL': 'DEPOSIT', 'QTY': 1, 'PRICE': round(monthly, 2), 'FEE': 0.0})
+
+    trades = pd.concat([deposits, trades], ignore_index=True)
+    trades['AMT'] = (trades['QTY'] * trades['PRICE']).round(3)
+    trades = data_manager.type_trades(trades)
+    return trades.sort_values(['DATE', 'BUY/SELL'], kind='stable').reset_index(drop=True)
+
+# --- Measurement ---
+def _measure(stages, name, func, *args, **kwargs):
+    """
+    Run one stage and record its wall time, the process RSS high-water mark
+    after it and, when tracemalloc is on, its own allocation peak.
+    """
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    start_time = time.perf_counter()
+    result = func(*args, **kwargs)
+    stages[name] = {'seconds': time.perf_counter() - start_time, 'peak_rss_mb': profiler.peak_rss_mb()}
+    if tracemalloc.is_tracing():
+        stages[name]['alloc_peak_mb'] = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    return result
+
+def _use_sandbox(market, work_dir):
+    """
+    Point every data/cache path and every yfinance caller at the sandbox.
+    """
+    for attr, sub in [('DATA_DIR', ''), ('DAILY_DATA_DIR', 'Daily'), ('MINUTE_DATA_DIR', 'Minute'), ('INPUT_DIR', 'input'),
+                      ('OUTPUT_DIR', 'output'), ('REPORT_CACHE_DIR', 'report_cache'), ('VENDOR_DIR', 'vendor')]:
+        setattr(config, attr, os.path.join(work_dir, sub))
+        os.makedirs(getattr(config, attr), exist_ok=True)
+    scenario_engine.SCENARIO_PRICES_FILE = os.path.join(work_dir, 'scenario_prices.pkl')
+    tracker.yf = analyzer.yf = scenario_engine.yf = market
+    analyzer._benchmark_cache.clear()
+    analyzer._period_returns_cache.clear()
+    report_manager._fragment_cache.clear()
+
+def run_scale(n_symbols, years, n_trades, seed=0, keep_results=False):
+    """
+    Every pipeline stage on one synthetic portfolio, run sequentially in a
+    throwaway sandbox. Returns the stage measurements (and the outputs).
+    """
+    market = SyntheticMarket(seed=seed)
+    work_dir = tempfile.mkdtemp(prefix='portfolio_bench_')
+    stages = {}
+    try:
+        _use_sandbox(market, work_dir)
+        trades = _measure(stages, 'generate_trades', make_trades, market, n_symbols, years, n_trades, seed=seed)
+
+        portfolio_tracker = tracker.PortfolioTracker(trades)
+        portfolio_tracker.end_date = ANCHOR_DATE
+        _measure(stages, 'fetch_market_data', portfolio_tracker.fetch_market_data, update=True)
+        history = _measure(stages, 'process_portfolio', portfolio_tracker.process_portfolio)
+        metrics = _measure(stages, 'performance_metrics', analyzer.calculate_performance_metrics, history)
+        _measure(stages, 'shadow_portfolios', analyzer.calculate_shadow_portfolios, history, config.PLOT_BENCHMARK)
+
+        # Report tasks one at a time so each gets the machine to itself
+        results, timings = _measure(stages, 'report_tasks', pipeline.run_tasks, pipeline.get_report_tasks(update=True),
+                                    {'history': history, 'trades': trades, 'tracker': portfolio_tracker}, executor='thread', max_workers=1)
+        for name, ms in timings.items():
+            stages[f"task_{name}"] = {'seconds': ms / 1000}
+
+        figs, df_alloc, df_risk, df_execution = pipeline.get_report_inputs(results)
+        _measure(stages, 'create_report', report_manager.create_report, figs, df_alloc, trades, df_risk, df_execution,
+                 output_dir=config.OUTPUT_DIR, assets='cdn', precompress=False)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    outputs = {'history': history, 'metrics': metrics, 'results': results} if keep_results else None
+    return stages, outputs
+
+# --- Golden outputs ---
+def _digest(value):
+    """
+    Comparable summary of an output: per numeric column [sum, min, max, last] for frames/series, the number itself otherwise.
+    """
+    if isinstance(value, pd.Series):
+        value = value.to_frame()
+    if isinstance(value, pd.DataFrame):
+        numeric = value.select_dtypes(include='number', exclude='timedelta')
+        return {str(col): [float(values.sum()), float(values.min()), float(values.max()), float(values.iloc[-1])]
+                for col, values in numeric.items() if len(numeric)}
+    if isinstance(value, (int, float, np.number)) and not isinstance(value, bool):
+        return float(value)
+    return None
+
+def golden_outputs(outputs):
+    results = outputs['results']
+    golden = {
+        'history': _digest(outputs['history']),
+        'metrics': {key: _digest(value) for key, value in outputs['metrics'].items() if _digest(value) is not None},
+        'rolling_var': _digest(results['rolling_var'][0]),
+        'var_backtest': _digest(results['rolling_var'][1]),
+        'allocation': _digest(results['allocation'][1]),
+        'risk': _digest(results['risk_decomposition'][1]),
+        'stress': _digest(results['stress']),
+        'period_returns': {freq: _digest(df) for freq, df in results['period_returns'][0].items()},
+        'trailing_returns': _digest(results['period_returns'][1]),
+        'execution': _digest(results['execution'][1]),
+    }
+    return json.loads(json.dumps(golden, default=float).replace('NaN', 'null'))
+
+def _compare_golden(expected, actual, path=''):
+    """
+    Paths whose values differ beyond GOLDEN_RTOL.
+    """
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        mismatches = [f"{path}/{key}: missing" for key in expected.keys() - actual.keys()]
+        for key in expected.keys() & actual.keys():
+            mismatches += _compare_golden(expected[key], actual[key], f"{path}/{key}")
+        return mismatches
+    if isinstance(expected, list) and isinstance(actual, list) and len(expected) == len(actual):
+        return [m for e, a in zip(expected, actual) for m in _compare_golden(e, a, path)][:1]
+    if expected is None or actual is None:
+        return [] if expected is actual else [f"{path}: {expected} != {actual}"]
+    if isinstance(expected, (int, float)) and isinstance(actual, (int, float)):
+        return [] if np.isclose(expected, actual, rtol=GOLDEN_RTOL, atol=GOLDEN_RTOL) else [f"{path}: {expected} != {actual}"]
+    return [] if expected == actual else [f"{path}: {expected} != {actual}"]
+
+def check_golden(update=False):
+    """
+    Run the golden portfolio and compare its outputs with GOLDEN_FILE
+    (written instead when missing or when update is set).
+    """
+    _, outputs = run_scale(*GOLDEN_SCALE, keep_results=True)
+    actual = golden_outputs(outputs)
+    if update or not os.path.exists(GOLDEN_FILE):
+        with open(GOLDEN_FILE, 'w') as f:
+            json.dump(actual, f, indent=1, sort_keys=True)
+        print(f"✅ Wrote golden outputs to {GOLDEN_FILE}")
+        return True
+
+    with open(GOLDEN_FILE) as f:
+        expected = json.load(f)
+    mismatches = _compare_golden(expected, actual)
+    if mismatches:
+        print(f"❌ {len(mismatches)} golden outputs changed:")
+        for mismatch in sorted(mismatches)[:30]:
+            print(f"   {mismatch}")
+        return False
+    print("✅ Golden outputs match")
+    return True
+
+# --- Startup ---
+def measure_startup(module='main'):
+    """
+    Import the module in a fresh interpreter under python -X importtime.
+    Returns the cumulative import seconds and the deferred packages it loaded anyway.
+    """
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=config.SRC_DIR, capture_output=True, text=True, timeout=120).stderr
+    cumulative = {}
+    for line in output.splitlines():
+        fields = line.removeprefix('import time:').split('|')
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            cumulative[fields[2].strip()] = int(fields[1])
+    loaded = sorted({name.split('.')[0] for name in cumulative} & set(STARTUP_DEFERRED))
+    return cumulative.get(module, 0) / 1e6, loaded
+
+# --- Results ---
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=config.SRC_DIR, capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+def compare_results(baseline, current):
+    """
+    Stages slower than the baseline by more than config.BENCHMARK_TOLERANCE.
+    """
+    regressions = []
+    for scale, stages in current['scales'].items():
+        for stage, measured in stages.items():
+            before = baseline.get('scales', {}).get(scale, {}).get(stage)
+            if before is None:
+                continue
+            ratio = measured['seconds'] / before['seconds'] if before['seconds'] > 0 else np.inf
+            if ratio > 1 + config.BENCHMARK_TOLERANCE and measured['seconds'] - before['seconds'] > REGRESSION_MIN_SECONDS:
+                regressions.append((scale, stage, before['seconds'], measured['seconds'], ratio))
+    return regressions
+
+def print_stages(scale, stages):
+    print(f"\n{scale}")
+    print(f"   {'stage':<28} {'seconds':>9} {'peak RSS MB':>12} {'alloc MB':>9}")
+    for stage, measured in stages.items():
+        rss = f"{measured['peak_rss_mb']:.0f}" if measured.get('peak_rss_mb') is not None else '-'
+        alloc = f"{measured['alloc_peak_mb']:.1f}" if measured.get('alloc_peak_mb') is not None else '-'
+        print(f"   {stage:<28} {measured['seconds']:9.3f} {rss:>12} {alloc:>9}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every pipeline stage on synthetic portfolios")
+    parser.add_argument('--scales', nargs='+', default=DEFAULT_SCALES, help=f"Named scales ({', '.join(SCALES)}) or SYMBOLSxYEARSxTRADES, e.g. 100x5x20000")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--compare', help='Baseline results file; exits non-zero on regressions')
+    parser.add_argument('--output', help='Results file (default: data/benchmarks/benchmark_<time>.json)')
+    parser.add_argument('--tracemalloc', action='store_true', help='Also record per-stage Python allocation peaks (slows the stages down)')
+    parser.add_argument('--skip-golden', action='store_true', help='Skip the golden-output check')
+    parser.add_argument('--update-golden', action='store_true', help='Rewrite the golden outputs from this engine')
+    args = parser.parse_args()
+
+    golden_ok = True
+    if args.update_golden or not args.skip_golden:
+        golden_ok = check_golden(update=args.update_golden)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    results = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'machine': f"{platform.system()} {platform.machine()}, {os.cpu_count()} CPUs",
+        'seed': args.seed,
+        'scales': {},
+    }
+
+    startup_seconds, startup_loaded = measure_startup()
+    results['scales']['startup'] = {'import_main': {'seconds': startup_seconds}}
+    startup_ok = startup_seconds <= STARTUP_BUDGET_SECONDS and not startup_loaded
+    print(f"{'✅' if startup_ok else '❌'} import main: {startup_seconds * 1000:.0f} ms (budget {STARTUP_BUDGET_SECONDS * 1000:.0f} ms)"
+          + (f"; loaded at startup: {', '.join(startup_loaded)}" if startup_loaded else ""))
+    for scale in args.scales:
+        n_symbols, years, n_trades = SCALES[scale] if scale in SCALES else map(int, scale.split('x'))
+        label = f"{scale} ({n_symbols} symbols, {years}y, {n_trades} trades)" if scale in SCALES else scale
+        print(f"⏱️ Benchmarking {label}...")
+        stages, _ = run_scale(n_symbols, years, n_trades, seed=args.seed)
+        results['scales'][scale] = stages
+        print_stages(label, stages)
+
+    output_path = args.output or os.path.join(config.BENCHMARK_DIR, f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(results, f, indent=1)
+    print(f"\n✅ Saved benchmark results to {output_path}")
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare_results(json.load(f), results)
+        for scale, stage, before, after, ratio in regressions:
+            print(f"⚠️ Regression in {scale}/{stage}: {before:.3f}s -> {after:.3f}s ({ratio - 1:+.0%})")
+        if not regressions:
+            print(f"✅ No stage slower than {args.compare} by more than {config.BENCHMARK_TOLERANCE:.0%}")
+
+    sys.exit(0 if golden_ok and startup_ok and not regressions else 1)
+
+if __name__ == "__main__":
+    main()
@@ -12,31 +12,127 @@ MINUTE_DATA_DIR = os.path.join(DATA_DIR, "Minute")
 DAILY_DATA_DIR = os.path.join(DATA_DIR, "Daily")
 INPUT_DIR = os.path.join(PROJECT_ROOT, "input") # For trade.csv, financials.xlsx
 OUTPUT_DIR = os.path.join(PROJECT_ROOT, "output") # For report generated
+REPORT_CACHE_DIR = os.path.join(DATA_DIR, "report_cache") # Rendered report sections
+VENDOR_DIR = os.path.join(DATA_DIR, "vendor") # Pinned copies of the report's JS/CSS libraries
+BENCHMARK_DIR = os.path.join(DATA_DIR, "benchmarks") # Results of benchmark.py runs
+PROFILE_DIR = os.path.join(DATA_DIR, "profiles") # Chrome traces from main.py --profile
+CHECKPOINT_DIR = os.path.join(DATA_DIR, "checkpoints") # Last output of each main.py stage, to resume from
+BACKTEST_DIR = os.path.join(DATA_DIR, "backtests") # Comparison tables and equity curves from backtest.py
 
 TRADE_EXCEL_SOURCE = os.getenv("TRADE_EXCEL_FILE")
 TRADE_EXCEL_SHEET = os.getenv("TRADE_EXCEL_SHEET")
 
 # Configuration
 TRADE_HISTORY_FILE = os.path.join(INPUT_DIR, 'trade_history.csv')
+TRADE_LEDGER_FILE = os.path.join(INPUT_DIR, 'trade_ledger.pkl') # Typed trades + fingerprint of the source they came from
+TRADE_IMPORT_FILE = os.path.join(INPUT_DIR, 'imported_trades.csv') # Broker statements imported by importers.py
+IMPORT_CHUNK_ROWS = 50000 # Rows per chunk when streaming broker statements
 METRICS_BENCHMARK = "SPY"
 PLOT_BENCHMARK = ["SPY","QQQ","VEU"]
 
-# Tickers without dividend tax
+# Withholding tax on dividends, and the tickers exempt from it
+DIVIDEND_TAX_RATE = 0.30
 NO_DIVIDEND_TAX = ['SHV', 'SGOV', 'BIL']
 
 # Rolling window for quantitative analysis
 QUANT_WINDOW = [21, 63, 252]
 
+# Rolling windows and confidence for historical VaR / Expected Shortfall
+VAR_WINDOW = [63, 252, 504]
+VAR_CONFIDENCE = 0.95
+
+# Plot payload: traces longer than PLOT_MAX_POINTS are downsampled (LTTB),
+# PLOT_ZOOM_LEVELS > 1 embeds finer copies (4x each) swapped in on zoom, and
+# traces embedding more than PLOT_WEBGL_THRESHOLD points are drawn with WebGL
+PLOT_MAX_POINTS = 5000
+PLOT_ZOOM_LEVELS = 1
+PLOT_WEBGL_THRESHOLD = 20000
+
+# Embed figure/table data once as a shared, compressed binary block hydrated
+# in the browser (False: one self-contained to_html per figure, HTML tables)
+REPORT_SHARED_DATA = True
+# Table rows are built in the page in chunks of this size (first chunk drawn immediately)
+REPORT_TABLE_CHUNK_ROWS = 5000
+
+# Report JS/CSS: "cdn" (tags pointing at public CDNs), "inline" (vendored copies
+# embedded in the HTML, works offline) or "split" (vendored copies written once to
+# output/assets under content-hashed names that can be cached forever)
+REPORT_ASSETS = "cdn"
+# Also write precompressed .gz / .br (needs the brotli package) variants of the report and assets
+REPORT_PRECOMPRESS = True
+
+# Report figures/tables run as independent tasks on a "thread" or "process" pool
+# (process workers return figures as plain dicts)
+PIPELINE_EXECUTOR = "thread"
+PIPELINE_WORKERS = 8
+
+# Watch mode (main.py --watch): trade file polling, market data refreshes while the US
+# market is open (plus one after each close, once prices settle) and the memory ceiling
+# above which in-memory caches are evicted
+WATCH_POLL_SECONDS = 5
+WATCH_REFRESH_MINUTES = 15
+WATCH_CLOSE_DELAY_MINUTES = 20
+WATCH_MEMORY_LIMIT_MB = 2048
+
+# Local JSON API (main.py --serve): bind address and how many encoded responses
+# (dataset x query x format) are kept besides the precomputed full datasets
+API_HOST = "127.0.0.1"
+API_PORT = 8765
+API_CACHE_ENTRIES = 512
+
+# backtest.py: process pool size for the what-if variants (1 runs them in-process)
+BACKTEST_WORKERS = os.cpu_count() or 1
+
+# benchmark.py --compare flags stages this much slower than the baseline (and slower by over 50 ms)
+BENCHMARK_TOLERANCE = 0.20
+
+
+# Historical stress windows (start, end) replayed on current holdings
+STRESS_SCENARIOS = {
+    "GFC 2008-09": ("2007-10-09", "2009-03-09"),
+    "Lehman Collapse": ("2008-09-12", "2008-10-10"),
+    "Flash Crash 2010": ("2010-04-23", "2010-07-02"),
+    "US Downgrade 2011": ("2011-07-22", "2011-10-03"),
+    "Taper Tantrum 2013": ("2013-05-22", "2013-06-24"),
+    "China Deval 2015": ("2015-08-10", "2015-08-25"),
+    "Brexit Vote": ("2016-06-23", "2016-06-27"),
+    "Volmageddon 2018": ("2018-01-26", "2018-02-08"),
+    "Q4 2018 Selloff": ("2018-09-20", "2018-12-24"),
+    "COVID Crash 2020": ("2020-02-19", "2020-03-23"),
+    "2022 Rate Shock": ("2022-01-03", "2022-10-12"),
+    "SVB Crisis 2023": ("2023-03-08", "2023-03-13"),
+    "Yen Carry Unwind 2024": ("2024-07-16", "2024-08-05"),
+    "Tariff Shock 2025": ("2025-04-02", "2025-04-08"),
+}
+# Also replay every calendar month since this date as a scenario
+STRESS_MONTHLY_SINCE = "2007-01-01"
+
+# Factor proxies and user-defined factor shocks (factor return over the shock)
+FACTOR_PROXIES = {"Equity": "SPY", "Rates": "IEF", "Credit": "HYG", "Gold": "GLD", "Dollar": "UUP"}
+FACTOR_SHOCKS = {
+    "Equities -20%": {"Equity": -0.20},
+    "Equities -10%, Rates Rally": {"Equity": -0.10, "Rates": 0.04},
+    "Rates +100bp": {"Rates": -0.07},
+    "Credit Spread Blowout": {"Credit": -0.10, "Equity": -0.08},
+    "Stagflation": {"Equity": -0.15, "Rates": -0.05, "Gold": 0.10},
+    "Dollar +10%": {"Dollar": 0.10},
+}
 
 # Hosting 
 HOST = os.getenv("HOST")
 USER = os.getenv("HOST_USER")
 SUBPAGE = os.getenv("SUBPAGE")
 REMOTE_REPORT_PATH = f"/home/{USER}/public_html/{SUBPAGE}/index.html"
+PUBLISH_PORT = int(os.getenv("HOST_PORT", 22))
+PUBLISH_KEY_FILE = os.path.expanduser("~/.ssh/id_ed25519")
+# Concurrent SFTP channels on the one SSH connection
+PUBLISH_CHANNELS = 4
 
-os.makedirs(DATA_DIR, exist_ok=True)
-os.makedirs(INPUT_DIR, exist_ok=True)
-os.makedirs(MINUTE_DATA_DIR, exist_ok=True)
-os.makedirs(DAILY_DATA_DIR, exist_ok=True)
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+def make_dirs():
+    """
+    Create the data, input and output directories. Called by the entry points
+    rather than at import, so importing config touches nothing on disk.
+    """
+    for path in [DATA_DIR, INPUT_DIR, MINUTE_DATA_DIR, DAILY_DATA_DIR, OUTPUT_DIR, REPORT_CACHE_DIR, VENDOR_DIR, CHECKPOINT_DIR]:
+        os.makedirs(path, exist_ok=True)
 
@@ -1,8 +1,19 @@
+import io
 import shutil 
+import pickle
+import hashlib
+import time
 import warnings 
 import pandas as pd
 import os
 import config
+import profiler
+
+# Bump when the ledger layout changes so it is rebuilt from the source
+LEDGER_VERSION = 1
+
+# Sort order of trades within a day: cash in before buys, sells last
+BUYSELL_ORDER = ['DEPOSIT', 'BUY', 'WITHDRAW', 'SELL']
 
 def copy_file(source, destination_dir):
     """
@@ -14,34 +25,46 @@ def copy_file(source, destination_dir):
     except Exception as e:
         print(f"Error copying file: {e}")
 
-def get_trade_df(file_path, sheet_name=config.TRADE_EXCEL_SHEET):
+def clean_trade_df(df):
     """
-    Read the Excel file and return a list of symbols from the specified sheet.
+    Normalise raw trade rows (Excel or CSV) to the trade schema.
     """
+    if "CHECK" in df.columns:
+        df = df.drop(["CHECK"], axis = 1)
     
-    try:
-        with warnings.catch_warnings():
-            warnings.filterwarnings("ignore", category=UserWarning, module="openpyxl")
-            df = pd.read_excel(file_path, sheet_name=sheet_name)
-        if "CHECK" in df.columns:
-            df = df.drop(["CHECK"], axis = 1)
-        
-        df.columns = df.columns.str.upper().str.strip()
+    df.columns = df.columns.str.upper().str.strip()
 
-        if "FEE" not in df.columns:
-            df["FEE"] = 0.0
-        else:
-            df["FEE"] = df["FEE"].fillna(0.0)
+    if "FEE" not in df.columns:
+        df["FEE"] = 0.0
+    else:
+        df["FEE"] = df["FEE"].fillna(0.0)
 
-        df.dropna(inplace = True)
-        df["DATE"] = df["DATE"].dt.date
-        if "AMT" in df.columns:
-            df = df.drop(["AMT"], axis=1)
-        df["QTY"] = df["QTY"].apply(int)
-        df["AMT"] = (df["QTY"] * df["PRICE"]).round(3)
-        df["FEE"] = df["FEE"].astype(float).round(3)
+    df = df.dropna()
+    if not pd.api.types.is_datetime64_any_dtype(df["DATE"]):
+        # DD/MM/YYYY as in the Excel log, or ISO dates as in CSV exports
+        is_iso = df["DATE"].astype(str).str.match(r'\d{4}-').all()
+        df["DATE"] = pd.to_datetime(df["DATE"], format='ISO8601') if is_iso else pd.to_datetime(df["DATE"], dayfirst=True)
+    df["DATE"] = df["DATE"].dt.date
+    if "AMT" in df.columns:
+        df = df.drop(["AMT"], axis=1)
+    df["QTY"] = df["QTY"].astype(float).astype('int64')
+    df["AMT"] = (df["QTY"] * df["PRICE"]).round(3)
+    df["FEE"] = df["FEE"].astype(float).round(3)
+    return df
 
-        return df
+def get_trade_df(file_path, sheet_name=config.TRADE_EXCEL_SHEET):
+    """
+    Read the trades from the Excel sheet (or a CSV file with the same columns).
+    """
+    
+    try:
+        if file_path.lower().endswith('.csv'):
+            df = pd.read_csv(file_path)
+        else:
+            with warnings.catch_warnings():
+                warnings.filterwarnings("ignore", category=UserWarning, module="openpyxl")
+                df = pd.read_excel(file_path, sheet_name=sheet_name)
+        return clean_trade_df(df)
     except Exception as e:
         print(f"Error reading Excel file: {e}")
         return []
@@ -73,8 +96,138 @@ def load_trade_history(filepath):
     if 'FEE' not in df.columns:
         df['FEE'] = 0.0
         
-    buysell_order = ['DEPOSIT', 'BUY', 'WITHDRAW', 'SELL']
-    df['BUY/SELL'] = pd.Categorical(df['BUY/SELL'], categories=buysell_order, ordered=True)
+    df['BUY/SELL'] = pd.Categorical(df['BUY/SELL'], categories=BUYSELL_ORDER, ordered=True)
 
     return df.sort_values(['DATE', 'BUY/SELL'])
 
+# --- Trade ledger ---
+def _hash_file(path, prefix_size=None):
+    """
+    SHA-256 of the whole file and, in the same pass, of its first prefix_size bytes.
+    """
+    full, prefix = hashlib.sha256(), hashlib.sha256()
+    read = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            full.update(chunk)
+            if prefix_size is not None and read < prefix_size:
+                prefix.update(chunk[:prefix_size - read])
+            read += len(chunk)
+    return full.hexdigest(), prefix.hexdigest() if prefix_size is not None else None
+
+def type_trades(df):
+    """
+    Compact ledger dtypes: datetime DATE, categorical SYMBOL/MARKET/BUY/SELL, int QTY, float PRICE/FEE/AMT.
+    """
+    df = df.copy()
+    df['DATE'] = pd.to_datetime(df['DATE'])
+    for col in ['SYMBOL', 'MARKET']:
+        if col in df.columns:
+            df[col] = df[col].astype(str).astype('category')
+    df['BUY/SELL'] = pd.Categorical(df['BUY/SELL'].astype(str), categories=BUYSELL_ORDER, ordered=True)
+    df['QTY'] = df['QTY'].astype('int64')
+    for col in ['PRICE', 'FEE', 'AMT']:
+        df[col] = df[col].astype('float64')
+    return df.reset_index(drop=True)
+
+def _concat_trades(ledger_trades, new_trades):
+    """
+    Append rows, re-unioning the categories so the categoricals survive the concat.
+    """
+    combined = pd.concat([ledger_trades.astype({col: str for col in ['SYMBOL', 'MARKET'] if col in ledger_trades.columns}), new_trades], ignore_index=True)
+    return type_trades(combined)
+
+def load_trade_ledger(ledger_path=config.TRADE_LEDGER_FILE):
+    if not os.path.exists(ledger_path):
+        return None
+    try:
+        with open(ledger_path, 'rb') as f:
+            ledger = pickle.load(f)
+        return ledger if ledger.get('version') == LEDGER_VERSION else None
+    except Exception as e:
+        print(f"Error loading trade ledger: {e}")
+        return None
+
+def save_trade_ledger(ledger, ledger_path=config.TRADE_LEDGER_FILE):
+    try:
+        with open(ledger_path + '.tmp', 'wb') as f:
+            pickle.dump(ledger, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(ledger_path + '.tmp', ledger_path)
+    except Exception as e:
+        print(f"Error saving trade ledger: {e}")
+
+def _read_appended_rows(source, ledger):
+    """
+    Rows appended to a CSV source since the ledger was built, parsed from the old end of the file.
+    """
+    with open(source, 'rb') as f:
+        f.seek(ledger['size'])
+        tail = f.read()
+    return pd.read_csv(io.BytesIO(tail), header=None, names=ledger['columns'])
+
+def get_trade_ledger(source=config.TRADE_EXCEL_SOURCE, sheet_name=config.TRADE_EXCEL_SHEET, ledger_path=config.TRADE_LEDGER_FILE):
+    """
+    Typed trades from the source file. The source is only parsed when its size,
+    mtime and content hash changed; a CSV source that only grew has just its
+    appended rows parsed. Trade history CSV is rewritten when the trades change.
+    """
+    start_time = time.perf_counter()
+    stat = os.stat(source)
+    ledger = load_trade_ledger(ledger_path)
+    if ledger is not None and ledger['source'] != os.path.abspath(source):
+        ledger = None
+
+    # Unchanged size and mtime: trust the ledger without reading the source
+    if ledger is not None and (ledger['size'], ledger['mtime_ns']) == (stat.st_size, stat.st_mtime_ns):
+        profiler.count('cache.trade_ledger.hit')
+        print(f"✅ Trade file unchanged, loaded {len(ledger['trades'])} trades from ledger in {(time.perf_counter() - start_time) * 1000:.1f} ms")
+        return ledger['trades'].sort_values(['DATE', 'BUY/SELL'])
+
+    is_csv = source.lower().endswith('.csv')
+    can_append = ledger is not None and is_csv and ledger.get('ends_with_newline') and stat.st_size > ledger['size']
+    digest, prefix_digest = _hash_file(source, ledger['size'] if can_append else None)
+    hash_ms = (time.perf_counter() - start_time) * 1000
+
+    if ledger is not None and digest == ledger['sha256']:
+        # Touched but identical: keep the ledger, refresh the stat key
+        profiler.count('cache.trade_ledger.hit')
+        ledger.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+        save_trade_ledger(ledger, ledger_path)
+        print(f"✅ Trade file content unchanged (hashed in {hash_ms:.0f} ms), loaded {len(ledger['trades'])} trades from ledger")
+        return ledger['trades'].sort_values(['DATE', 'BUY/SELL'])
+
+    parse_start = time.perf_counter()
+    profiler.count('cache.trade_ledger.miss')
+    if can_append and prefix_digest == ledger['sha256']:
+        new_trades = type_trades(clean_trade_df(_read_appended_rows(source, ledger)))
+        trades = _concat_trades(ledger['trades'], new_trades)
+        columns = ledger['columns']
+        print(f"✅ Parsed {len(new_trades)} appended trades in {(time.perf_counter() - parse_start) * 1000:.0f} ms (hash {hash_ms:.0f} ms), ledger now {len(trades)} trades")
+    else:
+        if not is_csv:
+            copy_file(source=source, destination_dir=config.INPUT_DIR)
+        trade_df = get_trade_df(source if is_csv else os.path.join(config.INPUT_DIR, os.path.basename(source)), sheet_name=sheet_name)
+        if not hasattr(trade_df, 'to_csv'):
+            return ledger['trades'].sort_values(['DATE', 'BUY/SELL']) if ledger is not None else load_trade_history(config.TRADE_HISTORY_FILE)
+        trades = type_trades(trade_df)
+        columns = pd.read_csv(source, nrows=0).columns.tolist() if is_csv else None
+        print(f"✅ Parsed {len(trades)} trades from {os.path.basename(source)} in {(time.perf_counter() - parse_start) * 1000:.0f} ms (hash {hash_ms:.0f} ms)")
+
+    with open(source, 'rb') as f:
+        f.seek(max(stat.st_size - 1, 0))
+        ends_with_newline = f.read(1) == b'\n'
+
+    save_trade_ledger({
+        'version': LEDGER_VERSION,
+        'source': os.path.abspath(source),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': digest,
+        'ends_with_newline': ends_with_newline,
+        'columns': columns,
+        'trades': trades,
+    }, ledger_path)
+    export_trade_csv(trades.assign(DATE=trades['DATE'].dt.date), config.INPUT_DIR)
+
+    return trades.sort_values(['DATE', 'BUY/SELL'])
+
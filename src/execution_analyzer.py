@@ -0,0 +1,201 @@
+import config
+import os
+import time
+import numpy as np
+import pandas as pd
+
+import profiler
+
+# Minimum minute bars for a session to count as covered by intraday data
+MIN_SESSION_BARS = 30
+
+# Columns of the yfinance minute cache not needed for session prices
+MINUTE_UNUSED_COLUMNS = ('Adj Close', 'Dividends', 'Stock Splits', 'Capital Gains')
+
+def load_minute_bars(symbols):
+    """
+    Load the cached minute bars for the symbols into one long DataFrame.
+    """
+    frames = []
+    for symbol in symbols:
+        minute_path = os.path.join(config.MINUTE_DATA_DIR, f"{symbol}.csv")
+        if not os.path.exists(minute_path):
+            profiler.count('cache.minute_csv.miss')
+            continue
+        profiler.count('cache.minute_csv.hit')
+        try:
+            with profiler.span('read_minute_csv', symbol=symbol):
+                bars = pd.read_csv(minute_path, index_col=0, parse_dates=True, usecols=lambda c: c not in MINUTE_UNUSED_COLUMNS)
+            bars = bars[['Open', 'High', 'Low', 'Close', 'Volume']].rename_axis('Datetime').reset_index()
+            bars['SYMBOL'] = symbol
+            frames.append(bars)
+        except Exception as e:
+            print(f"Error loading minute bars for {symbol}: {e}")
+
+    if not frames:
+        return pd.DataFrame(columns=['Datetime', 'SYMBOL', 'Open', 'High', 'Low', 'Close', 'Volume'])
+    return pd.concat(frames, ignore_index=True)
+
+def get_minute_sessions(minute_bars):
+    """
+    Per (symbol, session date) open, high, low, close and volume-weighted
+    average price from minute bars, in one groupby.
+    """
+    if minute_bars.empty:
+        return pd.DataFrame(columns=['SYMBOL', 'DATE', 'Open', 'High', 'Low', 'Close', 'VWAP', 'Bars'])
+
+    bars = minute_bars.sort_values(['SYMBOL', 'Datetime'])
+    typical = (bars['High'] + bars['Low'] + bars['Close']) / 3
+    bars = bars.assign(DATE=bars['Datetime'].dt.normalize(), PV=typical * bars['Volume'])
+
+    sessions = bars.groupby(['SYMBOL', 'DATE'], sort=False).agg(
+        Open=('Open', 'first'),
+        High=('High', 'max'),
+        Low=('Low', 'min'),
+        Close=('Close', 'last'),
+        PV=('PV', 'sum'),
+        Volume=('Volume', 'sum'),
+        Bars=('Close', 'size'),
+    ).reset_index()
+    sessions['VWAP'] = (sessions['PV'] / sessions['Volume'].where(sessions['Volume'] > 0)).fillna((sessions['High'] + sessions['Low'] + sessions['Close']) / 3)
+    sessions = sessions[sessions['Bars'] >= MIN_SESSION_BARS]
+    return sessions.drop(columns=['PV', 'Volume'])
+
+def get_daily_sessions(market_data, symbols):
+    """
+    Fallback sessions from daily OHLC, using the typical price as the VWAP estimate.
+    """
+    frames = []
+    for symbol in symbols:
+        daily = market_data.get(symbol)
+        if daily is None or daily.empty:
+            continue
+        frames.append(pd.DataFrame({
+            'SYMBOL': symbol,
+            'DATE': daily.index.normalize(),
+            'Open': daily['Open'].to_numpy(),
+            'High': daily['High'].to_numpy(),
+            'Low': daily['Low'].to_numpy(),
+            'Close': daily['Close'].to_numpy(),
+            'VWAP': ((daily['High'] + daily['Low'] + daily['Close']) / 3).to_numpy(),
+        }))
+
+    if not frames:
+        return pd.DataFrame(columns=['SYMBOL', 'DATE', 'Open', 'High', 'Low', 'Close', 'VWAP'])
+    return pd.concat(frames, ignore_index=True)
+
+def analyze_execution(trades_df, portfolio_tracker):
+    """
+    Slippage of every BUY/SELL fill against its session's VWAP, open (arrival),
+    close and high-low range. Sessions come from minute bars where cached and
+    fall back to daily OHLC otherwise. Slippage is in bps, positive = cost.
+    """
+    trades = trades_df[trades_df['BUY/SELL'].isin(['BUY', 'SELL'])].copy()
+    if trades.empty:
+        return pd.DataFrame()
+
+    trades['DATE'] = pd.to_datetime(trades['DATE']).dt.normalize()
+    trades['SYMBOL'] = trades['SYMBOL'].astype(str)
+    symbols = trades['SYMBOL'].unique().tolist()
+
+    minute = get_minute_sessions(load_minute_bars(symbols)).assign(Source='Minute')
+    daily = get_daily_sessions(portfolio_tracker.market_data, symbols).assign(Source='Daily')
+
+    # Minute sessions win over daily ones for the same (symbol, date)
+    sessions = pd.concat([minute.drop(columns=['Bars'], errors='ignore'), daily], ignore_index=True)
+    sessions = sessions.drop_duplicates(['SYMBOL', 'DATE'], keep='first')
+    sessions['DATE'] = pd.to_datetime(sessions['DATE'])
+
+    executions = trades.merge(sessions, on=['SYMBOL', 'DATE'], how='left')
+
+    price = executions['PRICE'].to_numpy(dtype=float)
+    side = np.where(executions['BUY/SELL'].astype(str) == 'BUY', 1.0, -1.0) # Paying up on a buy, selling low on a sell are costs
+    for ref in ['VWAP', 'Open', 'Close']:
+        reference = executions[ref].to_numpy(dtype=float)
+        executions[f'Slip_{ref}_bps'] = side * (price - reference) / reference * 1e4
+
+    day_range = (executions['High'] - executions['Low']).to_numpy(dtype=float)
+    range_position = np.where(day_range > 0, (price - executions['Low'].to_numpy(dtype=float)) / day_range, 0.5)
+    executions['Range_Position'] = np.where(side > 0, range_position, 1 - range_position) # 0 = best price of the day
+
+    executions['Notional'] = executions['QTY'] * executions['PRICE']
+    executions['Cost_VWAP'] = executions['Slip_VWAP_bps'] / 1e4 * executions['Notional']
+    executions['Source'] = executions['Source'].fillna('Missing')
+
+    return executions
+
+def _aggregate(executions, keys):
+    """
+    Notional-weighted slippage and total cost per group.
+    """
+    matched = executions[executions['Source'] != 'Missing']
+    if matched.empty:
+        return pd.DataFrame()
+
+    weighted = matched.assign(Is_Minute=matched['Source'] == 'Minute', **{
+        f'W_{col}': matched[col] * matched['Notional']
+        for col in ['Slip_VWAP_bps', 'Slip_Open_bps', 'Slip_Close_bps', 'Range_Position']
+    })
+    grouped = weighted.groupby(keys, observed=True).agg(
+        Trades=('PRICE', 'size'),
+        Notional=('Notional', 'sum'),
+        Cost_VWAP=('Cost_VWAP', 'sum'),
+        Minute_Sessions=('Is_Minute', 'sum'),
+        **{f'W_{col}': (f'W_{col}', 'sum') for col in ['Slip_VWAP_bps', 'Slip_Open_bps', 'Slip_Close_bps', 'Range_Position']}
+    )
+    for col in ['Slip_VWAP_bps', 'Slip_Open_bps', 'Slip_Close_bps', 'Range_Position']:
+        grouped[col] = grouped.pop(f'W_{col}') / grouped['Notional']
+    return grouped
+
+def summarize_execution(executions):
+    """
+    Slippage aggregated per symbol, per month and per side, plus overall totals.
+    """
+    if executions is None or executions.empty:
+        return {}
+
+    executions = executions.assign(Month=executions['DATE'].dt.to_period('M'), Side=executions['BUY/SELL'].astype(str))
+    overall = _aggregate(executions.assign(All='All'), 'All')
+
+    return {
+        'by_symbol': _aggregate(executions, 'SYMBOL').sort_values('Cost_VWAP', ascending=False),
+        'by_month': _aggregate(executions, 'Month'),
+        'by_side': _aggregate(executions, 'Side'),
+        'overall': overall.iloc[0] if not overall.empty else None,
+        'unmatched': int((executions['Source'] == 'Missing').sum()),
+    }
+
+def run_execution_analysis(trades_df, portfolio_tracker):
+    """
+    Trade-level slippage plus its per-symbol, per-month and per-side aggregates.
+    """
+    start_time = time.perf_counter()
+    executions = analyze_execution(trades_df, portfolio_tracker)
+    execution_summary = summarize_execution(executions)
+
+    if execution_summary:
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        n_minute = int((executions['Source'] == 'Minute').sum())
+        print(f"✅ Analyzed execution of {len(executions)} trades ({n_minute} against minute bars) in {elapsed_ms:.1f} ms")
+        if execution_summary['unmatched']:
+            print(f"No session prices for {execution_summary['unmatched']} trades")
+
+    return executions, execution_summary
+
+def get_execution_table(execution_summary):
+    """
+    Per-symbol display table for the report.
+    """
+    by_symbol = execution_summary.get('by_symbol') if execution_summary else None
+    if by_symbol is None or by_symbol.empty:
+        return pd.DataFrame()
+
+    df = by_symbol.reset_index()[['SYMBOL', 'Trades', 'Minute_Sessions', 'Notional', 'Slip_VWAP_bps', 'Slip_Open_bps', 'Slip_Close_bps', 'Range_Position', 'Cost_VWAP']]
+    df.columns = ['Symbol', 'Trades', 'Intraday Matched', 'Notional', 'vs VWAP (bps)', 'vs Open (bps)', 'vs Close (bps)', 'Range Position', 'Cost vs VWAP']
+    df.attrs['formats'] = {
+        'Notional': '${:,.2f}',
+        **{col: '{:.1f}' for col in ['vs VWAP (bps)', 'vs Open (bps)', 'vs Close (bps)']},
+        'Range Position': '{:.0%}',
+        'Cost vs VWAP': '${:,.2f}'
+    }
+    return df
@@ -0,0 +1,283 @@
+import config
+import os
+import re
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+# Trade schema written by the importers (the columns of trade_history.csv)
+TRADE_COLUMNS = ['DATE', 'MARKET', 'SYMBOL', 'BUY/SELL', 'QTY', 'PRICE', 'FEE', 'AMT']
+
+# Broker export layouts. columns: source header (case-insensitive) -> trade column;
+# sides: source action -> BUY/SELL; cash_actions: actions booked as a deposit or
+# withdrawal of CASH by the sign of the amount column; abs_columns: signed in the
+# export (e.g. negative quantity on sells); date_format: None to infer (ISO dates
+# as ISO, the rest day-first if dayfirst).
+BROKER_FORMATS = {
+    'generic': {
+        'columns': {'DATE': 'DATE', 'MARKET': 'MARKET', 'SYMBOL': 'SYMBOL', 'BUY/SELL': 'BUY/SELL', 'QTY': 'QTY', 'PRICE': 'PRICE', 'FEE': 'FEE'},
+        'sides': {'BUY': 'BUY', 'SELL': 'SELL', 'DEPOSIT': 'DEPOSIT', 'WITHDRAW': 'WITHDRAW'},
+        'dayfirst': True,
+    },
+    'ibkr': { # Flex query trades CSV
+        'columns': {'TRADEDATE': 'DATE', 'SYMBOL': 'SYMBOL', 'BUY/SELL': 'BUY/SELL', 'QUANTITY': 'QTY', 'TRADEPRICE': 'PRICE', 'IBCOMMISSION': 'FEE'},
+        'sides': {'BUY': 'BUY', 'SELL': 'SELL'},
+        'abs_columns': ['QTY', 'FEE'],
+        'date_format': '%Y%m%d',
+    },
+    'schwab': { # Account history CSV
+        'columns': {'DATE': 'DATE', 'SYMBOL': 'SYMBOL', 'ACTION': 'BUY/SELL', 'QUANTITY': 'QTY', 'PRICE': 'PRICE', 'FEES & COMM': 'FEE', 'AMOUNT': 'AMOUNT'},
+        'sides': {'BUY': 'BUY', 'SELL': 'SELL', 'REINVEST SHARES': 'BUY'},
+        'cash_actions': ['MONEYLINK TRANSFER', 'WIRE FUNDS', 'WIRE RECEIVED', 'JOURNAL'],
+        'date_format': '%m/%d/%Y',
+    },
+    'ofx': { # Columns produced by read_ofx_chunks
+        'columns': {'DATE': 'DATE', 'SYMBOL': 'SYMBOL', 'ACTION': 'BUY/SELL', 'UNITS': 'QTY', 'UNITPRICE': 'PRICE', 'FEE': 'FEE', 'AMOUNT': 'AMOUNT'},
+        'sides': {'BUY': 'BUY', 'SELL': 'SELL'},
+        'cash_actions': ['CASH'],
+        'abs_columns': ['QTY'],
+        'date_format': '%Y%m%d',
+    },
+}
+
+# --- Readers: yield raw DataFrame chunks of at most chunk_rows rows ---
+def read_csv_chunks(path, broker, chunk_rows=config.IMPORT_CHUNK_ROWS):
+    wanted = set(BROKER_FORMATS[broker]['columns'])
+    return pd.read_csv(path, chunksize=chunk_rows, dtype=str, keep_default_na=False, skip_blank_lines=True,
+                       usecols=lambda c: c.strip().upper() in wanted)
+
+# OFX aggregates holding one investment or cash transaction
+OFX_TRADES = {'BUYSTOCK', 'SELLSTOCK', 'BUYMF', 'SELLMF', 'BUYOTHER', 'SELLOTHER', 'BUYDEBT', 'SELLDEBT', 'BUYOPT', 'SELLOPT'}
+OFX_TAG = re.compile(r'<(/?)([A-Z0-9.]+)>([^<]*)')
+
+def _iter_ofx_tags(path, block_size=1 << 20):
+    """
+    (closing, tag, value) for every OFX tag, read in blocks so SGML (OFX 1.x,
+    one tag per line) and single-line XML (OFX 2.x) files stream the same way.
+    """
+    carry = ''
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for block in iter(lambda: f.read(block_size), ''):
+            text = carry + block
+            cut = text.rfind('<')
+            text, carry = text[:cut], text[cut:]
+            for closing, tag, value in OFX_TAG.findall(text):
+                yield closing == '/', tag, value.strip()
+    for closing, tag, value in OFX_TAG.findall(carry):
+        yield closing == '/', tag, value.strip()
+
+def _ofx_frame(rows):
+    df = pd.DataFrame(rows).reindex(columns=['DATE', 'SYMBOL', 'ACTION', 'UNITS', 'UNITPRICE', 'COMMISSION', 'FEES', 'AMOUNT']).fillna('')
+    df['FEE'] = (_to_number(df.pop('COMMISSION')).fillna(0) + _to_number(df.pop('FEES')).fillna(0)).astype(str)
+    return df
+
+def read_ofx_chunks(path, broker='ofx', chunk_rows=config.IMPORT_CHUNK_ROWS):
+    """
+    Investment (BUY*/SELL*) and cash (INVBANKTRAN) transactions of an OFX/QFX
+    statement. A first pass maps security ids to tickers from the SECLIST.
+    """
+    tickers, security = {}, {}
+    for closing, tag, value in _iter_ofx_tags(path):
+        if tag == 'SECINFO' and closing:
+            if 'UNIQUEID' in security and 'TICKER' in security:
+                tickers[security['UNIQUEID']] = security['TICKER']
+            security = {}
+        elif value:
+            security[tag] = value
+
+    rows, current, kind = [], {}, None
+    for closing, tag, value in _iter_ofx_tags(path):
+        if not closing and not value and (tag in OFX_TRADES or tag == 'INVBANKTRAN'):
+            current, kind = {}, tag
+        elif closing and tag == kind:
+            if kind == 'INVBANKTRAN':
+                rows.append({'DATE': current.get('DTPOSTED', '')[:8], 'SYMBOL': 'CASH', 'ACTION': 'CASH', 'AMOUNT': current.get('TRNAMT', '')})
+            else:
+                rows.append({
+                    'DATE': current.get('DTTRADE', '')[:8],
+                    'SYMBOL': tickers.get(current.get('UNIQUEID'), current.get('UNIQUEID', '')),
+                    'ACTION': 'BUY' if kind.startswith('BUY') else 'SELL',
+                    'UNITS': current.get('UNITS', ''),
+                    'UNITPRICE': current.get('UNITPRICE', ''),
+                    'COMMISSION': current.get('COMMISSION', ''),
+                    'FEES': current.get('FEES', ''),
+                })
+            kind = None
+            if len(rows) >= chunk_rows:
+                yield _ofx_frame(rows)
+                rows = []
+        elif kind is not None and value:
+            current[tag] = value
+    if rows:
+        yield _ofx_frame(rows)
+
+READERS = {'.csv': read_csv_chunks, '.ofx': read_ofx_chunks, '.qfx': read_ofx_chunks}
+
+# --- Mapping and validation ---
+def _to_datetime(values, spec):
+    """
+    Dates in the layout's date_format or, without one, ISO (YYYY-MM-DD, as in
+    trade_history.csv) per row and the rest as the layout's dayfirst says.
+    """
+    if spec.get('date_format'):
+        return pd.to_datetime(values, format=spec['date_format'], errors='coerce')
+    is_iso = values.str.match(r'\d{4}-')
+    dates = pd.Series(pd.NaT, index=values.index, dtype='datetime64[ns]')
+    if is_iso.any():
+        dates[is_iso] = pd.to_datetime(values[is_iso], format='ISO8601', errors='coerce')
+    if not is_iso.all():
+        dates[~is_iso] = pd.to_datetime(values[~is_iso], dayfirst=spec.get('dayfirst', False), errors='coerce')
+    return dates
+
+def _to_number(values):
+    """
+    Numbers from text like "$1,234.50"; blanks and junk become NaN.
+    """
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype(float)
+    numbers = pd.to_numeric(values, errors='coerce').astype(float)
+    retry = numbers.isna() & values.astype(str).str.strip().ne('')
+    if retry.any(): # Only the formatted ones pay for the regex
+        numbers[retry] = pd.to_numeric(values[retry].astype(str).str.replace(r'[$,\s]', '', regex=True), errors='coerce')
+    return numbers
+
+def normalize_chunk(chunk, broker, row_offset=0):
+    """
+    Map one raw chunk to the trade schema with vectorized transforms and
+    validate it in bulk. Returns the valid trades and a (ROW, REASON, VALUE)
+    error report; ROW counts data rows from 1.
+    """
+    spec = BROKER_FORMATS[broker]
+    chunk = chunk.rename(columns=lambda c: c.strip().upper())
+    rows = pd.Series(np.arange(row_offset + 1, row_offset + len(chunk) + 1), index=chunk.index)
+    raw = pd.DataFrame({target: chunk[source] if source in chunk.columns else pd.Series('', index=chunk.index, dtype=object)
+                        for source, target in spec['columns'].items()})
+
+    action = raw['BUY/SELL'].astype(str).str.strip().str.upper()
+    df = pd.DataFrame(index=chunk.index)
+    df['DATE'] = _to_datetime(raw['DATE'].astype(str).str.strip().str.split(' ', n=1).str[0], spec)
+    df['MARKET'] = raw['MARKET'].astype(str).str.strip().replace('', spec.get('market', 'US')) if 'MARKET' in raw else spec.get('market', 'US')
+    df['SYMBOL'] = raw['SYMBOL'].astype(str).str.strip().str.upper()
+    df['BUY/SELL'] = action.map(spec['sides'])
+    df['QTY'] = _to_number(raw['QTY'])
+    df['PRICE'] = _to_number(raw['PRICE'])
+    df['FEE'] = _to_number(raw['FEE']).fillna(0.0)
+    for col in spec.get('abs_columns', []):
+        df[col] = df[col].abs()
+
+    # Cash movements: one CASH unit priced at the amount, side from its sign
+    is_cash = action.isin(spec.get('cash_actions', []))
+    if is_cash.any():
+        amount = _to_number(raw['AMOUNT'])
+        df.loc[is_cash, 'BUY/SELL'] = np.where(amount[is_cash] >= 0, 'DEPOSIT', 'WITHDRAW')
+        df.loc[is_cash, 'SYMBOL'] = 'CASH'
+        df.loc[is_cash, 'QTY'] = 1.0
+        df.loc[is_cash, 'PRICE'] = amount[is_cash].abs()
+
+    checks = [
+        (df['DATE'].isna(), 'DATE', 'unparseable date'),
+        (df['SYMBOL'].isin(['', 'NAN']), 'SYMBOL', 'missing symbol'),
+        (df['BUY/SELL'].isna(), 'BUY/SELL', 'unknown action'),
+        (df['QTY'].isna() | (df['QTY'] <= 0) | (df['QTY'] % 1 != 0), 'QTY', 'quantity not a positive whole number'),
+        (df['PRICE'].isna() | (df['PRICE'] <= 0), 'PRICE', 'price missing or not positive'),
+        (_to_number(raw['FEE']).isna() & raw['FEE'].astype(str).str.strip().ne(''), 'FEE', 'fee not a number'),
+    ]
+    errors = pd.concat([
+        pd.DataFrame({'ROW': rows[mask], 'REASON': reason, 'VALUE': raw.loc[mask, column].astype(str) if column in raw else ''})
+        for mask, column, reason in checks if mask.any()
+    ] or [pd.DataFrame(columns=['ROW', 'REASON', 'VALUE'])], ignore_index=True)
+
+    invalid = np.zeros(len(df), dtype=bool)
+    for mask, _, _ in checks:
+        invalid |= mask.to_numpy()
+    trades = df[~invalid].copy()
+    trades['QTY'] = trades['QTY'].astype('int64')
+    trades['FEE'] = trades['FEE'].round(3)
+    trades['AMT'] = (trades['QTY'] * trades['PRICE']).round(3)
+    return trades[TRADE_COLUMNS], errors.sort_values('ROW', kind='stable')
+
+def trade_fingerprints(trades):
+    """
+    64-bit hash per trade over date, symbol, side, quantity, price and fee.
+    """
+    key = pd.DataFrame({
+        'DATE': pd.to_datetime(trades['DATE']).dt.normalize().astype('datetime64[s]'),
+        'SYMBOL': trades['SYMBOL'].astype(str),
+        'BUY/SELL': trades['BUY/SELL'].astype(str),
+        'QTY': trades['QTY'].astype('int64'),
+        'PRICE': trades['PRICE'].astype(float).round(6),
+        'FEE': trades['FEE'].astype(float).round(6),
+    })
+    return pd.util.hash_pandas_object(key, index=False).to_numpy()
+
+def _known_fingerprints(target, chunk_rows):
+    """
+    How many times each trade fingerprint is already in the target CSV, streamed.
+    """
+    known = []
+    if os.path.exists(target):
+        for chunk in pd.read_csv(target, chunksize=chunk_rows):
+            known.append(trade_fingerprints(chunk))
+    return pd.Series(np.concatenate(known) if known else np.array([], dtype=np.uint64)).value_counts()
+
+def import_statement(path, broker='generic', target=config.TRADE_IMPORT_FILE, chunk_rows=config.IMPORT_CHUNK_ROWS, error_path=None):
+    """
+    Stream a broker CSV/OFX export into the target trade CSV, one chunk at a
+    time. Invalid rows go to the error report and trades already in the target
+    are skipped. Returns the import counts.
+    """
+    start_time = time.perf_counter()
+    reader = READERS.get(os.path.splitext(path)[1].lower())
+    if reader is None:
+        raise ValueError(f"No importer for {path} (supported: {', '.join(READERS)})")
+    if broker not in BROKER_FORMATS:
+        raise ValueError(f"Unknown broker format {broker} (known: {', '.join(BROKER_FORMATS)})")
+    error_path = error_path or os.path.splitext(target)[0] + '_errors.csv'
+
+    known = _known_fingerprints(target, chunk_rows)
+    seen = pd.Series(dtype='int64') # Fingerprint counts of this statement's earlier chunks
+    stats = {'rows': 0, 'imported': 0, 'duplicates': 0, 'errors': 0}
+    write_header = not os.path.exists(target)
+    errors_written = False
+    for chunk in reader(path, broker, chunk_rows=chunk_rows):
+        trades, errors = normalize_chunk(chunk, broker, row_offset=stats['rows'])
+        stats['rows'] += len(chunk)
+
+        # Identical trades (e.g. split fills) are counted, not collapsed: the n-th copy in
+        # the statement is only a duplicate if the target already holds n copies
+        fingerprints = pd.Series(trade_fingerprints(trades) if not trades.empty else np.array([], dtype=np.uint64))
+        occurrence = seen.reindex(fingerprints, fill_value=0).to_numpy() + fingerprints.groupby(fingerprints).cumcount().to_numpy()
+        duplicate = occurrence < known.reindex(fingerprints, fill_value=0).to_numpy()
+        seen = seen.add(fingerprints.value_counts(), fill_value=0).astype('int64')
+        new_trades = trades[~duplicate]
+
+        if not new_trades.empty:
+            new_trades.assign(DATE=new_trades['DATE'].dt.strftime('%Y-%m-%d')).to_csv(target, mode='a', header=write_header, index=False)
+            write_header = False
+        if not errors.empty:
+            errors.to_csv(error_path, mode='a' if errors_written else 'w', header=not errors_written, index=False)
+            errors_written = True
+
+        stats['imported'] += len(new_trades)
+        stats['duplicates'] += int(duplicate.sum())
+        stats['errors'] += errors['ROW'].nunique()
+
+    elapsed_ms = (time.perf_counter() - start_time) * 1000
+    print(f"✅ Imported {stats['imported']} of {stats['rows']} rows from {os.path.basename(path)} in {elapsed_ms:.0f} ms "
+          f"({stats['duplicates']} duplicates, {stats['errors']} invalid)")
+    if errors_written:
+        print(f"Invalid rows written to {error_path}")
+    stats['elapsed_ms'] = elapsed_ms
+    return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import a broker statement into the trade CSV")
+    parser.add_argument('path', help='Broker export (.csv, .ofx or .qfx)')
+    parser.add_argument('--broker', default=None, choices=sorted(BROKER_FORMATS), help='Export layout (default: generic for CSV, ofx for OFX/QFX)')
+    parser.add_argument('--target', default=config.TRADE_IMPORT_FILE, help='Trade CSV to append to')
+    args = parser.parse_args()
+
+    config.make_dirs()
+    broker = args.broker or ('generic' if args.path.lower().endswith('.csv') else 'ofx')
+    import_statement(args.path, broker=broker, target=args.target)
@@ -0,0 +1,26 @@
+import importlib
+import threading
+
+class LazyModule:
+    """
+    Stand-in for a heavy module that is only imported on first attribute
+    access, so commands that never touch it do not pay for it at startup.
+    The module attribute holding it can still be replaced (e.g. by a fake
+    yfinance in the benchmark).
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock() # Pipeline workers may reach for it at the same time
+
+    def _load(self):
+        with self._lock:
+            if self._module is None:
+                self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._module or self._load(), attr)
+
+    def __repr__(self):
+        return f"<lazy module '{self._name}' ({'loaded' if self._module is not None else 'not loaded'})>"
@@ -1,17 +1,25 @@
 import time
 from datetime import datetime
 import os
+import numbers
+import threading
+import posixpath
 import shutil
 import pandas as pd
 import webbrowser
 import argparse
-import paramiko
+from functools import partial
 
 import config 
 import data_manager
 import portfolio_tracker as tracker
 import portfolio_analyzer as analyzer
 import report_manager
+import pipeline
+import publisher
+import profiler
+import watcher
+import api
 
 pd.set_option('display.max_rows', 100)
 pd.set_option('display.float_format', '{:.2f}'.format)
@@ -22,132 +30,303 @@ try:
 except AttributeError:
     pass
     
+@profiler.profiled('trade_history', memory=True)
 def get_trade_history() -> pd.DataFrame:
-    data_manager.create_trade_csv()
-    trades_df = data_manager.load_trade_history(filepath=config.TRADE_HISTORY_FILE)
+    trades_df = data_manager.get_trade_ledger()
     return trades_df
 
-def get_portfolio_history(portfolio_tracker, update=True) -> pd.DataFrame:
-    portfolio_tracker.fetch_market_data(update=update)
-    history_df = portfolio_tracker.process_portfolio()
-    return history_df
-
-def create_report(figs, df_alloc, df_trades, open_report = False):
-    report_path = report_manager.create_report(figs, df_alloc, df_trades)
+@profiler.profiled('create_report', memory=True)
+def create_report(figs, df_alloc, df_trades, df_risk=None, df_execution=None, open_report = False):
+    report_path, report_stats = report_manager.create_report(figs, df_alloc, df_trades, df_risk, df_execution)
     latest_path = os.path.join(config.OUTPUT_DIR, "portfolio_report_latest.html")
+    if report_stats['reused']:
+        print(f"♻️ Reused {len(report_stats['reused'])} unchanged report sections (saved ~{report_stats['saved_ms']:.0f} ms); rebuilt: {', '.join(report_stats['rebuilt']) or 'none'}")
+    else:
+        print(f"✅ Rebuilt all {len(report_stats['rebuilt'])} report sections")
     print(f"✅ Saved report to: {report_path}")
     print(f"✅ Updated main report: {latest_path}")
     shutil.copy(report_path, latest_path)
+    latest_variants = []
+    for variant in report_stats['variants']:
+        latest_variants.append(latest_path + variant[len(report_path):])
+        shutil.copy(variant, latest_variants[-1])
     if open_report:
         is_open = webbrowser.open(report_path.as_uri())
         if is_open:
             print(f"✅ Opened report in browser")
         else:
             print(f"❌ Could not open browser automatically. Please open the file manually.")
-    return report_path, latest_path
+    return report_path, latest_path, latest_variants, report_stats['assets']
 
-def upload_to_host(file_path):
+@profiler.profiled('upload')
+def upload_to_host(file_path, variants=(), assets=()):
+    """
+    Publish the hashed assets, the precompressed variants and then the page itself.
+    """
     print("📤 Starting upload to host...")
+    remote_dir = posixpath.dirname(config.REMOTE_REPORT_PATH)
+    uploads = [(asset, posixpath.join(remote_dir, 'assets', os.path.basename(asset))) for asset in assets]
+    uploads += [(variant, config.REMOTE_REPORT_PATH + variant[len(file_path):]) for variant in variants]
+    uploads.append((file_path, config.REMOTE_REPORT_PATH))
 
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    
-    private_key_path = os.path.expanduser("~/.ssh/id_ed25519")
-    
     try:
-        ssh.connect(
-            hostname=config.HOST, 
-            username=config.USER,
-            key_filename=private_key_path,
-            look_for_keys=True,
-            timeout=10
-        )
-
-        sftp = ssh.open_sftp()
-        sftp.put(file_path, config.REMOTE_REPORT_PATH)
-
-        sftp.close()
-        ssh.close()
+        publisher.get_publisher().publish(uploads)
         print("✅ Success! Portfolio updated on host.")
-    
     except Exception as e:
         print(f"❌ SRCF Upload failed: {str(e)}")
+        raise
 
-def main():
-    print("=" * 50)
-    print(f"Updating portfolio performance as of {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ET")
-    print("-" * 50)
-    df_trades = get_trade_history()
-    
-    # Initialise tracker
+# --- Stages ---
+# Config and source files each stage's output depends on, as its checkpoint version
+RECONSTRUCT_CONFIG = ['DIVIDEND_TAX_RATE', 'NO_DIVIDEND_TAX']
+RECONSTRUCT_CODE = ['portfolio_tracker.py']
+ANALYZE_CONFIG = ['METRICS_BENCHMARK', 'PLOT_BENCHMARK', 'PLOT_MAX_POINTS', 'PLOT_WEBGL_THRESHOLD', 'PLOT_ZOOM_LEVELS', 'QUANT_WINDOW',
+                  'VAR_CONFIDENCE', 'VAR_WINDOW', 'STRESS_SCENARIOS', 'STRESS_MONTHLY_SINCE', 'FACTOR_PROXIES', 'FACTOR_SHOCKS']
+ANALYZE_CODE = ['portfolio_analyzer.py', 'scenario_engine.py', 'execution_analyzer.py', 'pipeline.py']
+RENDER_CONFIG = ['REPORT_ASSETS', 'REPORT_PRECOMPRESS', 'REPORT_SHARED_DATA', 'REPORT_TABLE_CHUNK_ROWS']
+RENDER_CODE = ['report_manager.py', 'main.py', os.path.join('templates', 'report_template.html')]
+
+def _source_signature(path=config.TRADE_EXCEL_SOURCE):
+    try:
+        stat = os.stat(path)
+        return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+    except (OSError, TypeError):
+        return None
+
+def ingest(source=None):
+    """
+    Typed trades. source (the trade file's path, size and mtime) only keys the checkpoint.
+    """
+    return get_trade_history()
+
+def fetch(df_trades, update=True):
+    """
+    Market data for the traded symbols: downloaded, or with update=False read from the local cache.
+    """
     portfolio_tracker = tracker.PortfolioTracker(df_trades)
-    df_history = get_portfolio_history(portfolio_tracker, update=True) 
-
-    # Analysis and plots
-    metrics = analyzer.calculate_performance_metrics(df_history)
-    fig_wealth = analyzer.get_wealth_plot(df_history, show = False)
-    fig_drawdown = analyzer.get_drawdown_plot(df_history, show=False)
-    fig_returns = analyzer.get_returns_plot(df_history, show=False)
-    fig_quant = analyzer.get_quant_plots(df_history, show=False, windows=config.QUANT_WINDOW)
-    fig_alloc, df_alloc, category_values, sector_values, current_values, current_holdings = analyzer.get_allocation(df_history, df_trades, portfolio_tracker, show=False)
-
-    # Summary sheet 
-    summary_sheet = analyzer.get_summary_sheet(df_history, category_values, sector_values, current_values, current_holdings)
-
-    figs = {
-        "wealth": fig_wealth,
-        "drawdown": fig_drawdown,
-        "returns": fig_returns,
-        "alloc": fig_alloc,
-        "quant": fig_quant,
-        "summary": summary_sheet
-    }
-
-    _, latest_path = create_report(figs, df_alloc, df_trades)
-    upload_to_host(latest_path)
+    with profiler.span('fetch_market_data', memory=True):
+        portfolio_tracker.fetch_market_data(update=update)
+    return pipeline.MarketData(portfolio_tracker.market_data, portfolio_tracker.dividends, portfolio_tracker.splits,
+                               portfolio_tracker.asset_info, datetime.now(watcher.MARKET_TZ) if update else None)
 
-    print("\n")
+def market_data_fresh(market, update=True):
+    """
+    Downloaded market data is reused until a refresh is due (see watcher.refresh_due); any will do without update.
+    """
+    return not update or (market.fetched_at is not None and not watcher.refresh_due(market.fetched_at, datetime.now(watcher.MARKET_TZ)))
+
+def reconstruct(df_trades, market, end_date):
+    """
+    The tracker with its daily history (df_portfolio) and weights rebuilt up to end_date.
+    """
+    portfolio_tracker = tracker.PortfolioTracker(df_trades)
+    portfolio_tracker.market_data, portfolio_tracker.dividends, portfolio_tracker.splits, portfolio_tracker.asset_info = market[:4]
+    portfolio_tracker.end_date = end_date
+    with profiler.span('process_portfolio', memory=True):
+        portfolio_tracker.process_portfolio()
+    return portfolio_tracker
+
+def analyze(df_trades, portfolio_tracker, update=True):
+    """
+    Performance metrics, shadow portfolios and the report's figures, tables and summary sheet.
+    """
+    df_history = portfolio_tracker.df_portfolio
+    # Analysis (adds the return and shadow portfolio columns the tasks read)
+    with profiler.span('analysis', memory=True):
+        metrics = analyzer.calculate_performance_metrics(df_history)
+        analyzer.calculate_shadow_portfolios(df_history, config.PLOT_BENCHMARK)
+
+    # Figures, tables and summary sheet as concurrent tasks
+    tasks = pipeline.get_report_tasks(update=update)
+    results, _ = pipeline.run_tasks(tasks, {'history': df_history, 'trades': df_trades, 'tracker': portfolio_tracker})
+    return pipeline.Analysis(df_history, metrics, pipeline.serialize_results(results, tasks))
+
+def render(df_trades, analysis):
+    figs, df_alloc, df_risk, df_execution = pipeline.get_report_inputs(analysis.results)
+    return pipeline.Report(*create_report(figs, df_alloc, df_trades, df_risk, df_execution), datetime.now())
 
-def test():
+def report_exists(report):
+    return os.path.exists(report.report_path) and os.path.exists(report.latest_path)
+
+def publish(report):
+    upload_to_host(report.latest_path, report.variants, report.assets)
+    return report
+
+def get_stages(update=True):
+    """
+    A run as checkpointed stages (see pipeline.run_stages). Without update the
+    market data comes from the checkpoint or local cache and nothing is published.
+    """
+    stages = [
+        pipeline.Stage('ingest', ingest, [], pd.DataFrame, params={'source': _source_signature()}),
+        pipeline.Stage('fetch', partial(fetch, update=update), ['ingest'], pipeline.MarketData, fresh=partial(market_data_fresh, update=update)),
+        pipeline.Stage('reconstruct', reconstruct, ['ingest', 'fetch'], tracker.PortfolioTracker, params={'end_date': pd.Timestamp.now().normalize()},
+                       version=(pipeline.config_digest(RECONSTRUCT_CONFIG), pipeline.code_digest(RECONSTRUCT_CODE))),
+        pipeline.Stage('analyze', analyze, ['ingest', 'reconstruct'], pipeline.Analysis, params={'update': update},
+                       version=(pipeline.config_digest(ANALYZE_CONFIG), pipeline.code_digest(ANALYZE_CODE))),
+        pipeline.Stage('render', render, ['ingest', 'analyze'], pipeline.Report, fresh=report_exists,
+                       version=(pipeline.config_digest(RENDER_CONFIG), pipeline.code_digest(RENDER_CODE))),
+    ]
+    if update:
+        stages.append(pipeline.Stage('publish', publish, ['render'], pipeline.Report))
+    return stages
+
+def publish_to_api(api_state, analysis, portfolio_tracker):
+    api_state.update_from_run(analysis.history, analysis.metrics, analysis.results, portfolio_tracker)
+
+def build_report(df_trades, portfolio_tracker, update=True, api_state=None):
+    """
+    Analyze and render a reconstructed tracker in memory (watch mode), publishing to api_state when serving.
+    """
+    analysis = analyze(df_trades, portfolio_tracker, update=update)
+    if api_state is not None:
+        publish_to_api(api_state, analysis, portfolio_tracker)
+    return render(df_trades, analysis)
+
+def run(update=True, only=None, start=None, api_state=None):
+    """
+    A full run, resumed from the checkpoints of the stages whose inputs are
+    unchanged (only/start select stages as in pipeline.run_stages).
+    """
     print("=" * 50)
     print(f"Updating portfolio performance as of {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ET")
     print("-" * 50)
-    df_trades = get_trade_history()
-    
-    # Initialise tracker
-    portfolio_tracker = tracker.PortfolioTracker(df_trades)
-    df_history = get_portfolio_history(portfolio_tracker, update=False) 
-
-    # Analysis and plots
-    metrics = analyzer.calculate_performance_metrics(df_history)
-    fig_wealth = analyzer.get_wealth_plot(df_history, show = False)
-    fig_drawdown = analyzer.get_drawdown_plot(df_history, show=False)
-    fig_returns = analyzer.get_returns_plot(df_history, show=False)
-    fig_quant = analyzer.get_quant_plots(df_history, show=False, windows=config.QUANT_WINDOW)
-    fig_alloc, df_alloc, category_values, sector_values, current_values, current_holdings = analyzer.get_allocation(df_history, df_trades, portfolio_tracker, show=False)
-
-    # Summary sheet 
-    summary_sheet = analyzer.get_summary_sheet(df_history, category_values, sector_values, current_values, current_holdings)
-
-    figs = {
-        "wealth": fig_wealth,
-        "drawdown": fig_drawdown,
-        "returns": fig_returns,
-        "alloc": fig_alloc,
-        "quant": fig_quant,
-        "summary": summary_sheet
-    }
-
-    _, latest_path = create_report(figs, df_alloc, df_trades)
+    if update and (only is None or 'publish' in only):
+        publisher.get_publisher().connect_async() # SSH handshake overlaps the report build
+
+    artifacts = pipeline.run_stages(get_stages(update=update), only=only, start=start, outputs=['reconstruct', 'analyze'] if api_state is not None else ())
+    if api_state is not None and 'analyze' in artifacts:
+        publish_to_api(api_state, artifacts['analyze'], artifacts['reconstruct'])
 
     print("\n")
+    return artifacts
+
+def metrics_only(update=True, api_state=None):
+    """
+    Fast path: the ingest, fetch and reconstruct stages (resumed from their
+    checkpoints when possible), then the performance metrics. No figures,
+    report or upload, so plotly, jinja2 and paramiko never load.
+    """
+    df_history = pipeline.run_stages(get_stages(update=update)[:3], outputs=['reconstruct'])['reconstruct'].df_portfolio
+    with profiler.span('analysis', memory=True):
+        metrics = analyzer.calculate_performance_metrics(df_history)
+
+    print(f"Performance metrics, {metrics['first_date']:%Y-%m-%d} to {df_history.index[-1]:%Y-%m-%d}")
+    for key, value in metrics.items():
+        if isinstance(value, numbers.Real):
+            print(f"   {key:<26} {value:14,.4f}")
+    if api_state is not None:
+        api_state.update(portfolio=df_history, metrics=metrics)
+    return metrics
+
+def refresh_tracker(previous, trades_changed, refresh, update=True):
+    """
+    Tracker for the watch loop. Unchanged trades keep the tracker (and its
+    price panel); changed trades get a new tracker that inherits the loaded
+    market data, so only new symbols are fetched unless a refresh is due.
+    """
+    if previous is not None and not trades_changed:
+        portfolio_tracker = previous
+    else:
+        portfolio_tracker = tracker.PortfolioTracker(get_trade_history())
+        if previous is not None:
+            portfolio_tracker.market_data.update(previous.market_data)
+            portfolio_tracker.dividends.update(previous.dividends)
+            portfolio_tracker.splits.update(previous.splits)
+            portfolio_tracker.asset_info.update(previous.asset_info)
+    portfolio_tracker.end_date = datetime.now()
+
+    new_symbols = [sym for sym in portfolio_tracker.symbols if sym not in portfolio_tracker.market_data]
+    with profiler.span('fetch_market_data', memory=True):
+        if previous is None:
+            portfolio_tracker.fetch_market_data(update=update)
+        elif refresh and update:
+            portfolio_tracker.fetch_market_data(update=True)
+        elif new_symbols:
+            portfolio_tracker.fetch_market_data(update=update, symbols=new_symbols)
+    return portfolio_tracker
+
+def watch(update=True, api_state=None):
+    """
+    Daemon mode: keep the tracker, its price panel and the report section
+    cache in memory. Rebuild and republish when the trade file changes or a
+    market data refresh is due (see watcher.refresh_due). With update=False
+    the cached market data is used and nothing is uploaded. SIGINT/SIGTERM
+    stop the loop and flush the metadata cache.
+    """
+    stop = threading.Event()
+    watcher.install_shutdown_handlers(stop)
+    trade_file = watcher.FileWatcher(config.TRADE_EXCEL_SOURCE)
+    if update:
+        publisher.get_publisher().connect_async()
+    print(f"👀 Watching {config.TRADE_EXCEL_SOURCE} (market data every {config.WATCH_REFRESH_MINUTES} min while the market is open)")
+
+    portfolio_tracker = None
+    last_refresh = None
+    try:
+        while not stop.is_set():
+            now = datetime.now(watcher.MARKET_TZ)
+            trades_changed = portfolio_tracker is None or trade_file.changed()
+            refresh = update and watcher.refresh_due(last_refresh, now)
+            if trades_changed or refresh:
+                print("=" * 50)
+                print(f"{'Trades changed' if trades_changed else 'Refreshing market data'} at {now.strftime('%Y-%m-%d %H:%M:%S')} ET")
+                print("-" * 50)
+                if refresh:
+                    last_refresh = now # A failed refresh waits for the next slot rather than retrying every poll
+                watcher.clear_analysis_caches()
+                try:
+                    portfolio_tracker = refresh_tracker(portfolio_tracker, trades_changed, refresh, update=update)
+                    with profiler.span('process_portfolio', memory=True):
+                        portfolio_tracker.process_portfolio()
+                    report = build_report(portfolio_tracker.trades, portfolio_tracker, update=refresh, api_state=api_state)
+                    if update:
+                        publish(report)
+                except Exception as e:
+                    print(f"❌ Update failed: {e}")
+                watcher.enforce_memory_limit()
+            stop.wait(config.WATCH_POLL_SECONDS)
+    finally:
+        if portfolio_tracker is not None:
+            portfolio_tracker.save_metadata()
+        publisher.get_publisher().close()
+        print("✅ Flushed caches, stopped watching")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Portfolio Tracker Runner")
-    parser.add_argument('--test', action='store_true', help='Run in test mode (no data update)')
+    parser.add_argument('--test', action='store_true', help='Skip the market data download (checkpointed or locally cached prices) and the upload')
+    parser.add_argument('--watch', action='store_true', help='Keep running: rebuild and republish when the trade file changes or market data is due (with --test: cached data, no upload)')
+    parser.add_argument('--metrics', action='store_true', help='Only rebuild the history and print the performance metrics (with --test: from cached data)')
+    parser.add_argument('--serve', action='store_true', help=f'Serve the results as JSON on http://{config.API_HOST}:{config.API_PORT}/api (kept current with --watch; otherwise until Ctrl+C)')
+    stage_names = [stage.name for stage in get_stages()]
+    stage_selection = parser.add_mutually_exclusive_group()
+    stage_selection.add_argument('--only', nargs='+', choices=stage_names, metavar='STAGE', help=f'Run just these stages ({", ".join(stage_names)}); the others come from their last checkpoints')
+    stage_selection.add_argument('--from', dest='start', choices=stage_names, metavar='STAGE', help='Rerun this stage and every later one, taking earlier stages from their checkpoints')
+    parser.add_argument('--profile', action='store_true', help='Trace stages, network calls, cache hits and memory; writes a Chrome trace to data/profiles')
+    parser.add_argument('--profile-memory', action='store_true', help='With --profile, also trace Python allocations (slower)')
     args = parser.parse_args()
 
-    if args.test:
-        test()
-    else:
-        main()
+    config.make_dirs()
+    if args.profile:
+        profiler.enable(trace_memory=args.profile_memory)
+    api_state = api.ApiState() if args.serve else None
+    server = api.ApiServer(api_state).start() if args.serve else None
+    try:
+        if args.watch:
+            watch(update=not args.test, api_state=api_state)
+        elif args.metrics:
+            metrics_only(update=not args.test, api_state=api_state)
+        else:
+            run(update=not args.test, only=args.only, start=args.start, api_state=api_state)
+        if server is not None and not args.watch:
+            stop = threading.Event()
+            watcher.install_shutdown_handlers(stop)
+            print("🌐 Serving until Ctrl+C")
+            stop.wait()
+    finally:
+        if server is not None:
+            server.stop()
+        if args.profile:
+            trace_path = profiler.write_trace(os.path.join(config.PROFILE_DIR, f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"))
+            profiler.print_summary()
+            print(f"✅ Saved profile trace to {trace_path} (open in chrome://tracing or ui.perfetto.dev)")
@@ -0,0 +1,342 @@
+import config
+import os
+import json
+import time
+import pickle
+import hashlib
+import threading
+import concurrent.futures
+from functools import partial
+from datetime import datetime
+from collections import namedtuple
+
+import portfolio_analyzer as analyzer
+import scenario_engine
+import execution_analyzer
+import profiler
+from lazy import LazyModule
+
+go = LazyModule('plotly.graph_objects')
+pio = LazyModule('plotly.io')
+
+# One unit of report work: func(*[results[name] for name in inputs])
+Task = namedtuple('Task', ['name', 'func', 'inputs'])
+
+# One checkpointed step of a run: func(*[artifacts[name] for name in inputs], **params) returns an
+# artifact of type kind. params are part of the checkpoint key, as is version (not passed to func;
+# e.g. digests of the config and code the stage depends on); fresh(artifact) can turn down a
+# checkpoint whose key still matches (e.g. market data that is due a refresh)
+Stage = namedtuple('Stage', ['name', 'func', 'inputs', 'kind', 'params', 'fresh', 'version'], defaults=({}, None, None))
+
+# Stage artifacts
+MarketData = namedtuple('MarketData', ['market_data', 'dividends', 'splits', 'asset_info', 'fetched_at']) # fetched_at is None when loaded from the local cache
+Analysis = namedtuple('Analysis', ['history', 'metrics', 'results']) # results: report task results, figures as plain dicts
+Report = namedtuple('Report', ['report_path', 'latest_path', 'variants', 'assets', 'built_at'])
+
+def _serialize(result):
+    """
+    Figures as plain plotly dicts (cheap to pickle across processes), recursing into tuples.
+    """
+    if isinstance(result, go.Figure):
+        return result.to_plotly_json()
+    if isinstance(result, tuple):
+        return tuple(_serialize(item) for item in result)
+    return result
+
+def serialize_results(results, tasks):
+    """
+    The tasks' results alone (no context), figures as plain dicts, e.g. for a checkpoint.
+    """
+    return {task.name: _serialize(results[task.name]) for task in tasks}
+
+def _run_task(func, args, serialize):
+    """
+    Worker side: run one task and time it. Returns the result, the start
+    (perf_counter_ns), the duration in ns and the worker's pid and thread id.
+    """
+    start_ns = time.perf_counter_ns()
+    result = func(*args)
+    if serialize:
+        result = _serialize(result)
+    return result, start_ns, time.perf_counter_ns() - start_ns, os.getpid(), threading.get_ident()
+
+def run_tasks(tasks, context, executor=config.PIPELINE_EXECUTOR, max_workers=config.PIPELINE_WORKERS):
+    """
+    Run the tasks on a thread or process pool, each as soon as its inputs
+    (context values or other tasks' results) are available.
+    Returns the results by name (context included) and per-task wall times in ms.
+    """
+    pio.templates['plotly_white'] # Load the lazily-built template once, before the workers race for it
+
+    results = dict(context)
+    timings = {}
+    pending = {task.name: task for task in tasks}
+    serialize = executor == 'process'
+    pool_class = concurrent.futures.ProcessPoolExecutor if serialize else concurrent.futures.ThreadPoolExecutor
+
+    start_time = time.perf_counter_ns()
+    with pool_class(max_workers=max_workers) as pool:
+        running = {}
+        while pending or running:
+            for name, task in list(pending.items()):
+                if all(i in results for i in task.inputs):
+                    running[pool.submit(_run_task, task.func, [results[i] for i in task.inputs], serialize)] = name
+                    del pending[name]
+            if not running:
+                raise ValueError(f"Report tasks with unresolvable inputs: {sorted(pending)}")
+
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                results[name], start_ns, duration_ns, pid, tid = future.result()
+                timings[name] = duration_ns / 1e6
+                profiler.record(f"task:{name}", start_ns, duration_ns, pid=pid, tid=tid) # Timed in the worker, so process pools are traced too
+
+    elapsed_ns = time.perf_counter_ns() - start_time
+    elapsed_ms = elapsed_ns / 1e6
+    slowest = max(timings, key=timings.get) if timings else None
+    profiler.record('report_tasks', start_time, elapsed_ns)
+    profiler.snapshot('report_tasks')
+    print(f"✅ Ran {len(timings)} report tasks in {elapsed_ms:.0f} ms on a {executor} pool "
+          f"(task total {sum(timings.values()):.0f} ms, slowest {slowest} {timings.get(slowest, 0):.0f} ms)")
+    for name, ms in sorted(timings.items(), key=lambda x: -x[1]):
+        print(f"   {name:<20} {ms:8.1f} ms")
+
+    return results, timings
+
+# --- Stages ---
+def config_digest(names):
+    """
+    Digest of the named config values, for the version of a stage whose output depends on them.
+    """
+    return hashlib.blake2b(repr([(name, getattr(config, name)) for name in names]).encode(), digest_size=8).hexdigest()
+
+def code_digest(paths):
+    """
+    Digest of source files (relative to src/), for the version of a stage that runs them,
+    so a checkpoint written by older code is not reused.
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    for path in paths:
+        with open(os.path.join(config.SRC_DIR, path), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def _stage_key(stage, digests):
+    """
+    What a stage's output depends on: its name, params, version and the digests of its inputs.
+    """
+    inputs = [digests.get(name) for name in stage.inputs]
+    return hashlib.blake2b(repr((stage.name, sorted(stage.params.items()), stage.version, inputs)).encode(), digest_size=16).hexdigest()
+
+def _checkpoint_path(checkpoint_dir, name):
+    return os.path.join(checkpoint_dir, f"{name}.pkl")
+
+def load_manifest(checkpoint_dir=config.CHECKPOINT_DIR):
+    try:
+        with open(os.path.join(checkpoint_dir, 'manifest.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_checkpoint(checkpoint_dir, manifest, stage, key, artifact, seconds):
+    """
+    Pickle a stage's artifact next to the manifest (both replaced atomically).
+    Returns the artifact's digest, a hash of its pickle, so an unchanged output
+    leaves the next stage's key unchanged.
+    """
+    try:
+        data = pickle.dumps(artifact, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+        print(f"Error saving {stage.name} checkpoint: {e}")
+        return f"unsaved-{time.time_ns()}" # Nothing downstream can match it
+    digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+    manifest[stage.name] = {'key': key, 'digest': digest, 'kind': type(artifact).__name__, 'bytes': len(data),
+                            'seconds': round(seconds, 3), 'saved_at': datetime.now().isoformat(timespec='seconds')}
+    manifest_path = os.path.join(checkpoint_dir, 'manifest.json')
+    try:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        path = _checkpoint_path(checkpoint_dir, stage.name)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+        with open(manifest_path + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(manifest_path + '.tmp', manifest_path)
+    except OSError as e:
+        print(f"Error saving {stage.name} checkpoint: {e}")
+    return digest
+
+def load_checkpoint(stage, checkpoint_dir=config.CHECKPOINT_DIR):
+    """
+    A stage's last artifact. Raises if it is missing, unreadable or not of the stage's kind.
+    """
+    with open(_checkpoint_path(checkpoint_dir, stage.name), 'rb') as f:
+        artifact = pickle.load(f)
+    if not isinstance(artifact, stage.kind):
+        raise TypeError(f"{stage.name} checkpoint is a {type(artifact).__name__}, expected {stage.kind.__name__}")
+    return artifact
+
+def run_stages(stages, only=None, start=None, outputs=(), checkpoint_dir=config.CHECKPOINT_DIR):
+    """
+    Run the stages in order, checkpointing each artifact to checkpoint_dir.
+
+    By default a stage is resumed from its checkpoint when its key is unchanged
+    and fresh() (if any) accepts it, so a rerun picks up at the first stage
+    whose inputs changed. With start, that stage and every later one run; with
+    only, just the named stages run. Either way the other stages' artifacts are
+    taken from their checkpoints as they are. Checkpoints are only loaded when
+    a running stage or outputs need them.
+    Returns the artifacts by stage name.
+    """
+    names = [stage.name for stage in stages]
+    for name in list(only or ()) + ([start] if start else []):
+        if name not in names:
+            raise ValueError(f"Unknown stage {name} (stages: {', '.join(names)})")
+    if only:
+        forced = set(only)
+        stages = stages[:max(names.index(name) for name in only) + 1]
+    elif start:
+        forced = set(names[names.index(start):])
+    else:
+        forced = None
+
+    by_name = {stage.name: stage for stage in stages}
+    manifest = load_manifest(checkpoint_dir)
+    artifacts = {}
+    digests = {}
+
+    def execute(stage):
+        args = [load(name) for name in stage.inputs]
+        key = _stage_key(stage, digests)
+        start_ns = time.perf_counter_ns()
+        try:
+            with profiler.span(f"stage:{stage.name}", memory=True):
+                artifacts[stage.name] = stage.func(*args, **stage.params)
+        except Exception as e:
+            print(f"❌ Stage {stage.name} failed: {e} (earlier stages are checkpointed; a rerun resumes here)")
+            raise
+        seconds = (time.perf_counter_ns() - start_ns) / 1e9
+        digests[stage.name] = _save_checkpoint(checkpoint_dir, manifest, stage, key, artifacts[stage.name], seconds)
+        print(f"✅ Stage {stage.name} done in {seconds:.2f}s")
+
+    def load(name):
+        if name not in artifacts:
+            try:
+                artifacts[name] = load_checkpoint(by_name[name], checkpoint_dir)
+            except Exception as e:
+                if forced is not None:
+                    raise RuntimeError(f"No usable {name} checkpoint ({e}); run the {name} stage first") from e
+                print(f"⚠️ {name} checkpoint unusable ({e}), rerunning the stage")
+                execute(by_name[name])
+        return artifacts[name]
+
+    for stage in stages:
+        entry = manifest.get(stage.name)
+        if forced is not None:
+            if stage.name in forced:
+                execute(stage)
+            elif entry is not None:
+                digests[stage.name] = entry['digest']
+            continue
+
+        reuse = entry is not None and entry['key'] == _stage_key(stage, digests) and os.path.exists(_checkpoint_path(checkpoint_dir, stage.name))
+        if reuse and stage.fresh is not None:
+            try:
+                artifacts[stage.name] = load_checkpoint(stage, checkpoint_dir)
+                reuse = stage.fresh(artifacts[stage.name])
+            except Exception:
+                reuse = False
+        if reuse:
+            digests[stage.name] = entry['digest']
+            print(f"♻️ Stage {stage.name}: inputs unchanged, resumed from checkpoint ({entry['saved_at']})")
+        else:
+            artifacts.pop(stage.name, None)
+            execute(stage)
+
+    for name in outputs:
+        if name in by_name:
+            load(name)
+    return artifacts
+
+# --- Report tasks ---
+def _rolling_var(history_df):
+    return analyzer.calculate_rolling_var(history_df['Daily_Return'], windows=config.VAR_WINDOW, confidence=config.VAR_CONFIDENCE)
+
+def _rolling_irr(history_df):
+    return analyzer.calculate_rolling_irr(history_df, windows=config.QUANT_WINDOW)
+
+def _quant_plot(history_df, rolling_var, rolling_irr):
+    return analyzer.get_quant_plots(history_df, show=False, windows=config.QUANT_WINDOW, rolling_risk=rolling_var[0], rolling_irr=rolling_irr)
+
+def _risk_decomposition(portfolio_tracker, allocation):
+    return analyzer.get_risk_decomposition(portfolio_tracker, allocation[4], show=False)
+
+def _stress_test(portfolio_tracker, allocation, update=True):
+    return scenario_engine.run_stress_test(portfolio_tracker, allocation[4], update=update)
+
+def _execution(trades_df, portfolio_tracker):
+    _, execution_summary = execution_analyzer.run_execution_analysis(trades_df, portfolio_tracker)
+    return execution_summary, execution_analyzer.get_execution_table(execution_summary)
+
+def _period_returns(history_df):
+    benchmark_returns = analyzer.get_benchmark_returns(history_df, config.PLOT_BENCHMARK)
+    period_returns, trailing_returns = analyzer.calculate_period_returns(history_df['Daily_Return'], benchmark_returns)
+    trailing_returns = trailing_returns.assign(**{'Portfolio (MWR)': analyzer.calculate_trailing_irr(history_df)})
+    return period_returns, trailing_returns
+
+def _monthly_heatmap(period_returns):
+    return analyzer.get_monthly_heatmap(period_returns[0], show=False)
+
+def _summary(history_df, allocation, rolling_var, period_returns, stress, risk_decomposition, exposure, execution):
+    _, _, category_values, sector_values, current_values, current_holdings = allocation
+    return analyzer.get_summary_sheet(
+        history_df.copy(), # get_summary_sheet adds columns; keep the shared frame read-only for the other tasks
+        category_values, sector_values, current_values, current_holdings,
+        trailing_returns=period_returns[1],
+        var_backtest=rolling_var[1],
+        scenario_table=scenario_engine.get_scenario_table(stress),
+        risk_summary=risk_decomposition[2],
+        exposure=exposure,
+        execution_summary=execution[0]
+    )
+
+def get_report_tasks(update=True):
+    """
+    Figures, tables and the summary sheet with their inputs. The context must
+    provide 'history' (after metrics and shadow portfolios), 'trades' and 'tracker'.
+    """
+    return [
+        Task('wealth', analyzer.get_wealth_plot, ['history']),
+        Task('drawdown', analyzer.get_drawdown_plot, ['history']),
+        Task('returns', analyzer.get_returns_plot, ['history']),
+        Task('rolling_var', _rolling_var, ['history']),
+        Task('rolling_irr', _rolling_irr, ['history']),
+        Task('quant', _quant_plot, ['history', 'rolling_var', 'rolling_irr']),
+        Task('allocation', partial(analyzer.get_allocation, show=False), ['history', 'trades', 'tracker']),
+        Task('risk_decomposition', _risk_decomposition, ['tracker', 'allocation']),
+        Task('exposure', analyzer.calculate_exposure_history, ['tracker']),
+        Task('exposure_plot', analyzer.get_exposure_plot, ['exposure']),
+        Task('stress', partial(_stress_test, update=update), ['tracker', 'allocation']),
+        Task('execution', _execution, ['trades', 'tracker']),
+        Task('period_returns', _period_returns, ['history']),
+        Task('monthly', _monthly_heatmap, ['period_returns']),
+        Task('summary', _summary, ['history', 'allocation', 'rolling_var', 'period_returns', 'stress', 'risk_decomposition', 'exposure', 'execution']),
+    ]
+
+def get_report_inputs(results):
+    """
+    Arguments for create_report from the task results: figs, df_alloc, df_risk, df_execution.
+    """
+    figs = {
+        "wealth": results['wealth'],
+        "drawdown": results['drawdown'],
+        "returns": results['returns'],
+        "alloc": results['allocation'][0],
+        "quant": results['quant'],
+        "monthly": results['monthly'],
+        "risk": results['risk_decomposition'][0],
+        "exposure": results['exposure_plot'],
+        "summary": results['summary']
+    }
+    return figs, results['allocation'][1], results['risk_decomposition'][1], results['execution'][1]
@@ -1,13 +1,485 @@
 import config
 
+import math
 import pandas as pd 
 import numpy as np 
-from scipy import stats
-import yfinance as yf 
+from bisect import bisect_left, insort
+from statistics import NormalDist
 from datetime import datetime
-import matplotlib.pyplot as plt
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
+
+import profiler
+from lazy import LazyModule
+
+# Heavy dependencies load on first use, so the metrics-only path skips plotting entirely
+yf = LazyModule('yfinance')
+go = LazyModule('plotly.graph_objects')
+plotly_subplots = LazyModule('plotly.subplots')
+
+# Calendar buckets for the period returns cube
+PERIOD_FREQS = {'Weekly': 'W', 'Monthly': 'M', 'Quarterly': 'Q', 'Yearly': 'Y'}
+
+_benchmark_cache = {}
+_period_returns_cache = {}
+
+def get_benchmark_prices(symbols, start_date, end_date):
+    """
+    Adjusted close prices (dividends reinvested) for the benchmark symbols.
+    Prices are cached per symbol and date range, so every figure and metric
+    shares one download and only symbols not seen yet are fetched.
+    """
+    start_date = pd.Timestamp(start_date).normalize()
+    end_date = pd.Timestamp(end_date).normalize()
+    symbols = list(symbols)
+
+    missing = [sym for sym in symbols if (sym, start_date, end_date) not in _benchmark_cache]
+    profiler.count('cache.benchmark_prices.hit', len(symbols) - len(missing))
+    profiler.count('cache.benchmark_prices.miss', len(missing))
+    if missing:
+        profiler.count('network.yfinance')
+        prices = yf.download(missing, start=start_date, end=end_date + pd.Timedelta(days=1), progress=False, auto_adjust=True, group_by="column")["Close"]
+        if isinstance(prices, pd.Series):
+            prices = prices.to_frame(name=missing[0])
+        for sym in missing:
+            if sym in prices.columns:
+                _benchmark_cache[(sym, start_date, end_date)] = prices[sym].dropna()
+
+    return pd.DataFrame({sym: _benchmark_cache[(sym, start_date, end_date)] for sym in symbols if (sym, start_date, end_date) in _benchmark_cache})
+
+def get_benchmark_returns(history_df, symbols=config.PLOT_BENCHMARK):
+    """
+    Daily benchmark returns aligned to the portfolio history (0 on non-trading days).
+    """
+    try:
+        prices = get_benchmark_prices(symbols, history_df.index.min(), history_df.index.max())
+        returns = prices.pct_change(fill_method=None)
+        return returns.reindex(history_df.index).fillna(0)
+    except Exception as e:
+        print(f"Error fetching benchmark returns: {e}")
+        return pd.DataFrame(index=history_df.index)
+
+def calculate_shadow_portfolios(history_df, symbols=config.PLOT_BENCHMARK):
+    """
+    Simulate putting every deposit/withdrawal (Net_Flow) into each benchmark
+    instead, with dividends reinvested (adjusted prices). All benchmarks are
+    valued in one matrix pass and stored as Shadow_<symbol> equity columns.
+    """
+    try:
+        prices = get_benchmark_prices(symbols, history_df.index.min(), history_df.index.max())
+    except Exception as e:
+        print(f"Error fetching benchmark prices for shadow portfolios: {e}")
+        return []
+
+    # Flows on non-trading days buy at the last close (or the first one for leading days)
+    prices = prices.reindex(history_df.index).ffill().bfill()
+    price_matrix = prices.to_numpy(dtype=float)
+    flows = history_df['Net_Flow'].to_numpy(dtype=float)
+
+    units = np.cumsum(flows[:, None] / price_matrix, axis=0)
+    shadow_equity = units * price_matrix
+
+    shadow_columns = []
+    for i, sym in enumerate(prices.columns):
+        column = f'Shadow_{sym}'
+        history_df[column] = shadow_equity[:, i]
+        shadow_columns.append(column)
+
+    return shadow_columns
+
+def _trailing_period_starts(index):
+    """
+    (label, first row, years to annualize over) for each trailing period.
+    The first row is None when the history is too short for the period.
+    """
+    last_date = index[-1]
+    # (label, start cutoff, cutoff is inclusive, years to annualize over)
+    trailing_periods = [
+        ('MTD', last_date.to_period('M').start_time, True, None),
+        ('QTD', last_date.to_period('Q').start_time, True, None),
+        ('YTD', last_date.to_period('Y').start_time, True, None),
+        ('1M', last_date - pd.DateOffset(months=1), False, None),
+        ('3M', last_date - pd.DateOffset(months=3), False, None),
+        ('1Y', last_date - pd.DateOffset(years=1), False, None),
+        ('3Y (Ann.)', last_date - pd.DateOffset(years=3), False, 3),
+        ('Since Inception', index[0], True, None),
+    ]
+
+    starts = []
+    for label, cutoff, inclusive, years in trailing_periods:
+        if cutoff < index[0] - pd.Timedelta(days=1):
+            starts.append((label, None, years))
+        else:
+            starts.append((label, index.searchsorted(cutoff, side='left' if inclusive else 'right'), years))
+    return starts
+
+def calculate_period_returns(daily_returns, benchmark_returns=None):
+    """
+    Build the calendar returns cube (weekly, monthly, quarterly, yearly) and the
+    trailing-period table for the portfolio and benchmarks in a single pass.
+    Returns (cube, trailing) where cube maps 'Weekly'/'Monthly'/... to a DataFrame.
+    """
+    returns = daily_returns.rename('Portfolio').to_frame()
+    if benchmark_returns is not None and not benchmark_returns.empty:
+        returns = returns.join(benchmark_returns.reindex(returns.index))
+    returns = returns.fillna(0)
+
+    # Keyed on the content: a rebuild in the same process (watch mode, API) can change returns without changing the dates
+    cache_key = (tuple(returns.columns), pd.util.hash_pandas_object(returns).to_numpy().tobytes())
+    if cache_key in _period_returns_cache:
+        profiler.count('cache.period_returns.hit')
+        return _period_returns_cache[cache_key]
+    profiler.count('cache.period_returns.miss')
+
+    # Prefix sums of log returns: the compounded return of rows [i, j) is exp(P[j] - P[i]) - 1
+    n_rows, n_cols = returns.shape
+    log_prefix = np.vstack([
+        np.zeros((1, n_cols)),
+        np.cumsum(np.log1p(returns.to_numpy(dtype=float)), axis=0)
+    ])
+
+    cube = {}
+    for name, freq in PERIOD_FREQS.items():
+        periods = returns.index.to_period(freq)
+        boundaries = np.flatnonzero(periods[1:] != periods[:-1]) + 1
+        starts = np.r_[0, boundaries]
+        ends = np.r_[boundaries, n_rows]
+        cube[name] = pd.DataFrame(
+            np.expm1(log_prefix[ends] - log_prefix[starts]),
+            index=periods[starts],
+            columns=returns.columns
+        )
+
+    rows = {}
+    for label, start, years in _trailing_period_starts(returns.index):
+        if start is None:
+            rows[label] = np.full(n_cols, np.nan) # Not enough history
+            continue
+        log_total = log_prefix[n_rows] - log_prefix[start]
+        if years:
+            log_total = log_total / years
+        rows[label] = np.expm1(log_total)
+
+    trailing = pd.DataFrame.from_dict(rows, orient='index', columns=returns.columns)
+
+    _period_returns_cache.clear() # Only the latest run is worth keeping
+    _period_returns_cache[cache_key] = (cube, trailing)
+    return cube, trailing
+
+def get_drawdown_episodes(returns):
+    """
+    Detect every drawdown episode in a return series (daily or intraday).
+    Episodes are the runs where wealth sits below its running max, found by
+    run-length segmentation so the whole scan is linear in the series length.
+    """
+    columns = ['Peak', 'Trough', 'Recovery', 'Depth', 'Length', 'To_Trough', 'To_Recover', 'Duration', 'Recovery_Time']
+    index = returns.index
+    n = len(returns)
+    if n == 0:
+        return pd.DataFrame(columns=columns)
+
+    wealth = np.cumprod(1 + returns.fillna(0).to_numpy(dtype=float))
+    running_max = np.maximum.accumulate(wealth)
+    drawdown = wealth / running_max - 1
+    underwater = drawdown < 0
+
+    # Run edges: +1 where an underwater run starts, -1 on the first bar back at the peak
+    edges = np.diff(np.r_[0, underwater.astype(np.int8), 0])
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1) # == n when the episode has not recovered yet
+    if len(starts) == 0:
+        return pd.DataFrame(columns=columns)
+
+    peaks = np.maximum(starts - 1, 0)
+
+    # Depth: reduceat spans the gap to the next run as well, but those bars are all 0
+    depth = np.minimum.reduceat(drawdown, starts)
+
+    # Trough: first bar of each run that hits the run's minimum
+    run_id = np.cumsum(edges[:-1] == 1) - 1
+    hits = np.flatnonzero(underwater & (drawdown == depth[np.maximum(run_id, 0)]))
+    hit_runs = run_id[hits]
+    troughs = hits[np.r_[True, hit_runs[1:] != hit_runs[:-1]]]
+
+    recovered = ends < n
+    last_bar = np.where(recovered, ends, n - 1)
+    recovery_dates = pd.DatetimeIndex(np.where(recovered, index[np.minimum(ends, n - 1)], pd.NaT))
+
+    episodes = pd.DataFrame({
+        'Peak': index[peaks],
+        'Trough': index[troughs],
+        'Recovery': recovery_dates,
+        'Depth': depth,
+        'Length': last_bar - peaks,
+        'To_Trough': troughs - peaks,
+        'To_Recover': np.where(recovered, ends - troughs, np.nan),
+    })
+    episodes['Duration'] = index[last_bar] - episodes['Peak']
+    episodes['Recovery_Time'] = episodes['Recovery'] - episodes['Trough']
+
+    return episodes
+
+def calculate_drawdown_stats(returns, top_n=5):
+    """
+    Drawdown episode table plus the headline statistics: top-N episodes by
+    depth, average recovery time and the Ulcer index.
+    """
+    episodes = get_drawdown_episodes(returns)
+
+    wealth = (1 + returns.fillna(0)).cumprod()
+    drawdown_pct = (wealth / wealth.cummax() - 1) * 100
+    ulcer_index = np.sqrt(np.mean(drawdown_pct.to_numpy() ** 2)) if len(drawdown_pct) else np.nan
+
+    recovery_times = episodes['Recovery_Time'].dropna()
+    avg_recovery_days = recovery_times.mean().total_seconds() / 86400 if len(recovery_times) else np.nan
+
+    return {
+        'episodes': episodes,
+        'top_episodes': episodes.nsmallest(top_n, 'Depth').reset_index(drop=True) if len(episodes) else episodes,
+        'num_episodes': len(episodes),
+        'avg_recovery_days': avg_recovery_days,
+        'ulcer_index': ulcer_index
+    }
+
+# Bound on the continuously-compounded annual rate searched by the IRR solver
+IRR_LOG_RATE_LIMIT = 10.0
+
+def solve_irr(times, cash_flows, tol=1e-10, max_iter=50):
+    """
+    Batched IRR solver: finds one annual rate per row of `cash_flows`, with
+    `times` in years from the row's first flow (padding entries have flow 0).
+    Newton-Raphson runs on every row at once in log-rate space; rows where it
+    does not converge fall back to a vectorized bisection. Returns NaN for rows
+    without a sign change.
+    """
+    times = np.atleast_2d(np.asarray(times, dtype=float))
+    cash_flows = np.atleast_2d(np.asarray(cash_flows, dtype=float))
+    scale = np.abs(cash_flows).sum(axis=1)
+
+    def npv(x, t, cf):
+        discount = np.exp(-t * x[:, None])
+        return (cf * discount).sum(axis=1), -(t * cf * discount).sum(axis=1)
+
+    log_rate = np.full(len(cash_flows), np.log1p(0.1))
+
+    with np.errstate(all='ignore'):
+        # --- Newton-Raphson on all rows ---
+        for _ in range(max_iter):
+            value, slope = npv(log_rate, times, cash_flows)
+            step = value / slope
+            log_rate = np.clip(log_rate - step, -IRR_LOG_RATE_LIMIT, IRR_LOG_RATE_LIMIT)
+            if not np.any(np.abs(step) > tol):
+                break
+
+        value, _ = npv(log_rate, times, cash_flows)
+        failed = ~(np.abs(value) <= 1e-8 * scale) | ~np.isfinite(log_rate)
+
+        # --- Bisection fallback on the rows Newton could not solve ---
+        if failed.any():
+            t, cf = times[failed], cash_flows[failed]
+            lo = np.full(len(cf), -IRR_LOG_RATE_LIMIT)
+            hi = np.full(len(cf), IRR_LOG_RATE_LIMIT)
+            value_lo, _ = npv(lo, t, cf)
+            value_hi, _ = npv(hi, t, cf)
+            bracketed = np.sign(value_lo) != np.sign(value_hi)
+
+            for _ in range(100):
+                mid = (lo + hi) / 2
+                value_mid, _ = npv(mid, t, cf)
+                same_side = np.sign(value_mid) == np.sign(value_lo)
+                lo = np.where(same_side, mid, lo)
+                value_lo = np.where(same_side, value_mid, value_lo)
+                hi = np.where(same_side, hi, mid)
+
+            log_rate[failed] = np.where(bracketed, (lo + hi) / 2, np.nan)
+
+    log_rate[scale == 0] = np.nan
+    return np.expm1(log_rate)
+
+def _window_cash_flows(history_df, starts, ends):
+    """
+    Cash flow matrix for money-weighted returns over the rows [start, end].
+    Column 0 is the opening value (prior close plus the first day's flow),
+    then every Net_Flow inside the window, then the closing equity.
+    Flows are signed from the investor's side: deposits negative, value out positive.
+    """
+    equity = history_df['Total_Equity'].to_numpy(dtype=float)
+    flows = history_df['Net_Flow'].to_numpy(dtype=float)
+    prev_equity = np.r_[0.0, equity[:-1]]
+    days = (history_df.index - history_df.index[0]).days.to_numpy()
+
+    starts = np.asarray(starts)
+    ends = np.asarray(ends)
+
+    # Flow days strictly after each start, up to and including each end
+    flow_rows = np.flatnonzero(flows)
+    lo = np.searchsorted(flow_rows, starts, side='right')
+    hi = np.searchsorted(flow_rows, ends, side='right')
+    n_slots = int((hi - lo).max()) if len(starts) else 0
+
+    times = np.zeros((len(starts), n_slots + 2))
+    cash_flows = np.zeros((len(starts), n_slots + 2))
+
+    cash_flows[:, 0] = -(prev_equity[starts] + flows[starts])
+    if n_slots > 0:
+        slot = lo[:, None] + np.arange(n_slots)
+        valid = slot < hi[:, None]
+        rows = flow_rows[np.minimum(slot, len(flow_rows) - 1)]
+        cash_flows[:, 1:-1] = np.where(valid, -flows[rows], 0.0)
+        times[:, 1:-1] = np.where(valid, days[rows] - days[starts][:, None], 0)
+    cash_flows[:, -1] = equity[ends]
+    times[:, -1] = days[ends] - days[starts]
+
+    return times / 365.0, cash_flows
+
+def calculate_xirr(history_df):
+    """
+    Since-inception money-weighted return (XIRR, annualized) from Net_Flow and Total_Equity.
+    """
+    times, cash_flows = _window_cash_flows(history_df, [0], [len(history_df) - 1])
+    return solve_irr(times, cash_flows)[0]
+
+def calculate_rolling_irr(history_df, windows=config.QUANT_WINDOW):
+    """
+    Rolling money-weighted return over each window (in rows), as the return
+    over the window rather than annualized. All windows are solved in one batch.
+    """
+    n = len(history_df)
+    ends, starts, labels = [], [], []
+    for w in windows:
+        window_ends = np.arange(w - 1, n)
+        ends.append(window_ends)
+        starts.append(window_ends - w + 1)
+        labels.append(np.full(len(window_ends), w))
+    ends, starts, labels = np.concatenate(ends), np.concatenate(starts), np.concatenate(labels)
+
+    times, cash_flows = _window_cash_flows(history_df, starts, ends)
+    annual = solve_irr(times, cash_flows)
+    window_return = np.expm1(np.log1p(annual) * times[:, -1])
+
+    rolling = pd.DataFrame(index=history_df.index)
+    for w in windows:
+        mask = labels == w
+        rolling[f'{w}d'] = pd.Series(window_return[mask], index=history_df.index[ends[mask]])
+    return rolling
+
+def calculate_trailing_irr(history_df):
+    """
+    Money-weighted return for each trailing period, matching the trailing returns table.
+    """
+    periods = _trailing_period_starts(history_df.index)
+    solvable = [(label, start, years) for label, start, years in periods if start is not None]
+    result = pd.Series(np.nan, index=[label for label, _, _ in periods], name='Portfolio (MWR)')
+    if not solvable:
+        return result
+
+    starts = np.array([start for _, start, _ in solvable])
+    times, cash_flows = _window_cash_flows(history_df, starts, np.full(len(starts), len(history_df) - 1))
+    log_rate = np.log1p(solve_irr(times, cash_flows))
+
+    for (label, _, years), rate, span in zip(solvable, log_rate, times[:, -1]):
+        result[label] = np.expm1(rate) if years else np.expm1(rate * span)
+    return result
+
+def calculate_time_weighted_return(history_df):
+    """
+    True time-weighted daily returns: each day is revalued after that day's flow,
+    r_t = Equity_t / (Equity_t-1 + Flow_t) - 1, so deposits and withdrawals do not
+    leak into performance the way the modified-Dietz Daily_Return can.
+    """
+    prev_equity = history_df['Total_Equity'].shift(1).fillna(0)
+    opening_value = prev_equity + history_df['Net_Flow']
+    twr = history_df['Total_Equity'] / opening_value.where(opening_value > 0) - 1
+    return twr.fillna(0)
+
+def _rolling_var_es(values, window, alpha):
+    """
+    Rolling historical VaR (alpha quantile, interpolated like np.percentile)
+    and Expected Shortfall. The window is kept sorted and updated with one
+    bisect delete/insert per step instead of re-sorting every window.
+    """
+    n = len(values)
+    var = np.full(n, np.nan)
+    es = np.full(n, np.nan)
+    if window < 2 or n < window:
+        return var, es
+
+    position = alpha * (window - 1)
+    lower = int(position)
+    frac = position - lower
+    upper = min(lower + 1, window - 1)
+    n_tail = lower + 1 # Order statistics at or below the VaR
+
+    values = values.tolist()
+    sorted_window = sorted(values[:window])
+    for end in range(window - 1, n):
+        if end >= window:
+            del sorted_window[bisect_left(sorted_window, values[end - window])]
+            insort(sorted_window, values[end])
+        var[end] = sorted_window[lower] + frac * (sorted_window[upper] - sorted_window[lower])
+        es[end] = sum(sorted_window[:n_tail]) / n_tail
+
+    return var, es
+
+def kupiec_test(breaches, alpha):
+    """
+    Kupiec proportion-of-failures test: is the observed VaR breach rate
+    consistent with the expected rate alpha? Returns (breaches, observations, LR, p-value).
+    """
+    breaches = np.asarray(breaches, dtype=bool)
+    n_obs = len(breaches)
+    n_breach = int(breaches.sum())
+    if n_obs == 0:
+        return n_breach, n_obs, np.nan, np.nan
+
+    rate = n_breach / n_obs
+    log_null = (n_obs - n_breach) * np.log(1 - alpha) + n_breach * np.log(alpha)
+    log_alt = 0.0 # Likelihood of 1 when there are no (or only) breaches
+    if 0 < n_breach < n_obs:
+        log_alt = (n_obs - n_breach) * np.log(1 - rate) + n_breach * np.log(rate)
+
+    lr = -2 * (log_null - log_alt)
+    return n_breach, n_obs, lr, math.erfc(math.sqrt(max(lr, 0) / 2)) # chi-squared (1 dof) survival function
+
+def calculate_rolling_var(returns, windows=config.VAR_WINDOW, confidence=config.VAR_CONFIDENCE, horizons=(1, 10)):
+    """
+    Rolling historical VaR and Expected Shortfall for each window and horizon.
+    Multi-day horizons use overlapping compounded returns. VaR/ES are returned
+    as (negative) return quantiles, like var_95_percent_return. Also returns a
+    Kupiec backtest of next-day breaches for the 1-day VaR of each window.
+    """
+    alpha = 1 - confidence
+    values = returns.fillna(0).to_numpy(dtype=float)
+    log_prefix = np.r_[0.0, np.cumsum(np.log1p(values))]
+
+    rolling = pd.DataFrame(index=returns.index)
+    backtest_rows = []
+    for horizon in horizons:
+        # Overlapping horizon-day returns (NaN until enough history)
+        horizon_returns = np.full(len(values), np.nan)
+        horizon_returns[horizon - 1:] = np.expm1(log_prefix[horizon:] - log_prefix[:len(values) - horizon + 1])
+
+        for w in windows:
+            var, es = np.full(len(values), np.nan), np.full(len(values), np.nan)
+            var[horizon - 1:], es[horizon - 1:] = _rolling_var_es(horizon_returns[horizon - 1:], w, alpha)
+            rolling[f'VaR_{horizon}d_{w}'] = var
+            rolling[f'ES_{horizon}d_{w}'] = es
+
+            if horizon == 1:
+                # Forecast for day t+1 is the VaR known at the close of day t
+                forecast = var[:-1]
+                realized = values[1:]
+                valid = ~np.isnan(forecast)
+                n_breach, n_obs, lr, p_value = kupiec_test(realized[valid] < forecast[valid], alpha)
+                backtest_rows.append({
+                    'Window': w,
+                    'Observations': n_obs,
+                    'Breaches': n_breach,
+                    'Expected': n_obs * alpha,
+                    'Breach_Rate': n_breach / n_obs if n_obs else np.nan,
+                    'LR_Stat': lr,
+                    'P_Value': p_value
+                })
+
+    return rolling, pd.DataFrame(backtest_rows)
 
 def calculate_performance_metrics(history_df):
     history_df['Prev_Equity'] = history_df['Total_Equity'].shift(1)
@@ -29,6 +501,7 @@ def calculate_performance_metrics(history_df):
     # Risk-Free Rate
     try:
         irx_ticker = yf.Ticker("^IRX")
+        profiler.count('network.yfinance')
         start_date_str = history_df.index.min().strftime('%Y-%m-%d')
         irx_hist = irx_ticker.history(start=start_date_str)['Close']
         irx_hist.index = irx_hist.index.tz_localize(None)
@@ -45,10 +518,7 @@ def calculate_performance_metrics(history_df):
     # Benchmark & Beta
     try:
         benchmark_symbol = config.METRICS_BENCHMARK
-        benchmark_ticker = yf.Ticker(benchmark_symbol)
-        start_date_str = history_df.index.min().strftime('%Y-%m-%d')
-        benchmark_hist = benchmark_ticker.history(start=start_date_str)['Close']
-        benchmark_hist.index = benchmark_hist.index.tz_localize(None)
+        benchmark_hist = get_benchmark_prices([benchmark_symbol], history_df.index.min(), history_df.index.max())[benchmark_symbol]
         benchmark_returns = benchmark_hist.pct_change().fillna(0)
         
         aligned_data = pd.DataFrame({
@@ -58,10 +528,9 @@ def calculate_performance_metrics(history_df):
         }, index=history_df.index).dropna()
         
         if len(aligned_data) > 10:
-            beta, alpha, r_value, p_value, std_err = stats.linregress(
-                aligned_data[benchmark_symbol], aligned_data['Portfolio']
-            )
-            portfolio_beta = beta
+            # OLS slope, computed as scipy's linregress does
+            ssxm, ssxym, _, _ = np.cov(aligned_data[benchmark_symbol], aligned_data['Portfolio'], bias=1).flat
+            portfolio_beta = ssxym / ssxm if ssxm > 0 else np.nan
             
             benchmark_total_return = (1 + aligned_data[benchmark_symbol]).prod() - 1
             
@@ -161,6 +630,16 @@ def calculate_performance_metrics(history_df):
     else:
         total_return = 0
         max_drawdown = 0
+
+    # Drawdown episodes (time-weighted)
+    drawdown_stats = calculate_drawdown_stats(history_df['Daily_Return'])
+
+    # Money-weighted (XIRR) and true time-weighted returns
+    history_df['TWR_Return'] = calculate_time_weighted_return(history_df)
+    twr_total = (1 + history_df['TWR_Return']).prod() - 1
+    n_years = (history_df.index[-1] - history_df.index[0]).days / 365
+    twr_annual = (1 + twr_total) ** (1 / n_years) - 1 if n_years > 0 else np.nan
+    xirr = calculate_xirr(history_df)
     
     first_date = history_df.index[0]
 
@@ -179,12 +658,146 @@ def calculate_performance_metrics(history_df):
         'max_return': max_return,
         'total_cum_return': total_cum_return,
         'max_drawdown': max_drawdown,
+        'twr_total': twr_total,
+        'twr_annual': twr_annual,
+        'xirr': xirr,
+        'ulcer_index': drawdown_stats['ulcer_index'],
+        'avg_recovery_days': drawdown_stats['avg_recovery_days'],
+        'top_drawdowns': drawdown_stats['top_episodes'],
         'benchmark_return': benchmark_total_return if 'benchmark_total_return' in locals() else np.nan,
         'tracking_error': tracking_error if 'tracking_error' in locals() else np.nan,
         'down_capture': down_capture if 'down_capture' in locals() else np.nan,
         'up_capture': up_capture if 'up_capture' in locals() else np.nan
     }
 
+# --- Plot payload: downsampling ---
+# Per-point trace attributes that are sliced along with x/y
+POINT_ATTRIBUTES = [('marker', 'color'), ('marker', 'size'), ('customdata',), ('text',), ('hovertext',)]
+
+def lttb_indices(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets: indices of n_out points that keep the
+    visual shape of the (x, y) line. x and y are finite float arrays.
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    n_buckets = n_out - 2
+    edges = np.linspace(1, n - 1, n_buckets + 1).astype(int) # Interior buckets [edges[i], edges[i+1])
+    counts = np.diff(edges)
+    avg_x = np.append(np.add.reduceat(x[1:n - 1], edges[:-1] - 1) / counts, x[-1])
+    avg_y = np.append(np.add.reduceat(y[1:n - 1], edges[:-1] - 1) / counts, y[-1])
+
+    selected = np.empty(n_out, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(n_buckets):
+        lo, hi = edges[i], edges[i + 1]
+        # Triangle (previous pick, candidate, next bucket average); keep the largest
+        area = np.abs((x[a] - avg_x[i + 1]) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y[i + 1] - y[a]))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+def _axis_values(x):
+    """
+    Float positions for an x array (datetimes as ns since the first point).
+    """
+    values = np.asarray(x)
+    if np.issubdtype(values.dtype, np.number):
+        values = values.astype(float)
+    else:
+        try:
+            values = pd.to_datetime(values).asi8.astype(float)
+        except Exception:
+            return np.arange(len(values), dtype=float)
+    return values - values[0] if len(values) else values
+
+def downsample_indices(x, y, n_out):
+    """
+    LTTB over the finite points, plus the global extrema and the NaN points
+    bordering each gap so gaps still render as gaps.
+    """
+    y = np.asarray(y, dtype=float)
+    finite = np.isfinite(y)
+    positions = np.flatnonzero(finite)
+    if len(positions) == 0:
+        return np.arange(min(len(y), 2))
+
+    keep = positions[lttb_indices(_axis_values(x)[positions], y[positions], n_out)]
+    extrema = positions[[np.argmin(y[positions]), np.argmax(y[positions])]]
+    changes = np.flatnonzero(np.diff(finite.astype(int)))
+    gap_edges = np.concatenate([changes, changes + 1]) # Last/first point on both sides of each gap
+    return np.unique(np.concatenate([keep, extrema, gap_edges]))
+
+def _slice_trace(trace, idx):
+    """
+    Trace properties restricted to the given point indices.
+    """
+    n = len(trace.x)
+    props = trace.to_plotly_json()
+    update = {'x': np.asarray(trace.x)[idx], 'y': np.asarray(trace.y)[idx]}
+    for path in POINT_ATTRIBUTES:
+        value = props
+        for key in path:
+            value = value.get(key) if isinstance(value, dict) else None
+        if value is not None and not isinstance(value, str) and np.ndim(value) == 1 and len(value) == n:
+            update['_'.join(path)] = np.asarray(value)[idx]
+    return update
+
+def optimize_figure(fig, max_points=config.PLOT_MAX_POINTS, webgl_threshold=config.PLOT_WEBGL_THRESHOLD, zoom_levels=config.PLOT_ZOOM_LEVELS):
+    """
+    Shrink the figure payload for long histories: every trace longer than
+    max_points is downsampled with LTTB (stacked traces share the indices of
+    their stack total), optionally keeping zoom_levels finer copies (4x each)
+    in trace.meta for the report to swap in on zoom. Scatter traces whose
+    largest embedded level exceeds webgl_threshold are rendered with WebGL.
+    """
+    traces = list(go.Figure(fig).data) # Work on copies; the caller's figure is left untouched
+    lengths = [len(t.x) if getattr(t, 'x', None) is not None and getattr(t, 'y', None) is not None else 0 for t in traces]
+    if max(lengths, default=0) <= max_points:
+        return fig
+
+    # Stacked traces need common x values, so they share the indices of their stack total
+    group_indices = {}
+    for trace, n in zip(traces, lengths):
+        group = getattr(trace, 'stackgroup', None)
+        if group and n > max_points and (trace.xaxis, group) not in group_indices:
+            members = [np.nan_to_num(np.asarray(t.y, dtype=float)) for t in traces if getattr(t, 'stackgroup', None) == group and t.xaxis == trace.xaxis]
+            group_indices[(trace.xaxis, group)] = lambda size, x=trace.x, total=np.sum(members, axis=0): downsample_indices(x, total, size)
+
+    use_webgl = False
+    optimized = []
+    for trace, n in zip(traces, lengths):
+        if n <= max_points:
+            optimized.append(trace)
+            continue
+
+        group = getattr(trace, 'stackgroup', None)
+        indices_for = group_indices.get((trace.xaxis, group)) if group else None
+        indices_for = indices_for or (lambda size, t=trace: downsample_indices(t.x, t.y, size))
+
+        sizes = [max_points * 4 ** level for level in range(max(zoom_levels, 1))]
+        levels = [indices_for(size) if size < n else np.arange(n) for size in sizes]
+        levels = [idx for i, idx in enumerate(levels) if i == 0 or len(idx) > len(levels[i - 1])]
+
+        full_x, full_y = np.asarray(trace.x), np.asarray(trace.y)
+        trace.update(_slice_trace(trace, levels[0]))
+        if len(levels) > 1 and trace.type == 'scatter':
+            trace.meta = {'zoom_levels': [{'x': full_x[idx], 'y': full_y[idx]} for idx in levels[1:]]}
+        if trace.type == 'scatter' and len(levels[-1]) > webgl_threshold:
+            trace = go.Scattergl({k: v for k, v in trace.to_plotly_json().items() if k != 'type'})
+            use_webgl = True
+        optimized.append(trace)
+
+    fig = go.Figure(data=optimized, layout=fig.layout)
+    if zoom_levels > 1:
+        fig.update_layout(meta={'zoom_target': max_points})
+    if use_webgl:
+        fig.for_each_xaxis(lambda axis: setattr(axis, 'rangebreaks', None)) # Range breaks are not supported by WebGL traces
+    return fig
+
 def get_pnl_plot(history_df, show = False):
     fig_pnl = go.Figure()
 
@@ -238,7 +851,7 @@ def get_pnl_plot(history_df, show = False):
     return fig_pnl
 
 def get_wealth_plot(history_df, show = False):
-    fig = make_subplots(
+    fig = plotly_subplots.make_subplots(
         rows=2, cols=1, 
         shared_xaxes=True, 
         vertical_spacing=0.08,
@@ -281,6 +894,32 @@ def get_wealth_plot(history_df, show = False):
         legendgroup='group2'
     ), row=2, col=1)
 
+    # --- Shadow portfolios: same cash flows into each benchmark ---
+    shadow_colors = ["#B73352", '#EF6C00', '#8E24AA', '#558B2F']
+    shadow_columns = [col for col in history_df.columns if col.startswith('Shadow_')]
+    for i, column in enumerate(shadow_columns):
+        ticker = column[len('Shadow_'):]
+        line_color = shadow_colors[i % len(shadow_colors)]
+
+        fig.add_trace(go.Scatter(
+            x=history_df.index,
+            y=history_df[column],
+            mode='lines',
+            name=f'{ticker} (Same Cash Flows)',
+            line=dict(color=line_color, width=1.2, dash='dot'),
+            legendgroup='group1'
+        ), row=1, col=1)
+
+        fig.add_trace(go.Scatter(
+            x=history_df.index,
+            y=history_df[column] - history_df['Invested_Capital'],
+            mode='lines',
+            name=f'{ticker} PnL (Same Cash Flows)',
+            line=dict(color=line_color, width=1.2, dash='dot'),
+            legendgroup='group2',
+            showlegend=False
+        ), row=2, col=1)
+
     fig.add_hline(y=0, line_dash="dash", line_color="gray", row=2, col=1)
     
     # Layout
@@ -307,6 +946,8 @@ def get_wealth_plot(history_df, show = False):
         ]
     )
 
+    fig = optimize_figure(fig)
+
     if show:
         fig.show()
         
@@ -315,7 +956,7 @@ def get_wealth_plot(history_df, show = False):
 def get_returns_plot(history_df, show=False):
     benchmark_symbols = config.PLOT_BENCHMARK
 
-    fig = make_subplots(
+    fig = plotly_subplots.make_subplots(
         rows=2, cols=1, 
         shared_xaxes=True, 
         vertical_spacing=0.08,
@@ -352,10 +993,7 @@ def get_returns_plot(history_df, show=False):
     start_date = history_df.index.min()
     end_date = history_df.index.max()
 
-    benchmark_data = yf.download(benchmark_symbols, start=start_date, end=end_date + pd.Timedelta(days=1), progress=False, auto_adjust=True, group_by="column")["Close"]
-
-    if isinstance(benchmark_data, pd.Series):
-        benchmark_data = benchmark_data.to_frame(name=benchmark_symbols[0])
+    benchmark_data = get_benchmark_prices(benchmark_symbols, start_date, end_date)
 
     colors = ["#B73352", '#EF6C00', '#8E24AA', '#558B2F']
 
@@ -376,6 +1014,31 @@ def get_returns_plot(history_df, show=False):
                 hovertemplate=f'{ticker}: %{{y:.2f}}%'
             ), row=2, col=1)
 
+    # Return on invested capital: portfolio vs. the same cash flows into each benchmark
+    shadow_columns = [col for col in history_df.columns if col.startswith('Shadow_')]
+    if shadow_columns:
+        invested = history_df['Invested_Capital'].where(history_df['Invested_Capital'] > 0)
+
+        fig.add_trace(go.Scatter(
+            x=history_df.index,
+            y=(history_df['PnL'] / invested) * 100,
+            mode='lines',
+            name='Portfolio Return on Capital %',
+            line=dict(color='#0277BD', width=1.2, dash='dot'),
+            hovertemplate='Portfolio on capital: %{y:.2f}%'
+        ), row=2, col=1)
+
+        for i, column in enumerate(shadow_columns):
+            ticker = column[len('Shadow_'):]
+            fig.add_trace(go.Scatter(
+                x=history_df.index,
+                y=(history_df[column] / invested - 1) * 100,
+                mode='lines',
+                name=f'{ticker} Same Cash Flows %',
+                line=dict(color=colors[i % len(colors)], width=1.2, dash='dot'),
+                hovertemplate=f'{ticker} same flows: %{{y:.2f}}%'
+            ), row=2, col=1)
+
     # --- Layout ---
     fig.update_layout(
         template="plotly_white",
@@ -405,12 +1068,14 @@ def get_returns_plot(history_df, show=False):
         ]
     )
 
+    fig = optimize_figure(fig)
+
     if show:
         fig.show()
         
     return fig
 
-def get_drawdown_plot(history_df, show=False):
+def get_drawdown_plot(history_df, show=False, top_n=5):
     # Calculate Cumulative Return peak (Running Max)
     # We use (1 + Daily_Return).cumprod() to ensure it's time-weighted/percentage-based
     cum_returns = (1 + history_df['Daily_Return']).cumprod()
@@ -419,7 +1084,7 @@ def get_drawdown_plot(history_df, show=False):
     # Calculate Drawdown as a percentage: (Current / Peak) - 1
     drawdown_pct = (cum_returns / running_max) - 1
 
-    fig_drawdown = make_subplots(
+    fig_drawdown = plotly_subplots.make_subplots(
         rows=2, cols=1, 
         shared_xaxes=True, 
         vertical_spacing=0.1,
@@ -462,6 +1127,29 @@ def get_drawdown_plot(history_df, show=False):
         hovertemplate='Drawdown: %{y:.2f}%'
     ), row=2, col=1)
 
+    # --- Annotate the deepest episodes ---
+    top_episodes = calculate_drawdown_stats(history_df['Daily_Return'], top_n=top_n)['top_episodes']
+    for rank, episode in top_episodes.iterrows():
+        end = episode['Recovery'] if pd.notna(episode['Recovery']) else history_df.index[-1]
+        fig_drawdown.add_vrect(
+            x0=episode['Peak'], x1=end,
+            fillcolor='rgba(211, 47, 47, 0.08)', line_width=0,
+            annotation_text=f"#{rank + 1} {episode['Depth']:.1%}",
+            annotation_position='bottom left',
+            annotation_font_size=10,
+            row=2, col=1
+        )
+
+    if not top_episodes.empty:
+        fig_drawdown.add_trace(go.Scatter(
+            x=top_episodes['Trough'],
+            y=top_episodes['Depth'] * 100,
+            mode='markers',
+            name='Top Drawdown Troughs',
+            marker=dict(color='#D32F2F', size=7, symbol='triangle-down'),
+            hovertemplate='Trough: %{y:.2f}%'
+        ), row=2, col=1)
+
     # Layout Adjustments
     fig_drawdown.update_layout(
         template="plotly_white",
@@ -477,33 +1165,60 @@ def get_drawdown_plot(history_df, show=False):
     # Hide weekends
     fig_drawdown.update_xaxes(rangebreaks=[dict(bounds=["sat", "mon"])])
 
+    fig_drawdown = optimize_figure(fig_drawdown)
+
     if show:
         fig_drawdown.show()
-        
-    return fig_drawdown
 
-def get_allocation(history_df, trades_df, portfolio_tracker, show=False):
-    last_holdings = {}
+    return fig_drawdown
 
-    for sym in portfolio_tracker.symbols:
-        buys = trades_df[(trades_df['SYMBOL'] == sym) & (trades_df['BUY/SELL'] == 'BUY')]['QTY'].sum()
-        sells = trades_df[(trades_df['SYMBOL'] == sym) & (trades_df['BUY/SELL'] == 'SELL')]['QTY'].sum()
-        last_holdings[sym] = buys - sells
+def get_monthly_heatmap(period_returns, column='Portfolio', show=False):
+    monthly = period_returns['Monthly'][column]
+    yearly = period_returns['Yearly'][column]
+
+    # Year x Month grid, with the full-year return as the last column
+    grid = pd.DataFrame({
+        'Year': monthly.index.year,
+        'Month': monthly.index.month,
+        'Return': monthly.to_numpy()
+    }).pivot(index='Year', columns='Month', values='Return').reindex(columns=range(1, 13))
+    grid['Year Total'] = pd.Series(yearly.to_numpy(), index=yearly.index.year)
+
+    month_labels = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec', 'Year']
+    values = grid.to_numpy() * 100
+    text = [[f"{v:.1f}%" if not np.isnan(v) else "" for v in row] for row in values]
+    max_abs = np.nanmax(np.abs(values)) if np.isfinite(values).any() else 1
+
+    fig = go.Figure(go.Heatmap(
+        z=values,
+        x=month_labels,
+        y=[str(y) for y in grid.index],
+        text=text,
+        texttemplate='%{text}',
+        colorscale='RdYlGn',
+        zmid=0,
+        zmin=-max_abs,
+        zmax=max_abs,
+        hovertemplate='%{y} %{x}: %{z:.2f}%<extra></extra>',
+        colorbar=dict(title='%')
+    ))
 
-    current_holdings = {k: v for k, v in last_holdings.items() if v > 0}
-    current_values = {}
+    fig.update_layout(
+        template="plotly_white",
+        height=max(250, 45 * len(grid) + 120),
+        margin=dict(t=30, b=40, l=50, r=30),
+        yaxis=dict(autorange='reversed', type='category')
+    )
 
-    for sym, qty in current_holdings.items():
-        if sym in portfolio_tracker.market_data and not portfolio_tracker.market_data[sym].empty:
-            price = portfolio_tracker.market_data[sym].iloc[-1]['Close']
-            current_values[sym] = qty * price
+    if show:
+        fig.show()
 
-    # Add Cash
-    current_cash = history_df['Cash'].iloc[-1]
-    if current_cash > 0:
-        current_values['CASH'] = current_cash
+    return fig
 
-    # Categorize Assets
+def classify_assets(symbols, asset_info):
+    """
+    Map each symbol to its (asset category, sector) from the cached ticker info.
+    """
     asset_categories = {}
     asset_sectors = {}
 
@@ -511,7 +1226,7 @@ def get_allocation(history_df, trades_df, portfolio_tracker, show=False):
     US_BROAD_MARKET = ['VOO', 'VTI', 'SPY', 'IVV', 'QQQ', 'IWM', 'QQQM', 'SPYM']
     INTL_EQUITY = ['VEU', 'VXUS', 'EFA']
 
-    for sym in current_values.keys():
+    for sym in symbols:
         if sym == 'CASH':
             asset_categories[sym] = 'Cash & Equivalents'
             asset_sectors[sym] = 'Cash'
@@ -523,7 +1238,7 @@ def get_allocation(history_df, trades_df, portfolio_tracker, show=False):
             asset_sectors[sym] = 'US Broad Market'
             continue
 
-        info = portfolio_tracker.asset_info.get(sym, {})
+        info = asset_info.get(sym, {})
         quote_type = info.get('quoteType', 'UNKNOWN')
         sector = info.get('sector', 'Unknown')
         long_name = info.get('longName', '').lower()
@@ -554,6 +1269,32 @@ def get_allocation(history_df, trades_df, portfolio_tracker, show=False):
         asset_categories[sym] = category
         asset_sectors[sym] = sector if sector != 'Unknown' else category
 
+    return asset_categories, asset_sectors
+
+def get_allocation(history_df, trades_df, portfolio_tracker, show=False):
+    last_holdings = {}
+
+    for sym in portfolio_tracker.symbols:
+        buys = trades_df[(trades_df['SYMBOL'] == sym) & (trades_df['BUY/SELL'] == 'BUY')]['QTY'].sum()
+        sells = trades_df[(trades_df['SYMBOL'] == sym) & (trades_df['BUY/SELL'] == 'SELL')]['QTY'].sum()
+        last_holdings[sym] = buys - sells
+
+    current_holdings = {k: v for k, v in last_holdings.items() if v > 0}
+    current_values = {}
+
+    for sym, qty in current_holdings.items():
+        if sym in portfolio_tracker.market_data and not portfolio_tracker.market_data[sym].empty:
+            price = portfolio_tracker.market_data[sym].iloc[-1]['Close']
+            current_values[sym] = qty * price
+
+    # Add Cash
+    current_cash = history_df['Cash'].iloc[-1]
+    if current_cash > 0:
+        current_values['CASH'] = current_cash
+
+    # Categorize Assets
+    asset_categories, asset_sectors = classify_assets(current_values.keys(), portfolio_tracker.asset_info)
+
     # Group by Category
     category_values = {}
     for sym, val in current_values.items():
@@ -586,7 +1327,7 @@ def get_allocation(history_df, trades_df, portfolio_tracker, show=False):
     # Visualization (Pie Charts)
     df_by_category = df_allocation.groupby('Category')['Value'].sum().reset_index()
 
-    fig_alloc = make_subplots(
+    fig_alloc = plotly_subplots.make_subplots(
         rows=1, cols=2, 
         specs=[[{'type':'domain'}, {'type':'domain'}]],
         subplot_titles=['Allocation by Symbol', 'Allocation by Asset Class'],
@@ -629,29 +1370,220 @@ def get_allocation(history_df, trades_df, portfolio_tracker, show=False):
         )
     )
 
-    # Display DataFrame
+    # Display DataFrame (numbers stay numeric; the report formats them)
     df_alloc = df_allocation.copy()
-    df_alloc['Value'] = df_alloc['Value'].apply(lambda x: f"${x:,.2f}")
-    df_alloc['Allocation (%)'] = df_alloc['Allocation (%)'].apply(lambda x: f"{x:.2f}%")
+    df_alloc.attrs['formats'] = {'Value': '${:,.2f}', 'Allocation (%)': '{:.2f}%'}
 
     if show:
         fig_alloc.show()
 
     return fig_alloc, df_alloc, category_values, sector_values, current_values, current_holdings
 
-def get_quant_plots(history_df, show=False, windows=[21, 63]):
+def calculate_risk_decomposition(portfolio_tracker, current_values, lookback=252, confidence=config.VAR_CONFIDENCE):
+    """
+    Covariance-based risk decomposition of the current book. One annualized
+    covariance estimate gives, per holding, the marginal and component
+    contribution to volatility and to parametric VaR, and the share of total
+    risk; these are then summed by sector and category. Cash has zero risk.
+    """
+    total_value = sum(current_values.values())
+    symbols = [sym for sym in current_values if sym != 'CASH'
+               and sym in portfolio_tracker.market_data and not portfolio_tracker.market_data[sym].empty]
+    if not symbols or total_value <= 0:
+        return pd.DataFrame(), {}
+
+    prices = pd.DataFrame({sym: portfolio_tracker.market_data[sym]['Close'] for sym in symbols}).sort_index()
+    returns = prices.ffill().pct_change(fill_method=None).iloc[-lookback:].fillna(0)
+
+    cov = returns.cov().to_numpy() * 252
+    weights = np.array([current_values[sym] for sym in symbols]) / total_value
+
+    port_vol = np.sqrt(weights @ cov @ weights)
+    if not port_vol > 0: # Nothing risky left (zero weights or flat prices), so there is no risk to split
+        return pd.DataFrame(), {}
+    asset_vol = np.sqrt(np.diag(cov))
+    marginal = cov @ weights / port_vol
+    component = weights * marginal
+    z_score = NormalDist().inv_cdf(confidence)
+
+    asset_categories, asset_sectors = classify_assets(symbols, portfolio_tracker.asset_info)
+    df_risk = pd.DataFrame({
+        'Symbol': symbols,
+        'Category': [asset_categories.get(sym, 'Other') for sym in symbols],
+        'Sector': [asset_sectors.get(sym, 'Other') for sym in symbols],
+        'Weight': weights,
+        'Volatility': asset_vol,
+        'Marginal_Risk': marginal,
+        'Component_Risk': component,
+        'Risk_Pct': component / port_vol,
+        'Marginal_VaR': z_score * marginal,
+        'Component_VaR': z_score * component * total_value / np.sqrt(252), # 1-day, in dollars
+    }).sort_values('Risk_Pct', ascending=False).reset_index(drop=True)
+
+    risk_summary = {
+        'portfolio_vol': port_vol,
+        'diversification_ratio': (weights @ asset_vol) / port_vol,
+        'top_10_risk_pct': df_risk['Risk_Pct'].head(10).sum(),
+        'by_sector': df_risk.groupby('Sector')[['Weight', 'Risk_Pct']].sum().sort_values('Risk_Pct', ascending=False),
+        'by_category': df_risk.groupby('Category')[['Weight', 'Risk_Pct']].sum().sort_values('Risk_Pct', ascending=False),
+    }
+    return df_risk, risk_summary
+
+def get_risk_plot(df_risk, risk_summary, show=False):
+    fig = plotly_subplots.make_subplots(
+        rows=1, cols=2,
+        column_widths=[0.6, 0.4],
+        horizontal_spacing=0.12,
+        subplot_titles=("Allocation vs. Risk by Holding", "Allocation vs. Risk by Sector")
+    )
+
+    if not df_risk.empty:
+        by_sector = risk_summary['by_sector']
+        for col, (labels, weights, risk) in enumerate([
+            (df_risk['Symbol'], df_risk['Weight'], df_risk['Risk_Pct']),
+            (by_sector.index, by_sector['Weight'], by_sector['Risk_Pct']),
+        ], start=1):
+            fig.add_trace(go.Bar(x=labels, y=weights * 100, name='Allocation %', marker_color='#90CAF9',
+                                 showlegend=(col == 1), legendgroup='alloc', hovertemplate='%{x}: %{y:.2f}%'), row=1, col=col)
+            fig.add_trace(go.Bar(x=labels, y=risk * 100, name='Risk Contribution %', marker_color='#D32F2F',
+                                 showlegend=(col == 1), legendgroup='risk', hovertemplate='%{x}: %{y:.2f}%'), row=1, col=col)
+
+    fig.update_layout(
+        template="plotly_white",
+        barmode='group',
+        height=450,
+        legend=dict(orientation="h", yanchor="bottom", y=1.08, xanchor="right", x=1),
+        margin=dict(t=60, b=40, l=50, r=20)
+    )
+    fig.update_yaxes(title_text="% of Portfolio", row=1, col=1)
+
+    if show:
+        fig.show()
+
+    return fig
+
+def calculate_exposure_history(portfolio_tracker):
+    """
+    Daily sector and asset-class exposure from the tracker's historical_weights.
+    The (dates x symbols) weights matrix is mapped onto groups with one sparse
+    one-hot (symbols x groups) multiply per classification. Also splits daily
+    weight changes into price drift and trade/flow-driven turnover.
+    """
+    weights = portfolio_tracker.historical_weights.fillna(0)
+    symbols = list(weights.columns)
+    weight_matrix = weights.to_numpy(dtype=float)
+    cash_weight = 1 - weight_matrix.sum(axis=1)
+
+    from scipy import sparse
+
+    asset_categories, asset_sectors = classify_assets(symbols, portfolio_tracker.asset_info)
+    exposure = {}
+    for name, mapping in [('sector', asset_sectors), ('category', asset_categories)]:
+        labels = [mapping.get(sym, 'Other') for sym in symbols]
+        groups, group_idx = np.unique(labels, return_inverse=True)
+        one_hot = sparse.csr_matrix(
+            (np.ones(len(symbols)), (np.arange(len(symbols)), group_idx)),
+            shape=(len(symbols), len(groups))
+        )
+        grouped = pd.DataFrame(np.asarray(weight_matrix @ one_hot), index=weights.index, columns=groups)
+        grouped['Cash'] = grouped.get('Cash', 0) + cash_weight
+        exposure[name] = grouped.loc[:, grouped.abs().max() > 0]
+
+    # Drift: where yesterday's weights would be after today's price moves (cash earns 0)
+    prices = pd.DataFrame({
+        sym: portfolio_tracker.market_data[sym]['Close']
+        for sym in symbols if sym in portfolio_tracker.market_data and not portfolio_tracker.market_data[sym].empty
+    }).reindex(columns=symbols)
+    prices = prices[~prices.index.duplicated(keep='last')].sort_index()
+    asset_returns = prices.reindex(weights.index, method='ffill').pct_change(fill_method=None).fillna(0).to_numpy()
+
+    prev_weights = np.vstack([weight_matrix[:1], weight_matrix[:-1]])
+    prev_cash = np.r_[cash_weight[:1], cash_weight[:-1]]
+    growth = 1 + (prev_weights * asset_returns).sum(axis=1)
+    drifted = prev_weights * (1 + asset_returns) / growth[:, None]
+    drifted_cash = prev_cash / growth
+
+    drift = 0.5 * (np.abs(drifted - prev_weights).sum(axis=1) + np.abs(drifted_cash - prev_cash))
+    turnover = 0.5 * (np.abs(weight_matrix - drifted).sum(axis=1) + np.abs(cash_weight - drifted_cash))
+    drift[0] = turnover[0] = 0
+
+    turnover = pd.Series(turnover, index=weights.index, name='Turnover')
+    drift = pd.Series(drift, index=weights.index, name='Drift')
+    n_years = max((weights.index[-1] - weights.index[0]).days / 365, 1 / 365) if len(weights) else np.nan
+
+    return {
+        'sector': exposure['sector'],
+        'category': exposure['category'],
+        'turnover': turnover,
+        'drift': drift,
+        'annual_turnover': turnover.sum() / n_years,
+        'annual_drift': drift.sum() / n_years,
+        'turnover_1y': turnover[turnover.index > turnover.index[-1] - pd.DateOffset(years=1)].sum() if len(turnover) else np.nan,
+    }
+
+def get_exposure_plot(exposure, show=False):
+    fig = plotly_subplots.make_subplots(
+        rows=2, cols=1,
+        shared_xaxes=True,
+        vertical_spacing=0.08,
+        subplot_titles=("Sector Exposure", "Asset Class Exposure")
+    )
+
+    palette = ['#0277BD', '#2E7D32', '#8E24AA', '#F9A825', '#D32F2F', '#00897B', '#EF6C00', '#5C6BC0',
+               '#795548', '#546E7A', '#C2185B', '#7CB342', '#FFB300', '#26C6DA']
+    for row, key in [(1, 'sector'), (2, 'category')]:
+        df = exposure[key]
+        for i, column in enumerate(df.columns):
+            fig.add_trace(go.Scatter(
+                x=df.index,
+                y=df[column] * 100,
+                mode='lines',
+                name=column,
+                stackgroup=key,
+                line=dict(width=0.5, color=palette[i % len(palette)]),
+                legendgroup=key,
+                hovertemplate=f'{column}: %{{y:.1f}}%'
+            ), row=row, col=1)
+
+    fig.update_layout(
+        template="plotly_white",
+        hovermode="x unified",
+        height=800,
+        legend=dict(orientation="v", x=1.02, y=1),
+        margin=dict(t=50, b=40, l=50, r=20)
+    )
+    fig.update_yaxes(title_text="% of Equity", row=1, col=1)
+    fig.update_yaxes(title_text="% of Equity", row=2, col=1)
+    fig.update_xaxes(rangebreaks=[dict(bounds=["sat", "mon"])])
+
+    fig = optimize_figure(fig)
+
+    if show:
+        fig.show()
+
+    return fig
+
+def get_risk_decomposition(portfolio_tracker, current_values, show=False):
+    df_risk, risk_summary = calculate_risk_decomposition(portfolio_tracker, current_values)
+    fig_risk = get_risk_plot(df_risk, risk_summary, show=show)
+
+    # Display DataFrame
+    df_risk_display = pd.DataFrame()
+    if not df_risk.empty:
+        df_risk_display = df_risk[['Symbol', 'Sector', 'Weight', 'Volatility', 'Marginal_Risk', 'Risk_Pct', 'Component_VaR']].copy()
+        df_risk_display.columns = ['Symbol', 'Sector', 'Allocation (%)', 'Volatility (%)', 'Marginal Risk (%)', 'Risk Contribution (%)', 'Component VaR 1D ($)']
+        df_risk_display.attrs['formats'] = {
+            **{col: '{:.2%}' for col in ['Allocation (%)', 'Volatility (%)', 'Marginal Risk (%)', 'Risk Contribution (%)']},
+            'Component VaR 1D ($)': '${:,.2f}'
+        }
+
+    return fig_risk, df_risk_display, risk_summary
+
+def get_quant_plots(history_df, show=False, windows=[21, 63], rolling_risk=None, rolling_irr=None):
     # Fetch benchmark data to align with portfolio history
-    start_date = history_df.index.min().strftime('%Y-%m-%d')
-    end_date = (history_df.index.max() + pd.Timedelta(days=1)).strftime('%Y-%m-%d')
     bench_ticker = config.METRICS_BENCHMARK
-    
-    # Download benchmark data
-    bench_data = yf.download(bench_ticker, start=start_date, end=end_date, progress=False, auto_adjust=True)
-    bench_returns = bench_data['Close'].pct_change().fillna(0)
-    
-    # Handle multi-index columns if yfinance returns them
-    if isinstance(bench_returns, pd.DataFrame):
-        bench_returns = bench_returns.iloc[:, 0]
+    bench_data = get_benchmark_prices([bench_ticker], history_df.index.min(), history_df.index.max())
+    bench_returns = bench_data[bench_ticker].pct_change().fillna(0)
         
     # Align dates between portfolio and benchmark
     df = pd.DataFrame({
@@ -659,14 +1591,23 @@ def get_quant_plots(history_df, show=False, windows=[21, 63]):
         'Bench_Return': bench_returns
     }).dropna()
     
-    fig = make_subplots(
-        rows=4, cols=1, 
+    if rolling_risk is None:
+        rolling_risk, _ = calculate_rolling_var(history_df['Daily_Return'])
+    if rolling_irr is None:
+        rolling_irr = calculate_rolling_irr(history_df, windows=windows)
+    confidence = f"{config.VAR_CONFIDENCE:.0%}"
+
+    fig = plotly_subplots.make_subplots(
+        rows=7, cols=1, 
         shared_xaxes=True,
-        vertical_spacing=0.06,
+        vertical_spacing=0.04,
         subplot_titles=("Rolling Volatility (Annualized)", 
                         f"Rolling Beta (vs {bench_ticker})", 
                         "Rolling Alpha (Annualized)",
-                        "Rolling Sharpe Ratio")
+                        "Rolling Sharpe Ratio",
+                        f"Rolling 1-Day VaR / Expected Shortfall ({confidence})",
+                        f"Rolling 10-Day VaR / Expected Shortfall ({confidence})",
+                        "Rolling Money-Weighted Return (over the window)")
     )
     
     # Define 8 colors in total (4 for Portfolio, 4 for Benchmark)
@@ -711,14 +1652,33 @@ def get_quant_plots(history_df, show=False, windows=[21, 63]):
         # Plot Sharpe
         fig.add_trace(go.Scatter(x=df.index, y=rolling_sharpe, mode='lines', name=f'Port Sharpe ({w}d)', line=dict(color=p_color)), row=4, col=1)
         fig.add_trace(go.Scatter(x=df.index, y=bench_sharpe, mode='lines', name=f'{bench_ticker} Sharpe ({w}d)', line=dict(color=b_color, dash='dot', width=1)), row=4, col=1)
+
+        # Plot money-weighted return (IRR of the window's flows)
+        if f'{w}d' in rolling_irr:
+            fig.add_trace(go.Scatter(x=rolling_irr.index, y=rolling_irr[f'{w}d']*100, mode='lines', name=f'MWR ({w}d)', line=dict(color=p_color)), row=7, col=1)
     
+    # Rolling VaR (solid) and Expected Shortfall (dotted) per window
+    var_windows = sorted({int(col.split('_')[-1]) for col in rolling_risk.columns})
+    for i, w in enumerate(var_windows):
+        p_color = port_colors[i % 4]
+        for row, horizon in [(5, 1), (6, 10)]:
+            fig.add_trace(go.Scatter(x=rolling_risk.index, y=rolling_risk[f'VaR_{horizon}d_{w}']*100, mode='lines', name=f'VaR {horizon}d ({w}d)', line=dict(color=p_color)), row=row, col=1)
+            fig.add_trace(go.Scatter(x=rolling_risk.index, y=rolling_risk[f'ES_{horizon}d_{w}']*100, mode='lines', name=f'ES {horizon}d ({w}d)', line=dict(color=p_color, dash='dot', width=1)), row=row, col=1)
+
+    # Days that breached the previous day's 1-day VaR of the longest window
+    if var_windows:
+        forecast = rolling_risk[f'VaR_1d_{var_windows[-1]}'].shift(1)
+        breaches = history_df['Daily_Return'][history_df['Daily_Return'] < forecast]
+        fig.add_trace(go.Scatter(x=breaches.index, y=breaches*100, mode='markers', name=f'VaR Breach ({var_windows[-1]}d)', marker=dict(color='#D32F2F', size=4)), row=5, col=1)
+
     # Reference Lines 
     fig.add_hline(y=1, line_dash="dash", line_color="black", opacity=0.5, row=2, col=1) # Beta of 1
     fig.add_hline(y=0, line_dash="dash", line_color="black", opacity=0.5, row=3, col=1) # Zero Alpha
     fig.add_hline(y=1, line_dash="dash", line_color="black", opacity=0.5, row=4, col=1) # Sharpe of 1.0
+    fig.add_hline(y=0, line_dash="dash", line_color="black", opacity=0.5, row=7, col=1) # Break-even
     
     fig.update_layout(
-        height=1000, 
+        height=1600, 
         template="plotly_white", 
         showlegend=False, 
         hovermode="x unified",
@@ -729,19 +1689,25 @@ def get_quant_plots(history_df, show=False, windows=[21, 63]):
     fig.update_yaxes(title_text="Beta", row=2, col=1)
     fig.update_yaxes(title_text="Alpha (%)", row=3, col=1)
     fig.update_yaxes(title_text="Sharpe", row=4, col=1)
+    fig.update_yaxes(title_text="1-Day (%)", row=5, col=1)
+    fig.update_yaxes(title_text="10-Day (%)", row=6, col=1)
+    fig.update_yaxes(title_text="MWR (%)", row=7, col=1)
     
     # Hide weekends
     fig.update_xaxes(rangebreaks=[dict(bounds=["sat", "mon"])])
     
+    fig = optimize_figure(fig)
+
     if show:
         fig.show()
         
     return fig
 
-def get_summary_sheet(history_df, category_values, sector_values, current_values, current_holdings):
+def get_summary_sheet(history_df, category_values, sector_values, current_values, current_holdings, trailing_returns=None, var_backtest=None, scenario_table=None, risk_summary=None, exposure=None, execution_summary=None):
     # Fetch HKD Rate
     try:
         hkd_ticker = yf.Ticker("HKD=X")
+        profiler.count('network.yfinance')
         hkd_rate = hkd_ticker.history(period="1d")['Close'].iloc[-1]
     except Exception as e:
         print(f"Error fetching HKD rate: {e}")
@@ -771,6 +1737,12 @@ def get_summary_sheet(history_df, category_values, sector_values, current_values
     max_drawdown = metrics.get('max_drawdown', 0)
     var_95_dollar = metrics.get('var_95_dollar', 0)
     var_95_percent_return = metrics.get('var_95_percent_return',0)
+    twr_total = metrics.get('twr_total', 0)
+    twr_annual = metrics.get('twr_annual', 0)
+    xirr = metrics.get('xirr', 0)
+    ulcer_index = metrics.get('ulcer_index', 0)
+    avg_recovery_days = metrics.get('avg_recovery_days', 0)
+    top_drawdowns = metrics.get('top_drawdowns', pd.DataFrame())
     down_capture = metrics.get('down_capture', 0)
     up_capture = metrics.get('up_capture', 0)
     
@@ -843,6 +1815,117 @@ def get_summary_sheet(history_df, category_values, sector_values, current_values
         except:
             return '<span style="color: #666; font-weight: bold;">N/A</span>'
 
+    # Trailing period table (rows: periods, columns: portfolio and benchmarks)
+    if trailing_returns is not None and not trailing_returns.empty:
+        trailing_columns = list(trailing_returns.columns)
+        trailing_rows = [
+            {
+                "period": period,
+                "values": [format_val(v, is_pct=True) if pd.notna(v) else "N/A" for v in row]
+            }
+            for period, row in zip(trailing_returns.index, trailing_returns.to_numpy())
+        ]
+    else:
+        trailing_columns = []
+        trailing_rows = []
+
+    # Shadow portfolios (same cash flows into each benchmark)
+    shadow_rows = []
+    for column in [col for col in history_df.columns if col.startswith('Shadow_')]:
+        shadow_equity = history_df[column].iloc[-1]
+        shadow_rows.append({
+            "symbol": column[len('Shadow_'):],
+            "equity": f"{shadow_equity:,.2f}",
+            "pnl_html": format_val(shadow_equity - history_df['Invested_Capital'].iloc[-1], show_hkd=False),
+            "diff_html": format_val(current_equity - shadow_equity, show_hkd=False)
+        })
+
+    # VaR backtest (Kupiec proportion-of-failures)
+    var_backtest_rows = []
+    if var_backtest is not None:
+        for _, row in var_backtest.iterrows():
+            var_backtest_rows.append({
+                "window": f"{row['Window']:.0f}d",
+                "observations": f"{row['Observations']:.0f}",
+                "breaches": f"{row['Breaches']:.0f}",
+                "expected": f"{row['Expected']:.1f}",
+                "breach_rate": f"{row['Breach_Rate']:.2%}",
+                "p_value": f"{row['P_Value']:.3f}",
+                "result": "Pass" if row['P_Value'] >= 0.05 else "Reject"
+            })
+
+    # Risk concentration (covariance-based)
+    risk_summary = risk_summary or {}
+    diversification_ratio = risk_summary.get('diversification_ratio', np.nan)
+    top_10_risk_pct = risk_summary.get('top_10_risk_pct', np.nan)
+    by_sector = risk_summary.get('by_sector')
+    if by_sector is not None and not by_sector.empty:
+        sector_risk_str = " | ".join([f"{k} {v:.1%}" for k, v in by_sector['Risk_Pct'].head(3).items()])
+    else:
+        sector_risk_str = "Not Available"
+
+    # Exposure turnover and drift
+    exposure = exposure or {}
+    turnover_1y = exposure.get('turnover_1y', np.nan)
+    annual_turnover = exposure.get('annual_turnover', np.nan)
+    annual_drift = exposure.get('annual_drift', np.nan)
+
+    # Execution quality (slippage vs session prices, positive = cost)
+    execution_summary = execution_summary or {}
+    execution_rows = []
+    for key in ['by_side', 'by_month']:
+        table = execution_summary.get(key)
+        if table is None or table.empty:
+            continue
+        if key == 'by_month':
+            table = table.iloc[::-1].head(12) # Latest 12 months
+        for group, row in table.iterrows():
+            execution_rows.append({
+                "group": str(group),
+                "trades": f"{row['Trades']:.0f}",
+                "notional": f"{row['Notional']:,.2f}",
+                "vwap_bps": f"{row['Slip_VWAP_bps']:.1f}",
+                "open_bps": f"{row['Slip_Open_bps']:.1f}",
+                "close_bps": f"{row['Slip_Close_bps']:.1f}",
+                "range_position": f"{row['Range_Position']:.0%}",
+                "cost_html": format_val(-row['Cost_VWAP'], show_hkd=False)
+            })
+    overall_execution = execution_summary.get('overall')
+    if overall_execution is not None:
+        execution_vwap_bps = f"{overall_execution['Slip_VWAP_bps']:.1f} bps"
+        execution_cost_html = format_val(-overall_execution['Cost_VWAP'], show_hkd=False)
+    else:
+        execution_vwap_bps = "N/A"
+        execution_cost_html = "N/A"
+
+    # Stress scenarios on current holdings, worst first
+    scenario_rows = []
+    if scenario_table is not None:
+        for name, row in scenario_table.iterrows():
+            window = f"{row['Start'] + pd.Timedelta(days=1):%Y-%m-%d} to {row['End']:%Y-%m-%d}" if row['Type'] == 'Month' else (
+                f"{row['Start']:%Y-%m-%d} to {row['End']:%Y-%m-%d}" if pd.notna(row['Start']) else "Factor shock")
+            scenario_rows.append({
+                "scenario": name,
+                "type": row['Type'],
+                "window": window,
+                "pnl_html": format_val(row['PnL'], show_hkd=False),
+                "pnl_pct_html": format_val(row['PnL_Pct'], is_pct=True),
+                "worst_holding": row['Worst_Holding']
+            })
+
+    # Top drawdown episodes
+    drawdown_rows = [
+        {
+            "peak": episode['Peak'].strftime('%Y-%m-%d'),
+            "trough": episode['Trough'].strftime('%Y-%m-%d'),
+            "recovery": episode['Recovery'].strftime('%Y-%m-%d') if pd.notna(episode['Recovery']) else "Ongoing",
+            "depth": f"{episode['Depth']:.2%}",
+            "length": f"{episode['Duration'].days}d",
+            "recovery_time": f"{episode['Recovery_Time'].days}d" if pd.notna(episode['Recovery_Time']) else "-"
+        }
+        for _, episode in top_drawdowns.iterrows()
+    ]
+
     # Return a dictionary of data instead of an HTML string
     summary_data = {
         "first_date": first_date.strftime('%Y-%m-%d'),
@@ -858,6 +1941,9 @@ def get_summary_sheet(history_df, category_values, sector_values, current_values
         "total_return_pct_html": format_val(total_return, is_pct=True),
         "max_return_html": format_val(max_return, show_hkd=True),
         "total_cum_return_html": format_val(total_cum_return, is_pct=True),
+        "twr_total_html": format_val(twr_total, is_pct=True),
+        "twr_annual_html": format_val(twr_annual, is_pct=True),
+        "xirr_html": format_val(xirr, is_pct=True),
         "benchmark_total_return": f"{benchmark_total_return:.2%}",
         "alpha_html": format_val(alpha, is_pct=True),
         "volatility": f"{volatility:.2%}",
@@ -868,6 +1954,22 @@ def get_summary_sheet(history_df, category_values, sector_values, current_values
         "portfolio_beta": f"{portfolio_beta:.2f}",
         "tracking_error": f"{tracking_error:.2%}",
         "max_drawdown": f"{max_drawdown:.2%}",
+        "ulcer_index": f"{ulcer_index:.2f}",
+        "avg_recovery_days": f"{avg_recovery_days:.0f} days" if pd.notna(avg_recovery_days) else "N/A",
+        "drawdown_rows": drawdown_rows,
+        "shadow_rows": shadow_rows,
+        "var_backtest_rows": var_backtest_rows,
+        "scenario_rows": scenario_rows,
+        "execution_rows": execution_rows,
+        "execution_vwap_bps": execution_vwap_bps,
+        "execution_cost_html": execution_cost_html,
+        "diversification_ratio": f"{diversification_ratio:.2f}" if pd.notna(diversification_ratio) else "N/A",
+        "top_10_risk_pct": f"{top_10_risk_pct:.1%}" if pd.notna(top_10_risk_pct) else "N/A",
+        "sector_risk_str": sector_risk_str,
+        "turnover_1y": f"{turnover_1y:.1%}" if pd.notna(turnover_1y) else "N/A",
+        "annual_turnover": f"{annual_turnover:.1%}" if pd.notna(annual_turnover) else "N/A",
+        "annual_drift": f"{annual_drift:.1%}" if pd.notna(annual_drift) else "N/A",
+        "var_confidence": f"{config.VAR_CONFIDENCE:.0%}",
         "var_95_percent_return": f"{var_95_percent_return:.2%}",
         "down_capture": f"{down_capture:.2f}",
         "up_capture": f"{up_capture:.2f}",
@@ -875,7 +1977,9 @@ def get_summary_sheet(history_df, category_values, sector_values, current_values
         "sector_alloc_str": sector_alloc_str,
         "top_10_pct": f"{top_10_pct:.1%}",
         "num_holdings": num_holdings,
-        "benchmark_name": config.METRICS_BENCHMARK
+        "benchmark_name": config.METRICS_BENCHMARK,
+        "trailing_columns": trailing_columns,
+        "trailing_rows": trailing_rows
     }
 
     return summary_data
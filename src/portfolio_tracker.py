@@ -2,15 +2,127 @@ import config
 import os 
 import pandas as pd 
 import numpy as np 
-import yfinance as yf 
 from datetime import datetime, timedelta
-import matplotlib.pyplot as plt
-import seaborn as sns
 import concurrent.futures
 import pickle
+from collections import namedtuple
+
+import profiler
+from lazy import LazyModule
+
+yf = LazyModule('yfinance')
+
+# Close (padded to every calendar day, 0 before a symbol's data starts), split ratio and
+# dividend per share for each date and symbol, as (days x symbols) arrays. Read-only, so one
+# panel can be shared by any number of reconstructions over the same dates (see backtest.py)
+PricePanel = namedtuple('PricePanel', ['dates', 'symbols', 'close', 'split_ratio', 'dividend'])
+
+# --- Reconstruction engine ---
+def _on_dates(series, dates, default):
+    """
+    Values of an event series (splits, dividends) on the exact dates, default elsewhere.
+    """
+    series = series[~series.index.duplicated(keep='last')]
+    return np.where(dates.isin(series.index), series.reindex(dates).to_numpy(dtype=float), default)
+
+def build_price_panel(symbols, market_data, splits, dividends, dates):
+    """
+    PricePanel for the symbols over the calendar dates. Symbols without market
+    data are kept at a zero price; those without split/dividend records are
+    left out (they are not valued and get no weight column).
+    """
+    columns, close, split_ratio, dividend = [], [], [], []
+    for symbol in symbols:
+        df = market_data.get(symbol)
+        if df is None or df.empty:
+            prices, ratios, paid = np.zeros(len(dates)), np.ones(len(dates)), np.zeros(len(dates))
+        elif symbol not in splits or symbol not in dividends or 'Close' not in df.columns:
+            continue
+        else:
+            series = df['Close']
+            series = series[~series.index.duplicated(keep='last')].sort_index()
+            prices = np.array(series.reindex(dates, method='pad'), dtype=float)
+            prices[dates < series.index[0]] = 0 # Before data start
+            ratios = _on_dates(splits[symbol], dates, 1.0)
+            paid = _on_dates(dividends[symbol], dates, 0.0)
+        columns.append(symbol)
+        close.append(prices)
+        split_ratio.append(ratios)
+        dividend.append(paid)
+
+    def stack(arrays):
+        return np.column_stack(arrays) if arrays else np.zeros((len(dates), 0))
+    return PricePanel(dates, columns, stack(close), stack(split_ratio), stack(dividend))
+
+def reconstruct(trades_df, panel, dividend_tax=config.DIVIDEND_TAX_RATE, no_tax=config.NO_DIVIDEND_TAX):
+    """
+    Replay the trades over the panel's dates. Each day its trades settle
+    first, then splits and net dividends (positive amounts only) on the day's
+    holdings. Returns the daily history and weights on weekdays, and the
+    dividends received as records.
+    """
+    dates = panel.dates
+    n_days, n_symbols = panel.close.shape
+    day = dates.get_indexer(pd.DatetimeIndex(trades_df['DATE']))
+    trades_df = trades_df[day >= 0] # Trades after the end date (or off midnight) never match a day
+    day = day[day >= 0]
+
+    symbol = trades_df['SYMBOL'].astype(str).to_numpy()
+    type_ = trades_df['BUY/SELL'].astype(str).to_numpy()
+    qty = trades_df['QTY'].to_numpy(dtype=float)
+    amt = trades_df['AMT'].to_numpy(dtype=float)
+    fee = trades_df['FEE'].to_numpy(dtype=float)
+    is_cash = symbol == 'CASH'
+    deposit, withdraw = is_cash & (type_ == 'DEPOSIT'), is_cash & (type_ == 'WITHDRAW')
+    buy, sell = ~is_cash & (type_ == 'BUY'), ~is_cash & (type_ == 'SELL')
+
+    # Cash and external flows per day (np.add.at keeps the trade order)
+    cash_change = np.zeros(n_days)
+    np.add.at(cash_change, day, np.select([deposit, withdraw, buy, sell], [amt - fee, -(amt + fee), -(amt + fee), amt - fee], 0.0))
+    net_flow = np.zeros(n_days)
+    np.add.at(net_flow, day, np.select([deposit, withdraw], [amt, -amt], 0.0))
+
+    # Holdings: cumulative quantities, restarted from (holdings + that day's trades) * ratio at each split
+    column = pd.Index(panel.symbols).get_indexer(symbol)
+    traded = (buy | sell) & (column >= 0)
+    quantity = np.zeros((n_days, n_symbols))
+    np.add.at(quantity, (day[traded], column[traded]), np.where(buy, qty, -qty)[traded])
+    holdings = np.cumsum(quantity, axis=0)
+    for j in np.nonzero((panel.split_ratio != 1).any(axis=0))[0]:
+        for k in np.nonzero(panel.split_ratio[:, j] != 1)[0]:
+            before = holdings[k - 1, j] if k > 0 else 0.0
+            holdings[k:, j] = np.cumsum(np.concatenate(([(before + quantity[k, j]) * panel.split_ratio[k, j]], quantity[k + 1:, j])))
+
+    # Dividends net of tax, paid into cash
+    tax = np.array([0.0 if sym in no_tax else dividend_tax for sym in panel.symbols])
+    income = holdings * (panel.dividend * (1 - tax))
+    with np.errstate(invalid='ignore'):
+        received = income > 0
+    income = np.where(received, income, 0.0)
+    cash = np.cumsum(cash_change + income.sum(axis=1))
+
+    values = holdings * panel.close
+    market_value = values.sum(axis=1)
+    total_equity = market_value + cash
+    with np.errstate(invalid='ignore'):
+        weights = np.divide(values, total_equity[:, None], out=np.zeros_like(values), where=total_equity[:, None] > 0)
+
+    index = pd.DatetimeIndex(dates, name='Date')
+    weekdays = index.dayofweek < 5
+    df_portfolio = pd.DataFrame({
+        'Cash': cash,
+        'Market_Value': market_value,
+        'Total_Equity': total_equity,
+        'Invested_Capital': np.cumsum(net_flow),
+        'Net_Flow': net_flow
+    }, index=index)[weekdays]
+    historical_weights = pd.DataFrame(weights, index=index, columns=panel.symbols)[weekdays]
+    rows, cols = np.nonzero(received)
+    dividend_history = [{'Date': date, 'Symbol': panel.symbols[j], 'Amount': amount} for date, j, amount in zip(index[rows], cols, income[rows, cols])]
+    return df_portfolio, historical_weights, dividend_history
 
 class PortfolioTracker:
-    def __init__(self, trades_df):
+    def __init__(self, trades_df, dividend_tax=config.DIVIDEND_TAX_RATE):
         self.trades = trades_df.copy()
         self.symbols = self.trades[self.trades['SYMBOL'] != 'CASH']['SYMBOL'].unique().tolist()
         self.market_data = {}
@@ -20,10 +132,32 @@ class PortfolioTracker:
         self.start_date = self.trades['DATE'].min()
         self.end_date = datetime.now()
         self.dividend_history = []
+        self.dividend_tax = dividend_tax
         
-    def fetch_market_data(self, update=True):
-        
+    def save_metadata(self):
+        """
+        Write dividends, splits and asset info to the metadata cache.
+        """
         metadata_path = os.path.join(config.DATA_DIR, "portfolio_metadata.pkl")
+        try: 
+            with open(metadata_path, "wb") as f:
+                pickle.dump({
+                    "dividends": self.dividends,
+                    "splits": self.splits,
+                    "asset_info": self.asset_info
+                }, f)
+            return True
+        except Exception as e:
+            print(f"Error saving metadata: {e}")
+            return False
+
+    def fetch_market_data(self, update=True, symbols=None):
+        """
+        Load (update=False) or download market data, dividends, splits and
+        asset info for the symbols (default: every traded symbol).
+        """
+        metadata_path = os.path.join(config.DATA_DIR, "portfolio_metadata.pkl")
+        symbols = self.symbols if symbols is None else symbols
         
         if not update:
             print("⚠️  Update=False: Loading data from local cache...")
@@ -32,26 +166,35 @@ class PortfolioTracker:
                 try:
                     with open(metadata_path, 'rb') as f:
                         meta = pickle.load(f)
+                        profiler.count('cache.metadata.hit')
                         self.dividends = meta.get("dividends", {})
                         self.splits = meta.get("splits", {})
                         self.asset_info = meta.get("asset_info", {})
                 except Exception as e:
                     print(f"Error loading metadata: {e}")
             else:
+                profiler.count('cache.metadata.miss')
                 print(f"No metadata cache found.")
 
-            for symbol in self.symbols:
+            for symbol in symbols:
                 file_name = f"{symbol}.csv"
                 daily_path = os.path.join(config.DAILY_DATA_DIR, file_name)
                 if os.path.exists(daily_path):
-                    self.market_data[symbol] = pd.read_csv(daily_path, index_col = 0, parse_dates=True)
+                    with profiler.span('read_daily_csv', symbol=symbol):
+                        self.market_data[symbol] = pd.read_csv(daily_path, index_col = 0, parse_dates=True)
+                    profiler.count('cache.daily_csv.hit')
                 else:
+                    profiler.count('cache.daily_csv.miss')
                     print(f"Warning: No local data for {symbol}")
             return 
             
-        print(f"Processing data for: {self.symbols}")
+        print(f"Processing data for: {symbols}")
 
         def process_symbol(symbol):
+            with profiler.span('fetch_symbol', symbol=symbol):
+                _process_symbol(symbol)
+
+        def _process_symbol(symbol):
             try:
                 ticker = yf.Ticker(symbol)
                 start_str = (self.start_date - timedelta(days=5)).strftime('%Y-%m-%d')
@@ -63,10 +206,14 @@ class PortfolioTracker:
                 
                 if os.path.exists(daily_path):
                     try:
-                        existing_data = pd.read_csv(daily_path, index_col=0, parse_dates=True)
+                        with profiler.span('read_daily_csv', symbol=symbol):
+                            existing_data = pd.read_csv(daily_path, index_col=0, parse_dates=True)
                     except Exception: pass
+                profiler.count('cache.daily_csv.miss' if existing_data.empty else 'cache.daily_csv.hit')
                 
-                new_hist = ticker.history(start=start_str, auto_adjust=False)
+                with profiler.span('yfinance.history', symbol=symbol):
+                    new_hist = ticker.history(start=start_str, auto_adjust=False)
+                profiler.count('network.yfinance')
                 
                 if not new_hist.empty:
                     new_hist.index = new_hist.index.tz_localize(None)
@@ -77,7 +224,8 @@ class PortfolioTracker:
                         hist = combined
                     else:
                         hist = new_hist
-                    hist.to_csv(daily_path)
+                    with profiler.span('write_daily_csv', symbol=symbol):
+                        hist.to_csv(daily_path)
                     self.market_data[symbol] = hist
                 elif not existing_data.empty:
                     self.market_data[symbol] = existing_data
@@ -85,14 +233,18 @@ class PortfolioTracker:
                     self.market_data[symbol] = pd.DataFrame()
 
                 # --- DIVIDENDS & SPLITS ---
-                divs = ticker.dividends
-                splits = ticker.splits
+                with profiler.span('yfinance.actions', symbol=symbol):
+                    divs = ticker.dividends
+                    splits = ticker.splits
+                profiler.count('network.yfinance')
                 self.dividends[symbol] = divs.tz_localize(None) if divs.index.tz is not None else divs
                 self.splits[symbol] = splits.tz_localize(None) if splits.index.tz is not None else splits
                 
                 # --- ASSET INFO ---
                 try:
-                    self.asset_info[symbol] = ticker.info
+                    profiler.count('network.yfinance')
+                    with profiler.span('yfinance.info', symbol=symbol):
+                        self.asset_info[symbol] = ticker.info
                 except Exception:
                     self.asset_info[symbol] = {}
 
@@ -104,7 +256,9 @@ class PortfolioTracker:
                         existing_min = pd.read_csv(minute_path, index_col=0, parse_dates=True)
                     except: pass
                 
-                new_min = ticker.history(period='7d', interval='1m', auto_adjust=False)
+                with profiler.span('yfinance.minute', symbol=symbol):
+                    new_min = ticker.history(period='7d', interval='1m', auto_adjust=False)
+                profiler.count('network.yfinance')
                 if not new_min.empty:
                     new_min.index = new_min.index.tz_localize(None)
                     if not existing_min.empty:
@@ -118,141 +272,19 @@ class PortfolioTracker:
                 print(f"Error processing {symbol}: {e}")
 
         with concurrent.futures.ThreadPoolExecutor(max_workers=30) as executor:
-            executor.map(process_symbol, self.symbols)
+            executor.map(process_symbol, symbols)
 
         # --- Save metadata to cache --- 
-        try: 
-            with open(metadata_path, "wb") as f:
-                pickle.dump({
-                    "dividends": self.dividends,
-                    "splits": self.splits,
-                    "asset_info": self.asset_info
-                }, f)
+        if self.save_metadata():
             print("✅ Market data and metadata updated successfully.")
-        except Exception as e:
-            print(f"Error saving metadata: {e}")
             
     def process_portfolio(self):
-        date_range = pd.date_range(start=self.start_date, end=self.end_date, freq='D')
-        
-        # Initialize tracking variables
-        portfolio_history = []
-        holdings = {sym: 0 for sym in self.symbols}
-        cash = 0.0
-        invested_capital = 0.0
-
-        weight_history = []
-        
-        # Iterate through each day
-        for current_date in date_range:
-            daily_net_flow = 0.0 
-            
-            # Process trades for this day
-            day_trades = self.trades[self.trades['DATE'] == current_date]
-            for _, trade in day_trades.iterrows():
-                symbol = trade['SYMBOL']
-                qty = trade['QTY']
-                price = trade['PRICE']
-                amt = trade['AMT']
-                type_ = trade['BUY/SELL']
-                fee = trade['FEE']
-                
-                if symbol == 'CASH':
-                    if type_ == 'DEPOSIT':
-                        net_deposit = amt - fee
-                        cash += net_deposit
-                        invested_capital += amt
-                        daily_net_flow += amt
-                    elif type_ == 'WITHDRAW':
-                        net_withdrawal = amt + fee
-                        cash -= net_withdrawal
-                        invested_capital -= amt
-                        daily_net_flow -= amt
-                else:
-                    if type_ == 'BUY':
-                        holdings[symbol] += qty
-                        total_cost = amt + fee
-                        cash -= total_cost
-                    elif type_ == 'SELL':
-                        holdings[symbol] -= qty
-                        net_proceeds = amt - fee
-                        cash += net_proceeds
-            
-            # Process Dividends & Splits
-            daily_value = 0.0
-            current_asset_values = {} # Store value per asset for weight calc
-            
-            for symbol in self.symbols:
-                if symbol not in self.market_data or self.market_data[symbol].empty:
-                    current_asset_values[symbol] = 0.0
-                    continue
-                    
-                df = self.market_data[symbol]
-                
-                # Get price
-                try:
-                    idx = df.index.get_indexer([current_date], method='pad')[0]
-                    if idx == -1:
-                        price = 0 # Before data start
-                    else:
-                        price = df.iloc[idx]['Close']
-                        
-                    # Check for Split
-                    if current_date in self.splits[symbol].index:
-                        split_ratio = self.splits[symbol].loc[current_date]
-                        holdings[symbol] *= split_ratio
-                        
-                    # Check for Dividend
-                    if current_date in self.dividends[symbol].index:
-                        div_amt = self.dividends[symbol].loc[current_date]
-                        # Check if treasury (simple check for now, can be expanded)
-                        is_treasury = symbol in config.NO_DIVIDEND_TAX 
-                        tax_rate = 0.0 if is_treasury else 0.30
-                        net_div = div_amt * (1 - tax_rate)
-                        total_div = holdings[symbol] * net_div
-                        
-                        if total_div > 0:
-                            cash += total_div
-                            self.dividend_history.append({
-                                'Date': current_date,
-                                'Symbol': symbol,
-                                'Amount': total_div
-                            })
-                    
-                    val = holdings[symbol] * price
-                    daily_value += val
-                    current_asset_values[symbol] = val
-                        
-                except Exception as e:
-                    price = 0
-                
-            total_equity = daily_value + cash
-
-            # --- Record Weights ---
-            if total_equity > 0:
-                daily_weights = {k: v / total_equity for k, v in current_asset_values.items()}
-            else:
-                daily_weights = {k: 0 for k in current_asset_values}
-            
-            daily_weights['Date'] = current_date
-            weight_history.append(daily_weights)
-            
-            portfolio_history.append({
-                'Date': current_date,
-                'Cash': cash,
-                'Market_Value': daily_value,
-                'Total_Equity': total_equity,
-                'Invested_Capital': invested_capital,
-                'Net_Flow': daily_net_flow
-            })
-
-        # Convert to DataFrame
-        self.df_portfolio = pd.DataFrame(portfolio_history).set_index('Date')
-        self.df_portfolio = self.df_portfolio[self.df_portfolio.index.dayofweek < 5]
-
-        self.historical_weights = pd.DataFrame(weight_history).set_index('Date')
-        self.historical_weights = self.historical_weights[self.historical_weights.index.dayofweek < 5]
-        
+        """
+        Rebuild the daily history (weekdays) and weights from the trades, splits and dividends.
+        """
+        dates = pd.date_range(start=self.start_date, end=self.end_date, freq='D')
+        panel = build_price_panel(self.symbols, self.market_data, self.splits, self.dividends, dates)
+        self.df_portfolio, self.historical_weights, self.dividend_history = reconstruct(self.trades, panel, dividend_tax=self.dividend_tax)
         return self.df_portfolio
 
     def calculate_correlation_matrix(self, period='3mo', holdings = True):
@@ -318,6 +350,8 @@ class PortfolioTracker:
         correlation_matrix = returns_df.corr()
         
         # Plot correlation matrix
+        import matplotlib.pyplot as plt
+        import seaborn as sns
         plt.figure(figsize=(10, 8))
         mask = np.triu(np.ones_like(correlation_matrix, dtype=bool))
         sns.heatmap(correlation_matrix, 
@@ -0,0 +1,180 @@
+import os
+import sys
+import json
+import time
+import threading
+import functools
+import contextlib
+import tracemalloc
+from collections import Counter, defaultdict
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+# Off unless enable() is called (main.py --profile); every hook is then a single flag check
+_enabled = False
+_origin_ns = 0
+_events = [] # Chrome trace events
+_counters = Counter()
+_memory = [] # (label, peak RSS MB, traced MB, traced peak MB)
+_lock = threading.Lock()
+_NULL_SPAN = contextlib.nullcontext()
+
+class _Span:
+    __slots__ = ('name', 'args', 'memory', 'start_ns')
+
+    def __init__(self, name, args, memory):
+        self.name = name
+        self.args = args
+        self.memory = memory
+
+    def __enter__(self):
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, self.start_ns, time.perf_counter_ns() - self.start_ns, args=self.args)
+        if self.memory:
+            snapshot(self.name)
+        return False
+
+def is_enabled():
+    return _enabled
+
+def enable(trace_memory=False):
+    """
+    Start collecting spans, counters and memory snapshots (and Python
+    allocations with trace_memory, which slows the run down noticeably).
+    """
+    global _enabled, _origin_ns
+    _events.clear()
+    _counters.clear()
+    _memory.clear()
+    _origin_ns = time.perf_counter_ns()
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _enabled = True
+
+def disable():
+    global _enabled
+    _enabled = False
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+def span(name, memory=False, **args):
+    """
+    Context manager timing a block; with memory=True also snapshots memory at its end.
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name, args, memory)
+
+def profiled(name, memory=False):
+    """
+    Decorator form of span().
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Span(name, None, memory):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def record(name, start_ns, duration_ns, pid=None, tid=None, args=None):
+    """
+    Add a finished span, e.g. one timed in a worker process.
+    """
+    if not _enabled:
+        return
+    event = {'name': name, 'ph': 'X', 'ts': (start_ns - _origin_ns) / 1000, 'dur': duration_ns / 1000,
+             'pid': pid or os.getpid(), 'tid': tid or threading.get_ident()}
+    if args:
+        event['args'] = args
+    _events.append(event)
+
+def count(name, n=1):
+    """
+    Bump a counter, e.g. 'cache.daily_csv.hit' or 'network.yfinance'.
+    """
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] += n
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024 # bytes on macOS, KB on Linux
+
+def rss_mb():
+    """
+    Current resident set size (Linux); the peak elsewhere.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except (OSError, ValueError, AttributeError):
+        return peak_rss_mb()
+
+def snapshot(label):
+    """
+    Record the process peak RSS and, when tracing, the Python allocations
+    (current and peak since the previous snapshot).
+    """
+    if not _enabled:
+        return
+    traced, traced_peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (None, None)
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    row = (label, peak_rss_mb(), traced and traced / 1024 / 1024, traced_peak and traced_peak / 1024 / 1024)
+    _memory.append(row)
+    _events.append({'name': 'memory', 'ph': 'C', 'ts': (time.perf_counter_ns() - _origin_ns) / 1000, 'pid': os.getpid(),
+                    'args': {key: value for key, value in zip(['peak_rss_mb', 'traced_mb', 'traced_peak_mb'], row[1:]) if value is not None}})
+
+def write_trace(path):
+    """
+    Chrome trace JSON (chrome://tracing or ui.perfetto.dev), counters included as metadata.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    names = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': 'main' if tid == threading.main_thread().ident else f"worker {tid}"}}
+             for pid, tid in {(e['pid'], e['tid']) for e in _events if 'tid' in e}]
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': names + _events, 'displayTimeUnit': 'ms', 'otherData': {'counters': dict(_counters)}}, f)
+    return path
+
+def print_summary(top_allocations=10):
+    """
+    Spans aggregated by name, then counters and memory snapshots.
+    """
+    spans = defaultdict(list)
+    for event in _events:
+        if event['ph'] == 'X':
+            spans[event['name']].append(event['dur'] / 1000)
+
+    print(f"\n⏱️ Profile: {len(_events)} events")
+    print(f"   {'span':<28} {'calls':>6} {'total ms':>10} {'mean ms':>9} {'max ms':>9}")
+    for name, durations in sorted(spans.items(), key=lambda x: -sum(x[1])):
+        print(f"   {name:<28} {len(durations):6d} {sum(durations):10.1f} {sum(durations) / len(durations):9.1f} {max(durations):9.1f}")
+
+    if _counters:
+        print(f"\n   {'counter':<40} {'count':>8}")
+        for name, value in sorted(_counters.items()):
+            print(f"   {name:<40} {value:8d}")
+
+    if _memory:
+        print(f"\n   {'memory after':<28} {'peak RSS MB':>12} {'traced MB':>10} {'peak MB':>9}")
+        for label, rss, traced, traced_peak in _memory:
+            print(f"   {label:<28} {rss if rss is not None else float('nan'):12.0f} "
+                  f"{traced if traced is not None else float('nan'):10.1f} {traced_peak if traced_peak is not None else float('nan'):9.1f}")
+
+    if tracemalloc.is_tracing() and top_allocations:
+        print(f"\n   Largest live allocations:")
+        for stat in tracemalloc.take_snapshot().statistics('lineno')[:top_allocations]:
+            frame = stat.traceback[0]
+            print(f"   {stat.size / 1024 / 1024:8.1f} MB  {os.path.basename(frame.filename)}:{frame.lineno}")
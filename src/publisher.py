@@ -0,0 +1,261 @@
+import config
+import os
+import json
+import time
+import queue
+import shutil
+import hashlib
+import posixpath
+import threading
+import concurrent.futures
+
+from lazy import LazyModule
+
+paramiko = LazyModule('paramiko')
+
+# Remote record of the published files' hashes, kept next to the report
+MANIFEST_NAME = '.publish_manifest.json'
+
+def file_digest(path):
+    """
+    SHA-256 of a local file.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class LocalSFTPClient:
+    """
+    Stand-in for paramiko's SFTPClient over a local directory (remote paths are
+    resolved under root). Lets the publisher be exercised without a server.
+    """
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, remote_path):
+        return os.path.join(self.root, remote_path.lstrip('/'))
+
+    def put(self, localpath, remotepath, callback=None, confirm=True):
+        shutil.copyfile(localpath, self._path(remotepath))
+        return self.stat(remotepath)
+
+    def stat(self, path):
+        return os.stat(self._path(path))
+
+    def open(self, filename, mode='r'):
+        return open(self._path(filename), mode)
+
+    def mkdir(self, path):
+        os.mkdir(self._path(path))
+
+    def posix_rename(self, oldpath, newpath):
+        os.replace(self._path(oldpath), self._path(newpath))
+
+    def rename(self, oldpath, newpath):
+        os.rename(self._path(oldpath), self._path(newpath))
+
+    def remove(self, path):
+        os.remove(self._path(path))
+
+    def close(self):
+        pass
+
+class Publisher:
+    """
+    Uploads report files over one SSH connection with a small pool of SFTP
+    channels. Files whose hash matches the remote manifest are skipped, and
+    each upload goes to a temporary name and is renamed into place, so readers
+    never see a half-written file.
+    """
+    def __init__(self, host=config.HOST, user=config.USER, port=config.PUBLISH_PORT, key_filename=config.PUBLISH_KEY_FILE,
+                 channels=config.PUBLISH_CHANNELS, client_factory=None):
+        self.host = host
+        self.user = user
+        self.port = port
+        self.key_filename = key_filename
+        self.channels = channels
+        self.client_factory = client_factory # e.g. lambda: LocalSFTPClient(root)
+        self.connect_ms = 0.0
+        self._ssh = None
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._connecting = None
+        self._remote_dirs = set()
+
+    def is_connected(self):
+        if self.client_factory is not None:
+            return True
+        transport = self._ssh.get_transport() if self._ssh else None
+        return transport is not None and transport.is_active()
+
+    def connect(self):
+        """
+        Open the SSH connection unless a live one is already pooled. The host
+        key must be known (~/.ssh/known_hosts).
+        """
+        with self._lock:
+            if self.is_connected():
+                return self
+            self.close()
+            start_time = time.perf_counter()
+            ssh = paramiko.SSHClient()
+            ssh.load_system_host_keys()
+            ssh.set_missing_host_key_policy(paramiko.RejectPolicy())
+            ssh.connect(hostname=self.host, port=self.port, username=self.user, key_filename=self.key_filename, look_for_keys=True, timeout=10)
+            ssh.get_transport().set_keepalive(30)
+            self._ssh = ssh
+            self.connect_ms = (time.perf_counter() - start_time) * 1000
+        return self
+
+    def connect_async(self):
+        """
+        Connect in the background (e.g. while the report is being built); publish() waits for it.
+        """
+        if self._connecting is None or self._connecting.done():
+            self._connecting = concurrent.futures.ThreadPoolExecutor(max_workers=1).submit(self.connect)
+        return self
+
+    def close(self):
+        while not self._idle.empty():
+            self._idle.get_nowait().close()
+        if self._ssh is not None:
+            self._ssh.close()
+            self._ssh = None
+        self._remote_dirs.clear()
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self.client_factory() if self.client_factory is not None else self._ssh.open_sftp()
+
+    def _release(self, sftp):
+        self._idle.put(sftp)
+
+    def _makedirs(self, sftp, remote_dir):
+        if remote_dir in self._remote_dirs or remote_dir in ('', '/'):
+            return
+        try:
+            sftp.stat(remote_dir)
+        except IOError:
+            self._makedirs(sftp, posixpath.dirname(remote_dir))
+            sftp.mkdir(remote_dir)
+        self._remote_dirs.add(remote_dir)
+
+    def _swap_in(self, sftp, temp_path, remote_path):
+        try:
+            sftp.posix_rename(temp_path, remote_path)
+        except IOError: # Server without the posix-rename extension
+            try:
+                sftp.remove(remote_path)
+            except IOError:
+                pass
+            sftp.rename(temp_path, remote_path)
+
+    def _upload(self, local_path, remote_path):
+        """
+        Upload to a temporary name next to the target, then rename into place.
+        Returns the bytes sent and the latency in ms.
+        """
+        sftp = self._acquire()
+        try:
+            start_time = time.perf_counter()
+            temp_path = f"{remote_path}.part-{os.getpid()}"
+            sftp.put(local_path, temp_path, confirm=True)
+            self._swap_in(sftp, temp_path, remote_path)
+            return os.path.getsize(local_path), (time.perf_counter() - start_time) * 1000
+        finally:
+            self._release(sftp)
+
+    def _read_manifest(self, sftp, manifest_path):
+        try:
+            with sftp.open(manifest_path, 'r') as f:
+                return json.loads(f.read())
+        except (IOError, ValueError):
+            return {}
+
+    def _write_manifest(self, sftp, manifest_path, manifest):
+        temp_path = f"{manifest_path}.part-{os.getpid()}"
+        with sftp.open(temp_path, 'w') as f:
+            f.write(json.dumps(manifest, indent=1, sort_keys=True))
+        self._swap_in(sftp, temp_path, manifest_path)
+
+    def publish(self, uploads):
+        """
+        Upload (local path, remote path) pairs. Unchanged files (same hash in
+        the remote manifest and same remote size) are skipped. All but the last
+        pair go up concurrently; the last one (the page referencing the others)
+        is swapped in after them. Returns the upload stats.
+        """
+        start_time = time.perf_counter()
+        if self._connecting is not None:
+            self._connecting.result()
+        self.connect()
+
+        manifest_path = posixpath.join(posixpath.dirname(uploads[-1][1]), MANIFEST_NAME)
+        digests = {remote_path: file_digest(local_path) for local_path, remote_path in uploads}
+
+        sftp = self._acquire()
+        try:
+            manifest = self._read_manifest(sftp, manifest_path)
+            pending = []
+            for local_path, remote_path in uploads:
+                if manifest.get(remote_path) == digests[remote_path]:
+                    try:
+                        if sftp.stat(remote_path).st_size == os.path.getsize(local_path):
+                            continue
+                    except IOError:
+                        pass
+                pending.append((local_path, remote_path))
+            for remote_dir in sorted({posixpath.dirname(remote_path) for _, remote_path in pending}):
+                self._makedirs(sftp, remote_dir)
+        finally:
+            self._release(sftp)
+
+        latency = {}
+        sent = 0
+        final = [upload for upload in pending if upload == uploads[-1]]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.channels) as pool:
+            futures = {pool.submit(self._upload, *upload): upload[1] for upload in pending if upload not in final}
+            for future in concurrent.futures.as_completed(futures):
+                size, ms = future.result()
+                sent += size
+                latency[futures[future]] = ms
+        for local_path, remote_path in final:
+            size, ms = self._upload(local_path, remote_path)
+            sent += size
+            latency[remote_path] = ms
+
+        if pending:
+            sftp = self._acquire()
+            try:
+                self._write_manifest(sftp, manifest_path, {**manifest, **digests})
+            finally:
+                self._release(sftp)
+
+        stats = {
+            'uploaded': len(pending),
+            'skipped': len(uploads) - len(pending),
+            'bytes': sent,
+            'latency_ms': latency,
+            'connect_ms': self.connect_ms,
+            'elapsed_ms': (time.perf_counter() - start_time) * 1000,
+        }
+        slowest = max(latency.values()) if latency else 0
+        print(f"✅ Published {stats['uploaded']} files ({sent / 1024:,.0f} KB) in {stats['elapsed_ms']:.0f} ms "
+              f"(connect {self.connect_ms:.0f} ms, slowest file {slowest:.0f} ms); skipped {stats['skipped']} unchanged")
+        return stats
+
+# Connection reused by every publish in this process
+_publisher = None
+
+def get_publisher():
+    """
+    The process-wide publisher for the configured host.
+    """
+    global _publisher
+    if _publisher is None:
+        _publisher = Publisher()
+    return _publisher
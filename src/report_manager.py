@@ -1,66 +1,468 @@
 import config
 import os
+import time
+import json
+import gzip
+import pickle
+import base64
+import hashlib
+import urllib.request
+import numpy as np
+import pandas as pd
 from pathlib import Path
 from datetime import datetime
-from jinja2 import Environment, FileSystemLoader
 
-def create_report(figs, df_alloc, df_trades, output_dir=config.OUTPUT_DIR):
+import profiler
+from lazy import LazyModule
+
+pio = LazyModule('plotly.io')
+plotly_offline = LazyModule('plotly.offline')
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Report figures and their default heights, in template order
+FIGURE_HEIGHTS = {
+    "wealth": '500px',
+    "drawdown": '300px',
+    "returns": '500px',
+    "alloc": '500px',
+    "monthly": '400px',
+    "quant": '1600px',
+    "risk": '450px',
+    "exposure": '800px',
+}
+TABLE_CLASSES = 'display compact stripe hover order-column row-border'
+PLOTLY_CONFIG = {'responsive': True, 'displayModeBar': True}
+
+# Tables longer than this use virtual scrolling instead of pages
+TABLE_SCROLL_ROWS = 1000
+
+# Arrays shorter than this stay inline in the figure JSON
+MIN_SHARED_LENGTH = 16
+
+# JS typed array names for the dtypes stored in the shared data block
+TYPED_ARRAYS = {np.dtype('float64'): 'f8', np.dtype('int32'): 'i4', np.dtype('uint8'): 'u1', np.dtype('uint16'): 'u2'}
+
+# Bump when the fragment format changes so cached fragments are rebuilt
+FRAGMENT_VERSION = 2
+
+# Pinned third-party assets in load order: (file name, CDN URL). plotly.js is
+# taken from the installed plotly package so it always matches the figures.
+VENDOR_STYLES = [
+    ('jquery.dataTables-1.13.4.min.css', 'https://cdn.datatables.net/1.13.4/css/jquery.dataTables.min.css'),
+    ('responsive.dataTables-2.4.1.min.css', 'https://cdn.datatables.net/responsive/2.4.1/css/responsive.dataTables.min.css'),
+    ('scroller.dataTables-2.1.1.min.css', 'https://cdn.datatables.net/scroller/2.1.1/css/scroller.dataTables.min.css'),
+]
+VENDOR_SCRIPTS = [
+    ('jquery-3.6.0.min.js', 'https://code.jquery.com/jquery-3.6.0.min.js'),
+    ('jquery.dataTables-1.13.4.min.js', 'https://cdn.datatables.net/1.13.4/js/jquery.dataTables.min.js'),
+    ('dataTables.responsive-2.4.1.min.js', 'https://cdn.datatables.net/responsive/2.4.1/js/dataTables.responsive.min.js'),
+    ('dataTables.scroller-2.1.1.min.js', 'https://cdn.datatables.net/scroller/2.1.1/js/dataTables.scroller.min.js'),
+]
+
+# Rendered section fragments (section -> (fingerprint, fragment, build_ms)) and the compiled template
+_fragment_cache = {}
+_template_cache = {}
+
+class SharedDataBlock:
+    """
+    Every unique array used by the report figures and tables, keyed by content
+    hash. Arrays are referenced from the figure/table JSON as {"$ref": digest}
+    and decoded in the page into typed arrays (dates as epoch ms, strings as
+    category codes).
+    """
+    def __init__(self):
+        self.arrays = {}
+        self.requested = 0
+
+    def _store(self, kind, data, extra=None):
+        raw = data.tobytes()
+        digest = hashlib.blake2b(kind.encode() + data.dtype.str.encode() + json.dumps(extra).encode() + raw, digest_size=8).hexdigest()
+        self.requested += 1
+        if digest not in self.arrays:
+            self.arrays[digest] = ({'kind': kind, 'dtype': TYPED_ARRAYS[data.dtype], 'length': len(data), **(extra or {})}, raw)
+        return {'$ref': digest}
+
+    def add(self, values):
+        """
+        Store a 1-D array and return its reference, or None to keep it inline.
+        """
+        if isinstance(values, dict) and 'bdata' in values: # Plotly's own base64 encoding
+            if 'shape' in values and ',' in str(values['shape']):
+                return None # 2-D (heatmap z) stays inline
+            values = np.frombuffer(base64.b64decode(values['bdata']), dtype=values['dtype'])
+        values = np.asarray(values)
+        if values.ndim != 1 or len(values) < MIN_SHARED_LENGTH:
+            return None
+
+        kind = values.dtype.kind
+        if kind == 'M':
+            ms = values.astype('datetime64[ms]')
+            data = ms.astype('int64').astype('float64')
+            data[np.isnat(ms)] = np.nan
+            return self._store('date', data)
+        if kind == 'b':
+            return self._store('num', values.astype('uint8'))
+        if kind in 'iu':
+            fits = values.min() >= np.iinfo('int32').min and values.max() <= np.iinfo('int32').max
+            return self._store('num', values.astype('int32' if fits else 'float64'))
+        if kind == 'f':
+            return self._store('num', values.astype('float64'))
+        if kind in 'OU' and all(isinstance(v, str) for v in values):
+            categories, codes = np.unique(values.astype(str), return_inverse=True)
+            dtype = 'uint8' if len(categories) <= 256 else 'uint16' if len(categories) <= 65536 else 'int32'
+            return self._store('cat', codes.astype(dtype), {'categories': categories.tolist()})
+        return None
+
+    def share(self, node):
+        """
+        Replace every shareable array inside a figure/table spec with its reference.
+        """
+        if isinstance(node, dict):
+            if 'bdata' in node:
+                return self.add(node) or node
+            return {key: self.share(value) for key, value in node.items()}
+        if isinstance(node, (np.ndarray, pd.Index, pd.Series)) or (isinstance(node, (list, tuple)) and node and not isinstance(node[0], (dict, list, tuple))):
+            return self.add(node) or node
+        if isinstance(node, (list, tuple)):
+            return [self.share(value) for value in node]
+        return node
+
+    def payload(self):
+        """
+        Index (JSON, digest -> dtype/offset/length) and the gzip-compressed,
+        base64-encoded buffer of all arrays.
+        """
+        index = {}
+        chunks = []
+        offset = 0
+        for digest, (entry, raw) in self.arrays.items():
+            padding = -offset % 8 # Typed array views need aligned offsets
+            chunks.append(b'\0' * padding + raw)
+            offset += padding
+            index[digest] = {**entry, 'offset': offset}
+            offset += len(raw)
+        buffer = gzip.compress(b''.join(chunks), compresslevel=6)
+        return {'compressed': True, 'arrays': index}, base64.b64encode(buffer).decode('ascii')
+
+def _json_text(obj):
+    """
+    JSON safe to embed in a script tag.
+    """
+    with profiler.span('plotly_json'):
+        return pio.json.to_json_plotly(obj).replace('</', '<\\/')
+
+def _fingerprint(*parts):
+    """
+    Content hash of nested dicts/lists/arrays/DataFrames.
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+
+    def feed(node):
+        if isinstance(node, dict):
+            for key in sorted(node, key=str):
+                hasher.update(str(key).encode())
+                feed(node[key])
+        elif isinstance(node, pd.DataFrame):
+            hasher.update(repr(list(node.columns)).encode() + repr(list(node.dtypes)).encode())
+            hasher.update(pd.util.hash_pandas_object(node, index=False).to_numpy().tobytes())
+        elif isinstance(node, np.ndarray) and node.dtype.kind != 'O':
+            hasher.update(node.dtype.str.encode() + repr(node.shape).encode() + np.ascontiguousarray(node).tobytes())
+        elif isinstance(node, (list, tuple, np.ndarray)):
+            hasher.update(b'[')
+            for value in node:
+                feed(value)
+            hasher.update(b']')
+        else:
+            hasher.update(repr(node).encode())
+
+    for part in parts:
+        feed(part)
+    return hasher.hexdigest()
+
+def build_figure_fragment(name, spec, shared_data):
+    """
+    Placeholder div + JSON spec (with shared array references) for one figure,
+    or a self-contained Plotly snippet when shared_data is off.
+    """
+    height = FIGURE_HEIGHTS[name]
+    if not shared_data:
+        html = pio.to_html(spec, full_html=False, include_plotlyjs=False, default_width='100%', default_height=height, config=PLOTLY_CONFIG,
+                           post_script="attachZoomLevels(document.getElementById('{plot_id}'));") # Defined in the template head
+        return {'html': html}
+
+    block = SharedDataBlock()
+    data = block.share(spec['data'])
+    return {
+        'html': f'<div id="figure-{name}" class="report-figure" style="height:{height}; width:100%;"></div>',
+        'json': _json_text({'data': data, 'layout': spec['layout'], 'config': PLOTLY_CONFIG}),
+        'arrays': block.arrays,
+        'references': block.requested,
+    }
+
+def format_table(df):
+    """
+    Copy of the table with the columns in df.attrs['formats'] rendered as strings.
+    """
+    formats = df.attrs.get('formats', {})
+    return df.assign(**{col: df[col].map(fmt.format) for col, fmt in formats.items() if col in df.columns})
+
+def build_table_fragment(table_id, df, shared_data):
+    """
+    Empty table + DataTables spec: columns in the shared block, number formats
+    (df.attrs['formats']) applied in the page, rows materialized in chunks and
+    drawn with deferred rendering / virtual scrolling. Plain HTML table with
+    Python-side formatting when shared_data is off.
+    """
+    if not shared_data:
+        return {'html': format_table(df).to_html(index=False, classes=TABLE_CLASSES, border=0, table_id=table_id)}
+
+    block = SharedDataBlock()
+    formats = df.attrs.get('formats', {})
+    columns = [block.share((df[c].astype(str) if df[c].dtype == object else df[c]).to_numpy()) for c in df.columns]
+    return {
+        'html': f'<table id="{table_id}" class="{TABLE_CLASSES}" style="width:100%"></table>',
+        'json': _json_text({
+            'titles': [str(c) for c in df.columns],
+            'formats': [formats.get(c) for c in df.columns],
+            'columns': columns,
+            'length': len(df),
+            'chunk': config.REPORT_TABLE_CHUNK_ROWS,
+            'scroll': len(df) > TABLE_SCROLL_ROWS,
+        }),
+        'arrays': block.arrays,
+        'references': block.requested,
+    }
+
+def render_section(section, fingerprint, build):
+    """
+    Cached fragment for the section if its fingerprint is unchanged (memory,
+    then disk), else build and cache it. Returns (fragment, rebuilt, build_ms).
+    """
+    cached = _fragment_cache.get(section)
+    cache_path = os.path.join(config.REPORT_CACHE_DIR, f"{section}.pkl")
+    if (cached is None or cached[0] != fingerprint) and os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'rb') as f:
+                cached = pickle.load(f)
+        except Exception as e:
+            print(f"Error loading cached report section {section}: {e}")
+
+    if cached is not None and cached[0] == fingerprint:
+        _fragment_cache[section] = cached
+        profiler.count('cache.report_fragment.hit')
+        return cached[1], False, cached[2]
+
+    profiler.count('cache.report_fragment.miss')
+    start_time = time.perf_counter()
+    with profiler.span('build_fragment', section=section):
+        fragment = build()
+    build_ms = (time.perf_counter() - start_time) * 1000
+
+    _fragment_cache[section] = (fingerprint, fragment, build_ms)
+    try:
+        with open(cache_path, 'wb') as f:
+            pickle.dump(_fragment_cache[section], f)
+    except Exception as e:
+        print(f"Error saving cached report section {section}: {e}")
+    return fragment, True, build_ms
+
+def get_template():
+    """
+    Compiled report template, cached for repeated runs in one process.
+    """
+    if 'report' not in _template_cache:
+        from jinja2 import Environment, FileSystemLoader
+        env = Environment(loader=FileSystemLoader(os.path.join(config.SRC_DIR, 'templates')), auto_reload=False)
+        _template_cache['report'] = env.get_template('report_template.html')
+    return _template_cache['report']
+
+# --- Assets ---
+def get_vendor_asset(name, url):
+    """
+    Contents of a pinned asset from the vendor directory, fetched once on first
+    use. None if it is neither vendored nor downloadable.
+    """
+    vendor_path = os.path.join(config.VENDOR_DIR, name)
+    if not os.path.exists(vendor_path):
+        try:
+            if name.startswith('plotly-'):
+                content = plotly_offline.get_plotlyjs().encode('utf-8')
+            else:
+                with urllib.request.urlopen(url, timeout=10) as response:
+                    content = response.read()
+            with open(vendor_path + '.tmp', 'wb') as f:
+                f.write(content)
+            os.replace(vendor_path + '.tmp', vendor_path)
+        except Exception as e:
+            print(f"Error vendoring {name}: {e}")
+            return None
+    with open(vendor_path, 'rb') as f:
+        return f.read()
+
+def write_precompressed(path):
+    """
+    gzip (and brotli, if installed) copies next to the file, for hosts that
+    serve precompressed variants. Returns the paths written.
+    """
+    with open(path, 'rb') as f:
+        raw = f.read()
+    variants = [(path + '.gz', gzip.compress(raw, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append((path + '.br', brotli.compress(raw, quality=11)))
+    for variant_path, data in variants:
+        with open(variant_path, 'wb') as f:
+            f.write(data)
+    return [variant_path for variant_path, _ in variants]
+
+def _asset_tag(kind, src=None, content=None):
+    if kind == 'css':
+        if src:
+            return f'<link rel="stylesheet" type="text/css" href="{src}">'
+        return '<style>' + content.decode('utf-8').replace('</style', '<\\/style') + '</style>'
+    if src:
+        return f'<script charset="utf-8" src="{src}"></script>'
+    return '<script>' + content.decode('utf-8').replace('</script', '<\\/script') + '</script>'
+
+def get_asset_html(mode, output_dir, precompress=config.REPORT_PRECOMPRESS):
+    """
+    Tags for the stylesheets, plotly.js and the table scripts. "cdn" links the
+    public CDNs, "inline" embeds the vendored files and "split" writes them to
+    output_dir/assets under content-hashed names (never rewritten, so the host
+    can cache them forever). Assets that cannot be vendored fall back to the CDN.
+    Returns the tags by position and the asset files the page references.
+    """
+    plotly_version = plotly_offline.get_plotlyjs_version()
+    assets = (
+        [('css', 'head_css', name, url) for name, url in VENDOR_STYLES]
+        + [('js', 'plotlyjs', f'plotly-{plotly_version}.min.js', f'https://cdn.plot.ly/plotly-{plotly_version}.min.js')]
+        + [('js', 'body_js', name, url) for name, url in VENDOR_SCRIPTS]
+    )
+
+    tags = {'head_css': [], 'plotlyjs': [], 'body_js': []}
+    files = []
+    for kind, position, name, url in assets:
+        content = get_vendor_asset(name, url) if mode in ('inline', 'split') else None
+        if content is None:
+            tags[position].append(_asset_tag(kind, src=url))
+        elif mode == 'inline':
+            tags[position].append(_asset_tag(kind, content=content))
+        else:
+            stem, ext = name.rsplit('.', 1)
+            hashed_name = f"{stem}.{hashlib.blake2b(content, digest_size=5).hexdigest()}.{ext}"
+            asset_path = os.path.join(output_dir, 'assets', hashed_name)
+            if not os.path.exists(asset_path):
+                os.makedirs(os.path.dirname(asset_path), exist_ok=True)
+                with open(asset_path, 'wb') as f:
+                    f.write(content)
+                if precompress:
+                    write_precompressed(asset_path)
+            files += [asset_path] + [asset_path + suffix for suffix in ('.gz', '.br') if os.path.exists(asset_path + suffix)]
+            tags[position].append(_asset_tag(kind, src=f'assets/{hashed_name}'))
+
+    return {position: "\n    ".join(position_tags) for position, position_tags in tags.items()}, files
+
+def create_report(figs, df_alloc, df_trades, df_risk=None, df_execution=None, output_dir=config.OUTPUT_DIR, shared_data=config.REPORT_SHARED_DATA,
+                  assets=config.REPORT_ASSETS, precompress=config.REPORT_PRECOMPRESS):
+    """
+    Render the HTML report, reusing every figure/table fragment whose inputs
+    are unchanged since the last run. Returns the report path and build stats
+    (including the asset files and precompressed variants written).
+    """
+    start_time = time.perf_counter()
     current_date = datetime.now().strftime('%Y-%m-%d')
     current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-    summary_data = figs["summary"] 
-    plotly_config = {'responsive': True, 'displayModeBar': True}   
-    
-    wealth_html = figs["wealth"].to_html(
-        full_html=False, include_plotlyjs='cdn',
-        default_width='100%', default_height='500px', config=plotly_config
-    )
-    drawdown_html = figs["drawdown"].to_html(
-        full_html=False, include_plotlyjs=False,
-        default_width='100%', default_height='300px', config=plotly_config
-    )
-    returns_html = figs["returns"].to_html(
-        full_html=False, include_plotlyjs=False,
-        default_width='100%', default_height='500px', config=plotly_config
-    )
-    alloc_html = figs["alloc"].to_html(
-        full_html=False, include_plotlyjs=False,
-        default_width='100%', default_height='500px', config=plotly_config
-    )
-    quant_html = figs["quant"].to_html(
-        full_html=False, include_plotlyjs=False,
-        default_width='100%', default_height='800px', config=plotly_config
-    )
+    summary_data = figs["summary"]
+    tables = {
+        'alloc_table': df_alloc,
+        'risk_table': df_risk,
+        'execution_table': df_execution,
+        'trades_table': df_trades,
+    }
+
+    stats = {'rebuilt': [], 'reused': [], 'saved_ms': 0.0}
+    figure_fragments = {}
+    table_fragments = {}
+    for name in FIGURE_HEIGHTS:
+        if name not in figs:
+            continue
+        with profiler.span('figure_to_dict', figure=name):
+            spec = figs[name] if isinstance(figs[name], dict) else figs[name].to_plotly_json() # Process-pool figures arrive as dicts
+        fingerprint = _fingerprint(FRAGMENT_VERSION, shared_data, FIGURE_HEIGHTS[name], spec)
+        figure_fragments[name], rebuilt, build_ms = render_section(name, fingerprint, lambda: build_figure_fragment(name, spec, shared_data))
+        stats['rebuilt' if rebuilt else 'reused'].append(name)
+        stats['saved_ms'] += 0 if rebuilt else build_ms
+    for table_id, df in tables.items():
+        if df is None or df.empty:
+            continue
+        fingerprint = _fingerprint(FRAGMENT_VERSION, shared_data, df, df.attrs.get('formats', {}), config.REPORT_TABLE_CHUNK_ROWS)
+        table_fragments[table_id], rebuilt, build_ms = render_section(table_id, fingerprint, lambda: build_table_fragment(table_id, df, shared_data))
+        stats['rebuilt' if rebuilt else 'reused'].append(table_id)
+        stats['saved_ms'] += 0 if rebuilt else build_ms
+
+    # Shared mode: the merged array block and the figure/table specs
+    data_scripts = []
+    if shared_data:
+        block = SharedDataBlock()
+        for fragment in list(figure_fragments.values()) + list(table_fragments.values()):
+            block.arrays.update(fragment['arrays'])
+            block.requested += fragment['references']
+        index, buffer = block.payload()
+        data_scripts += [
+            f'<script type="application/json" id="report-data-index">{_json_text(index)}</script>',
+            f'<script type="application/octet-stream" id="report-data">{buffer}</script>',
+            '<script type="application/json" id="report-figures">{' + ','.join(f'"{name}":{fragment["json"]}' for name, fragment in figure_fragments.items()) + '}</script>',
+            '<script type="application/json" id="report-tables">{' + ','.join(f'"{table_id}":{fragment["json"]}' for table_id, fragment in table_fragments.items()) + '}</script>',
+        ]
+        stats.update(arrays=len(block.arrays), references=block.requested, block_kb=len(buffer) / 1024)
+
+    figure_html = {name: figure_fragments[name]['html'] if name in figure_fragments else "" for name in FIGURE_HEIGHTS}
+    table_html = {table_id: table_fragments[table_id]['html'] if table_id in table_fragments else "" for table_id in tables}
+
+    with profiler.span('report_assets', mode=assets):
+        asset_html, stats['assets'] = get_asset_html(assets, output_dir, precompress=precompress)
 
-    # Create interactive tables
-    alloc_table_html = df_alloc.to_html(
-        index=False, classes='display compact stripe hover order-column row-border', 
-        border=0, table_id='alloc_table'
-    )
-    trades_table_html = df_trades.to_html(
-        index=False, classes='display compact stripe hover order-column row-border', 
-        border=0, table_id='trades_table'
-    )
-    
-    templates_dir = os.path.join(config.SRC_DIR, 'templates')
-    env = Environment(loader=FileSystemLoader(templates_dir))
-    template = env.get_template('report_template.html')
-    
     # Render template
-    html_output = template.render(
-        current_time=current_time,
-        summary=summary_data,
-        wealth_html=wealth_html,
-        drawdown_html=drawdown_html,
-        returns_html=returns_html,
-        alloc_html=alloc_html,
-        alloc_table_html=alloc_table_html,
-        quant_html=quant_html,
-        trades_table_html=trades_table_html
-    )
-    
+    with profiler.span('render_template'):
+        html_output = get_template().render(
+            current_time=current_time,
+            summary=summary_data,
+            plotlyjs_html=asset_html['plotlyjs'],
+            vendor_css_html=asset_html['head_css'],
+            vendor_js_html=asset_html['body_js'],
+            wealth_html=figure_html["wealth"],
+            drawdown_html=figure_html["drawdown"],
+            returns_html=figure_html["returns"],
+            alloc_html=figure_html["alloc"],
+            alloc_table_html=table_html["alloc_table"],
+            quant_html=figure_html["quant"],
+            monthly_html=figure_html["monthly"],
+            trades_table_html=table_html["trades_table"],
+            risk_html=figure_html["risk"],
+            exposure_html=figure_html["exposure"],
+            risk_table_html=table_html["risk_table"],
+            execution_table_html=table_html["execution_table"],
+            report_data_html="\n".join(data_scripts)
+        )
+
     output_path = os.path.join(output_dir, f"portfolio_report_{current_date}.html")
     with open(output_path, 'w', encoding='utf-8') as f:
         f.write(html_output)
-        
-    return output_path
+
+    with profiler.span('precompress'):
+        stats['variants'] = write_precompressed(output_path) if precompress else []
+
+    stats['elapsed_ms'] = (time.perf_counter() - start_time) * 1000
+    stats['size_kb'] = len(html_output.encode('utf-8')) / 1024
+    if shared_data:
+        print(f"✅ Built report ({stats['size_kb']:,.0f} KB) in {stats['elapsed_ms']:.0f} ms; shared data block: {stats['arrays']} unique of {stats['references']} arrays, {stats['block_kb']:,.0f} KB")
+    else:
+        print(f"✅ Built report ({stats['size_kb']:,.0f} KB) in {stats['elapsed_ms']:.0f} ms")
+    if stats['variants']:
+        print("✅ Precompressed report: " + ", ".join(f"{os.path.splitext(path)[1][1:]} {os.path.getsize(path) / 1024:,.0f} KB" for path in stats['variants']))
+
+    return output_path, stats
@@ -0,0 +1,241 @@
+import config
+import os
+import time
+import pickle
+import numpy as np
+import pandas as pd
+
+import portfolio_analyzer as analyzer
+import profiler
+from lazy import LazyModule
+
+yf = LazyModule('yfinance')
+
+# Proxies for symbols without price history inside a scenario window
+SECTOR_ETF = {
+    'Technology': 'XLK',
+    'Financial Services': 'XLF',
+    'Healthcare': 'XLV',
+    'Consumer Cyclical': 'XLY',
+    'Consumer Defensive': 'XLP',
+    'Energy': 'XLE',
+    'Industrials': 'XLI',
+    'Utilities': 'XLU',
+    'Real Estate': 'XLRE',
+    'Basic Materials': 'XLB',
+    'Communication Services': 'XLC',
+}
+CATEGORY_PROXY = {
+    'US Broad Market': 'SPY',
+    'International Equity': 'VEU',
+    'Treasury Bonds': 'IEF',
+    'Corporate Bonds': 'LQD',
+    'Other Fixed Income': 'AGG',
+    'Commodities': 'GLD',
+}
+DEFAULT_PROXY = 'SPY'
+
+SCENARIO_PRICES_FILE = os.path.join(config.DATA_DIR, "scenario_prices.pkl")
+
+# Number of worst calendar months shown next to the named scenarios
+WORST_MONTHS_SHOWN = 5
+
+def get_proxy_chain(sym, category, sector):
+    """
+    Proxies to try, in order, when a symbol has no history in a scenario window.
+    """
+    chain = [SECTOR_ETF.get(sector), CATEGORY_PROXY.get(category), DEFAULT_PROXY]
+    return [p for p in dict.fromkeys(chain) if p and p != sym]
+
+def fetch_scenario_prices(symbols, update=True):
+    """
+    Long adjusted-close history for holdings, proxies and factors, cached on disk.
+    Only symbols missing from the cache are downloaded in full; cached ones are
+    extended from their last date.
+    """
+    cached = pd.DataFrame()
+    if os.path.exists(SCENARIO_PRICES_FILE):
+        try:
+            with open(SCENARIO_PRICES_FILE, 'rb') as f:
+                cached = pickle.load(f)
+        except Exception as e:
+            print(f"Error loading scenario price cache: {e}")
+    profiler.count('cache.scenario_prices.hit', sum(s in cached.columns for s in symbols))
+    profiler.count('cache.scenario_prices.miss', sum(s not in cached.columns for s in symbols))
+
+    if not update:
+        return cached.reindex(columns=[s for s in symbols if s in cached.columns])
+
+    start = min([pd.Timestamp(s) for s, _ in config.STRESS_SCENARIOS.values()] + [pd.Timestamp(config.STRESS_MONTHLY_SINCE)])
+    start = start - pd.Timedelta(days=10)
+    missing = [s for s in symbols if s not in cached.columns]
+    frames = [cached]
+
+    try:
+        if missing:
+            profiler.count('network.yfinance')
+            full = yf.download(missing, start=start, progress=False, auto_adjust=True, group_by="column")["Close"]
+            if isinstance(full, pd.Series):
+                full = full.to_frame(name=missing[0])
+            frames.append(full)
+        if not cached.empty:
+            profiler.count('network.yfinance')
+            recent = yf.download(list(cached.columns), start=cached.index.max() - pd.Timedelta(days=5), progress=False, auto_adjust=True, group_by="column")["Close"]
+            if isinstance(recent, pd.Series):
+                recent = recent.to_frame(name=cached.columns[0])
+            frames.append(recent)
+    except Exception as e:
+        print(f"Error downloading scenario prices: {e}")
+
+    prices = pd.concat(frames, axis=1) if len(frames) > 1 else cached
+    prices = prices.T.groupby(level=0).last().T # Newest download wins per symbol
+    prices = prices.groupby(level=0).last().sort_index()
+
+    try:
+        with open(SCENARIO_PRICES_FILE, 'wb') as f:
+            pickle.dump(prices, f)
+    except Exception as e:
+        print(f"Error saving scenario price cache: {e}")
+
+    return prices.reindex(columns=[s for s in symbols if s in prices.columns])
+
+def get_scenario_windows(prices):
+    """
+    Named stress windows plus every complete calendar month in the price history.
+    Returns a DataFrame indexed by scenario name with Type, Start and End.
+    """
+    rows = [
+        {'Scenario': name, 'Type': 'Historical', 'Start': pd.Timestamp(start), 'End': pd.Timestamp(end)}
+        for name, (start, end) in config.STRESS_SCENARIOS.items()
+    ]
+
+    if not prices.empty:
+        first = max(pd.Timestamp(config.STRESS_MONTHLY_SINCE), prices.index.min())
+        months = pd.period_range(first, prices.index.max(), freq='M')[:-1] # Skip the month in progress
+        rows += [
+            {'Scenario': str(month), 'Type': 'Month', 'Start': month.start_time - pd.Timedelta(days=1), 'End': month.end_time.normalize()}
+            for month in months
+        ]
+
+    return pd.DataFrame(rows).set_index('Scenario')
+
+def build_historical_returns(prices, windows):
+    """
+    Scenario x symbol return matrix: close on/before End over close on/before Start.
+    NaN where the symbol has no price at either end of the window.
+    """
+    prices = prices.sort_index().ffill()
+    values = prices.to_numpy(dtype=float)
+    values = np.vstack([np.full((1, values.shape[1]), np.nan), values]) # Row 0: before history
+
+    start_rows = prices.index.searchsorted(windows['Start'].to_numpy(), side='right')
+    end_rows = prices.index.searchsorted(windows['End'].to_numpy(), side='right')
+
+    returns = values[end_rows] / values[start_rows] - 1
+    return pd.DataFrame(returns, index=windows.index, columns=prices.columns)
+
+def apply_proxies(returns, holdings, categories, sectors):
+    """
+    Fill each holding's missing scenario returns from its proxy chain.
+    Returns the filled holdings matrix and the number of scenarios proxied per symbol.
+    """
+    filled = pd.DataFrame(index=returns.index)
+    proxied = {}
+    for sym in holdings:
+        column = returns[sym] if sym in returns.columns else pd.Series(np.nan, index=returns.index)
+        n_missing = int(column.isna().sum())
+        for proxy in get_proxy_chain(sym, categories.get(sym), sectors.get(sym)):
+            if not column.isna().any():
+                break
+            if proxy in returns.columns:
+                column = column.fillna(returns[proxy])
+        filled[sym] = column.fillna(0)
+        if n_missing:
+            proxied[sym] = n_missing
+    return filled, proxied
+
+def build_factor_returns(prices, holdings, categories, sectors, lookback=252):
+    """
+    Factor scenarios: regress the holdings' recent daily returns on the factor
+    proxies (one least-squares solve for every holding) and map each
+    user-defined shock through the betas.
+    """
+    factors = {name: sym for name, sym in config.FACTOR_PROXIES.items() if sym in prices.columns}
+    if not factors or not config.FACTOR_SHOCKS:
+        return pd.DataFrame(columns=holdings)
+
+    daily = prices.sort_index().ffill().pct_change(fill_method=None).iloc[-lookback:]
+    factor_returns = daily[list(factors.values())].fillna(0).to_numpy()
+    holding_returns, _ = apply_proxies(daily, holdings, categories, sectors)
+
+    design = np.column_stack([np.ones(len(factor_returns)), factor_returns])
+    betas = np.linalg.lstsq(design, holding_returns.to_numpy(), rcond=None)[0][1:] # Drop the intercept
+
+    shocks = pd.DataFrame(config.FACTOR_SHOCKS).T.reindex(columns=list(factors.keys())).fillna(0)
+    return pd.DataFrame(shocks.to_numpy() @ betas, index=shocks.index, columns=holdings)
+
+def run_scenarios(current_values, scenario_returns):
+    """
+    Revalue the book under every scenario with one matrix product of the
+    scenario return matrix and the holdings value vector.
+    """
+    holdings = list(scenario_returns.columns)
+    value_vector = np.array([current_values[sym] for sym in holdings], dtype=float)
+    total_value = sum(current_values.values())
+
+    returns = scenario_returns.to_numpy()
+    pnl = returns @ value_vector
+    contributions = returns * value_vector
+    worst = np.argmin(contributions, axis=1) if holdings else np.zeros(len(returns), dtype=int)
+
+    return pd.DataFrame({
+        'PnL': pnl,
+        'PnL_Pct': pnl / total_value if total_value else np.nan,
+        'Worst_Holding': [holdings[i] for i in worst] if holdings else None,
+        'Worst_Holding_PnL': contributions[np.arange(len(returns)), worst] if holdings else np.nan,
+    }, index=scenario_returns.index)
+
+def run_stress_test(portfolio_tracker, current_values, update=True):
+    """
+    Stress the current book (from get_allocation) across the historical windows,
+    every calendar month and the user-defined factor shocks.
+    Returns the scenarios ranked from worst to best.
+    """
+    holdings = [sym for sym in current_values if sym != 'CASH'] # Cash has a 0 return in every scenario
+    categories, sectors = analyzer.classify_assets(holdings, portfolio_tracker.asset_info)
+
+    proxies = {p for sym in holdings for p in get_proxy_chain(sym, categories.get(sym), sectors.get(sym))}
+    symbols = list(dict.fromkeys(holdings + sorted(proxies) + list(config.FACTOR_PROXIES.values())))
+    prices = fetch_scenario_prices(symbols, update=update)
+    if prices.empty:
+        print("No scenario price history available")
+        return pd.DataFrame()
+
+    start_time = time.perf_counter()
+
+    windows = get_scenario_windows(prices)
+    historical, proxied = apply_proxies(build_historical_returns(prices, windows), holdings, categories, sectors)
+    factor = build_factor_returns(prices, holdings, categories, sectors)
+
+    scenario_returns = pd.concat([historical, factor])
+    results = run_scenarios(current_values, scenario_returns)
+    results.insert(0, 'Type', list(windows['Type']) + ['Factor'] * len(factor))
+    results.insert(1, 'Start', list(windows['Start']) + [pd.NaT] * len(factor))
+    results.insert(2, 'End', list(windows['End']) + [pd.NaT] * len(factor))
+
+    elapsed_ms = (time.perf_counter() - start_time) * 1000
+    print(f"✅ Evaluated {len(results)} stress scenarios in {elapsed_ms:.1f} ms")
+    if proxied:
+        print(f"Proxied scenario returns: {proxied}")
+
+    return results.sort_values('PnL')
+
+def get_scenario_table(results):
+    """
+    Ranked table for the report: named historical and factor scenarios plus the worst months.
+    """
+    if results is None or results.empty:
+        return results
+    months = results[results['Type'] == 'Month'].head(WORST_MONTHS_SHOWN)
+    named = results[results['Type'] != 'Month']
+    return pd.concat([named, months]).sort_values('PnL')
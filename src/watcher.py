@@ -0,0 +1,117 @@
+import config
+import gc
+import os
+import ctypes
+import signal
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+import profiler
+import portfolio_analyzer as analyzer
+import report_manager
+
+# US equity session (exchange holidays are not modelled; a refresh on one is just a no-op download)
+MARKET_TZ = ZoneInfo('America/New_York')
+MARKET_OPEN = time(9, 30)
+MARKET_CLOSE = time(16, 0)
+
+# --- Market schedule ---
+def is_market_open(now):
+    now = now.astimezone(MARKET_TZ)
+    return now.weekday() < 5 and MARKET_OPEN <= now.time() < MARKET_CLOSE
+
+def last_close(now, delay_minutes=config.WATCH_CLOSE_DELAY_MINUTES):
+    """
+    The latest weekday close (plus the settle delay) at or before now.
+    """
+    now = now.astimezone(MARKET_TZ)
+    day = now.date()
+    while True:
+        close = datetime.combine(day, MARKET_CLOSE, MARKET_TZ) + timedelta(minutes=delay_minutes)
+        if day.weekday() < 5 and close <= now:
+            return close
+        day -= timedelta(days=1)
+
+def refresh_due(last_refresh, now, interval_minutes=config.WATCH_REFRESH_MINUTES):
+    """
+    Market data is refreshed every interval while the market is open and once
+    after each close; nights and weekends need nothing new.
+    """
+    if last_refresh is None:
+        return True
+    if is_market_open(now):
+        return now - last_refresh >= timedelta(minutes=interval_minutes)
+    return last_refresh < last_close(now)
+
+# --- Trade file ---
+class FileWatcher:
+    """
+    Polls a file's size and mtime. A change is only reported once the file
+    has stopped changing for one poll, so a half-saved workbook is not read.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.signature = self._stat()
+        self._pending = self.signature
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+            return stat.st_size, stat.st_mtime_ns
+        except (OSError, TypeError):
+            return None
+
+    def changed(self):
+        signature = self._stat()
+        settled = signature == self._pending
+        self._pending = signature
+        if settled and signature is not None and signature != self.signature:
+            self.signature = signature
+            return True
+        return False
+
+# --- Memory ---
+def clear_analysis_caches():
+    """
+    Drop the benchmark prices and period returns before a rebuild. Both are
+    keyed by date, so a refresh later the same day would otherwise reuse the
+    day's first benchmark download.
+    """
+    analyzer._benchmark_cache.clear()
+    analyzer._period_returns_cache.clear()
+
+def evict_caches():
+    """
+    Drop the in-memory caches that are cheap to rebuild (benchmark prices,
+    period returns, rendered report sections, which stay on disk) and hand
+    the freed memory back to the OS.
+    """
+    clear_analysis_caches()
+    report_manager._fragment_cache.clear()
+    gc.collect()
+    try:
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except (OSError, AttributeError): # Not glibc
+        pass
+
+def enforce_memory_limit(limit_mb=config.WATCH_MEMORY_LIMIT_MB):
+    """
+    Evict the caches when resident memory is over the ceiling. Returns True if it did.
+    """
+    before = profiler.rss_mb()
+    if before is None or before <= limit_mb:
+        return False
+    evict_caches()
+    print(f"♻️ Memory {before:,.0f} MB over the {limit_mb:,} MB ceiling; evicted caches, now {profiler.rss_mb():,.0f} MB")
+    return True
+
+# --- Shutdown ---
+def install_shutdown_handlers(stop):
+    """
+    SIGINT/SIGTERM set the stop event, so the loop finishes its current step and flushes.
+    """
+    def handle(signum, frame):
+        print(f"\n🛑 Received {signal.Signals(signum).name}, shutting down...")
+        stop.set()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, handle)
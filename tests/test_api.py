@@ -0,0 +1,52 @@
+import json
+import socket
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import api
+
+def _status(response):
+    head, _, body = response.partition(b'\r\n\r\n')
+    return int(head.split(b' ', 2)[1]), body
+
+@pytest.fixture
+def server():
+    return api.ApiServer(api.ApiState(), port=0)
+
+def _publish(server):
+    index = pd.bdate_range('2024-01-01', periods=5)
+    server.state.update(portfolio=pd.DataFrame({'Total_Equity': np.linspace(100, 104, 5)}, index=index), metrics={'sharpe_ratio': 1.0})
+
+def test_error_responses(server):
+    assert _status(server.respond('POST', '/api/portfolio', {}))[0] == 405
+    assert _status(server.respond('GET', '/nope', {}))[0] == 404
+    status, body = _status(server.respond('GET', '/api/portfolio', {}))
+    assert status == 503 and json.loads(body) == {'error': 'No data published yet'}
+
+    _publish(server)
+    assert _status(server.respond('GET', '/api/portfolio', {}))[0] == 200
+    assert _status(server.respond('GET', '/api/unknown', {}))[0] == 404
+    assert _status(server.respond('GET', '/api/portfolio?format=xml', {}))[0] == 400
+    assert _status(server.respond('GET', '/api/portfolio?columns=bogus', {}))[0] == 400
+    assert _status(server.respond('GET', '/api/portfolio?start=notadate', {}))[0] == 400
+    if not api.ARROW_AVAILABLE:
+        assert _status(server.respond('GET', '/api/portfolio.arrow', {}))[0] == 406
+
+def test_malformed_request_line(server):
+    server.start()
+    try:
+        with socket.create_connection((server.host, server.port), timeout=5) as conn:
+            conn.sendall(b'garbage\r\n\r\n')
+            assert _status(conn.recv(65536))[0] == 400
+    finally:
+        server.stop()
+
+def test_start_raises_when_port_in_use(server):
+    server.start()
+    try:
+        with pytest.raises(OSError):
+            api.ApiServer(api.ApiState(), port=server.port).start()
+    finally:
+        server.stop()
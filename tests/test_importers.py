@@ -0,0 +1,53 @@
+import datetime
+
+import pandas as pd
+
+import data_manager
+import importers
+
+def _trade_history():
+    """
+    Trades as the ledger exports them to trade_history.csv, with days above 12
+    so a day-first misread shows up as a wrong or rejected date.
+    """
+    return data_manager.clean_trade_df(pd.DataFrame({
+        'DATE': ['05/01/2024', '13/02/2024', '13/02/2024', '28/03/2024'],
+        'MARKET': ['US', 'US', 'US', 'US'],
+        'SYMBOL': ['CASH', 'AAPL', 'MSFT', 'AAPL'],
+        'BUY/SELL': ['DEPOSIT', 'BUY', 'BUY', 'SELL'],
+        'QTY': [1, 10, 5, 4],
+        'PRICE': [5000.0, 185.5, 405.25, 171.0],
+        'FEE': [0.0, 1.0, 1.0, 1.0],
+    }))
+
+def test_iso_csv_round_trip(tmp_path):
+    trades = _trade_history()
+    data_manager.export_trade_csv(trades, str(tmp_path))
+    target = str(tmp_path / 'imported_trades.csv')
+
+    stats = importers.import_statement(str(tmp_path / 'trade_history.csv'), target=target)
+    assert stats['imported'] == len(trades) and stats['errors'] == 0
+
+    imported = data_manager.get_trade_df(target)
+    assert imported['DATE'].tolist() == [datetime.date(2024, 1, 5), datetime.date(2024, 2, 13), datetime.date(2024, 2, 13), datetime.date(2024, 3, 28)]
+    pd.testing.assert_frame_equal(imported[trades.columns].reset_index(drop=True), trades.reset_index(drop=True), check_dtype=False)
+
+    # Importing the same file again adds nothing
+    assert importers.import_statement(str(tmp_path / 'trade_history.csv'), target=target)['imported'] == 0
+
+def test_identical_fills_are_kept(tmp_path):
+    # Two identical partial fills on one day are two trades, across chunks too
+    statement = tmp_path / 'statement.csv'
+    statement.write_text("DATE,SYMBOL,BUY/SELL,QTY,PRICE,FEE\n"
+                         "2024-03-01,AAPL,Buy,10,180.0,1.0\n"
+                         "2024-03-01,AAPL,Buy,10,180.0,1.0\n"
+                         "2024-03-01,AAPL,Buy,10,180.0,1.0\n")
+    target = str(tmp_path / 'imported_trades.csv')
+
+    assert importers.import_statement(str(statement), target=target, chunk_rows=2)['imported'] == 3
+    assert importers.import_statement(str(statement), target=target, chunk_rows=2)['imported'] == 0
+
+    # A statement with one more copy adds just that one
+    statement.write_text(statement.read_text() + "2024-03-01,AAPL,Buy,10,180.0,1.0\n")
+    assert importers.import_statement(str(statement), target=target)['imported'] == 1
+    assert len(pd.read_csv(target)) == 4